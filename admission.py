@@ -0,0 +1,118 @@
+import asyncio
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+
+# Upstream LLM calls allowed in flight at once, per process
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "64"))
+# Calls allowed to queue for a slot before new turns are turned away.
+# Shedding happens when a turn is admitted, never halfway through one.
+LLM_MAX_WAITING = int(os.getenv("LLM_MAX_WAITING", "256"))
+# Seconds a shed client is told to wait before retrying
+LLM_RETRY_AFTER = int(os.getenv("LLM_RETRY_AFTER", "5"))
+
+
+class ServerBusy(Exception):
+    """Raised when the LLM wait queue is full and the request should be shed"""
+
+    def __init__(self, retry_after: int = LLM_RETRY_AFTER):
+        super().__init__("Server is busy, please retry shortly")
+        self.retry_after = retry_after
+
+
+class Admission:
+    """Global cap on concurrent LLM calls with a bounded wait queue (threaded servers)"""
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, max_waiting: int = LLM_MAX_WAITING):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+
+    def check(self) -> None:
+        """Shed a new turn up front instead of letting it pile onto a full queue"""
+        with self._lock:
+            if self.waiting >= self.max_waiting:
+                self.shed += 1
+                raise ServerBusy()
+
+    @contextmanager
+    def slot(self) -> Iterator[float]:
+        """Hold one LLM call slot, waiting for one if they are all taken; yields the seconds waited"""
+        started_at = time.monotonic()
+        with self._lock:
+            self.waiting += 1
+        try:
+            self._slots.acquire()
+        finally:
+            with self._lock:
+                self.waiting -= 1
+        with self._lock:
+            self.in_flight += 1
+        try:
+            yield time.monotonic() - started_at
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": self.in_flight,
+                "waiting": self.waiting,
+                "shed": self.shed,
+                "max_concurrent": self.max_concurrent,
+                "max_waiting": self.max_waiting
+            }
+
+
+class AsyncAdmission:
+    """Same policy as Admission for a single event loop"""
+
+    def __init__(self, max_concurrent: int = LLM_MAX_CONCURRENT, max_waiting: int = LLM_MAX_WAITING):
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self._slots = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+
+    def check(self) -> None:
+        """Shed a new turn up front instead of letting it pile onto a full queue"""
+        if self.waiting >= self.max_waiting:
+            self.shed += 1
+            raise ServerBusy()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Hold one LLM call slot, waiting for one if they are all taken; yields the seconds waited"""
+        started_at = time.monotonic()
+        if self._slots is None:
+            # Created lazily so it binds to the serving loop
+            self._slots = asyncio.Semaphore(self.max_concurrent)
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        try:
+            yield time.monotonic() - started_at
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "shed": self.shed,
+            "max_concurrent": self.max_concurrent,
+            "max_waiting": self.max_waiting
+        }
@@ -1,477 +1,2063 @@
-from flask import Flask, request, jsonify, render_template
-import os
-import json
-from openai import OpenAI
-from typing import Dict, List, Any, Optional
-from dotenv import load_dotenv
-from flask_cors import CORS
-import random
-import re
-
-app = Flask(__name__)
-CORS(app)
-app.secret_key = os.urandom(24)  # Secret key for session management
-
-load_dotenv()
-# Configure OpenAI
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-# Load environment variables from .env file
-# load_dotenv()
-
-# Game state management
-class GameState:
-    def __init__(self):
-        self.current_scene = "start"
-        self.inventory = []
-        self.player_stats = {"health": 100, "courage": 50, "wisdom": 50}
-        self.visited_locations = []
-        self.story_flags = {}
-        self.story_context = (
-            "You are the survivor of a catastrophic quantum breach. Now altered with unstable powers, "
-            "you’ve been taken into SHIELD custody. Nick Fury believes you’re the only one who can stop "
-            "a multiverse collapse — the fate of the Marvel Universe is in your hands."
-        )
-        
-    def to_dict(self) -> Dict[str, Any]:
-        return {
-            "current_scene": self.current_scene,
-            "inventory": self.inventory,
-            "player_stats": self.player_stats,
-            "visited_locations": self.visited_locations,
-            "story_flags": self.story_flags,
-            "story_context": self.story_context
-        }
-    
-    def from_dict(self, data: Dict[str, Any]) -> None:
-        self.current_scene = data.get("current_scene", "start")
-        self.inventory = data.get("inventory", [])
-        self.player_stats = data.get("player_stats", {"health": 100, "courage": 50, "wisdom": 50})
-        self.visited_locations = data.get("visited_locations", [])
-        self.story_flags = data.get("story_flags", {})
-        self.story_context = data.get(
-            "story_context",
-            "You are the survivor of a catastrophic quantum breach. Now altered with unstable powers, "
-            "you’ve been taken into SHIELD custody. Nick Fury believes you’re the only one who can stop "
-            "a multiverse collapse — the fate of the Marvel Universe is in your hands."
-        )
-
-
-# Game session management
-sessions = {}
-
-# Base story framework with key waypoints
-# This will be enhanced by AI-generated content
-story_framework = {
-    "start": {
-        "description": "You awaken in a secure SHIELD bunker. You're told you were caught in a quantum reactor accident and are now exhibiting abilities no one fully understands. Nick Fury left a message: the world needs you.",
-        "ai_prompt": "The protagonist awakens in a SHIELD bunker with newfound powers after a mysterious quantum accident. Nick Fury’s message urges them to prepare — something dangerous is brewing. Write a cinematic opening scene and offer 4 action-packed paths: test your powers, escape, contact Fury, or access the SHIELD mainframe."
-    },
-
-    "final_showdown": {
-        "description": "The battle has reached Stark Tower. A multiverse breach is tearing reality, and the villain stands at its heart. Only you — with your powers and your choices — can stop the collapse.",
-        "ai_prompt": "Atop Stark Tower, the multiverse breach expands. The villain harnesses unstable energy. The hero must act. Present 4 Marvel-style strategies: perhaps a sacrifice, a team-up, a tech gamble, or a morality test."
-    },
-
-    "tragic_ending": {
-        "description": "You made the ultimate sacrifice. The multiverse is safe, but your light is gone. Your story echoes through timelines.",
-        "ai_prompt": "The hero dies saving the multiverse. Write a powerful, emotional ending. Include reactions from iconic heroes and how the world remembers them."
-    },
-
-    "victorious_ending": {
-        "description": "Against all odds, you closed the breach and stopped the villain. The Avengers salute you — the newest legend.",
-        "ai_prompt": "The hero triumphs, saving the multiverse and proving themselves among the greats. Write a victorious Marvel-style ending with hints of new threats and growth."
-    }
-}
-
-
-def generate_ai_content(prompt: str, temperature: float = 0.7) -> str:
-    """Generate content using OpenAI's GPT-3.5 model"""
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Use the appropriate model
-            messages=[
-                {"role": "system", "content": "You are a cinematic narrator for a Marvel-style superhero adventure game called 'Marvel: Legacy Awakened'. Create action-packed, emotional, and immersive Marvel-like scenes. Let the player become a new hero in the Marvel Universe, interacting with elements like SHIELD, Stark tech, cosmic threats, and multiverse rifts. Make choices matter."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=temperature,
-            max_tokens=800,
-            top_p=1.0
-        )
-        return response.choices[0].message.content.strip()  # ✅ FIXED
-    except Exception as e:
-        print(f"Error calling OpenAI API: {str(e)}")
-        return "The journey continues... (Error generating content, please try again)"
-
-
-def generate_options(game_state: GameState, current_situation: str) -> List[Dict[str, str]]:
-    """Generate 4 options plus the 'other' option using the AI"""
-    
-    # Create a context-aware prompt for the AI
-    prompt = f"""
-    In the superhero adventure game 'Marvel: Legacy Awakened':
-
-    Current situation: {current_situation}
-
-    Game state:
-    - Current location: {game_state.current_scene}
-    - Inventory: {', '.join(game_state.inventory) if game_state.inventory else 'empty'}
-    - Player visited: {', '.join(game_state.visited_locations) if game_state.visited_locations else 'nowhere yet'}
-    - Player stats: Health {game_state.player_stats.get('health')}, Courage {game_state.player_stats.get('courage')}, Wisdom {game_state.player_stats.get('wisdom')}
-    - Story context: {game_state.story_context}
-
-    Based on this Marvel-style situation, generate EXACTLY 4 dramatic, cinematic choices.
-
-    Each choice must:
-    1. Be under 15 words
-    2. Feel heroic, risky, or clever
-    3. Be meaningfully distinct
-    4. Lead to a unique outcome or direction
-
-    Format exactly like:
-    1. Activate your repulsor cannon and blast the wall
-    2. Hack the Stark console to access intel
-    3. Call for backup using the SHIELD beacon
-    4. Fly through the breach before it closes
-"""
-
-    
-    try:
-        options_text = generate_ai_content(prompt, temperature=0.8)
-        
-        # Process the AI-generated options
-        options = []
-        
-        # Extract the numbered options from the AI response
-        for line in options_text.split('\n'):
-            match = re.match(r"^\d+[\.\:\)\-]\s+(.*)", line.strip())
-            if match:
-                option_text = match.group(1).strip()
-                scene_id = "scene_" + "_".join(option_text.lower().split()[:3]).replace("'", "").replace('"', '')
-                options.append({"text": option_text, "next_scene": scene_id})
-        
-        # Add the "Other" option where player can input their own choice
-        options.append({"text": "Other (write your own action)", "next_scene": "custom_action"})
-        
-        # If we somehow don't have 5 options, generate a fallback set
-        if len(options) < 5:
-            options = [
-                {"text": "Explore further ahead", "next_scene": "scene_explore_ahead"},
-                {"text": "Examine your surroundings carefully", "next_scene": "scene_examine_surroundings"},
-                {"text": "Rest and recover your strength", "next_scene": "scene_rest_recover"},
-                {"text": "Try a different approach", "next_scene": "scene_different_approach"},
-                {"text": "Other (write your own action)", "next_scene": "custom_action"}
-            ]
-        
-        return options
-    
-    except Exception as e:
-        print(f"Error generating options: {str(e)}")
-        # Fallback options if AI generation fails
-        return [
-            {"text": "Continue forward cautiously", "next_scene": "scene_continue_forward"},
-            {"text": "Look for an alternative path", "next_scene": "scene_alternative_path"},
-            {"text": "Take a moment to think", "next_scene": "scene_think"},
-            {"text": "Prepare for potential danger", "next_scene": "scene_prepare"},
-            {"text": "Other (write your own action)", "next_scene": "custom_action"}
-        ]
-    
-def generate_narrative(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
-    """
-    Generate narrative and scene details using OpenAI's GPT model for Marvel-style superhero storytelling.
-    """
-    current_scene = game_state.current_scene
-    visited = ", ".join(game_state.visited_locations) if game_state.visited_locations else "nowhere yet"
-    items = ", ".join(game_state.inventory) if game_state.inventory else "nothing"
-
-    # Create a detailed prompt for narrative generation
-    prompt = f"""
-    You are the storyteller for 'Marvel: Legacy Awakened', a cinematic superhero text adventure where the player takes on the role of a rising Marvel hero caught in a multiverse crisis.
-
-    Current game state:
-    - Current location: {current_scene}
-    - Player has visited: {visited}
-    - Player has in inventory: {items}
-    - Player stats: Health {game_state.player_stats.get('health')}, Courage {game_state.player_stats.get('courage')}, Wisdom {game_state.player_stats.get('wisdom')}
-    - Story context so far: {game_state.story_context}
-
-    Player just chose: "{choice}"
-
-    Additional context: {ai_prompt}
-
-    Generate a thrilling continuation of the story (about 2-4 paragraphs) that:
-    1. Reacts to the player's choice
-    2. Describes what happens next in cinematic, vivid Marvel-style detail
-    3. Builds tension and stakes fitting the superhero genre
-    4. Keeps the story immersive and fast-paced
-
-    Write in second person ("you") and present tense. Do NOT include choices at the end.
-    """
-
-    try:
-        narrative_text = generate_ai_content(prompt)
-
-        # Generate a short scene description
-        description_prompt = f"""
-        Based on this narrative, create a short scene description (max 3 sentences) that sets the stage visually:
-
-        {narrative_text}
-
-        The description should paint a clear Marvel-style cinematic moment.
-        """
-        scene_description = generate_ai_content(description_prompt, temperature=0.6)
-
-        # Update story context
-        context_prompt = f"""
-        Summarize the following event in 1-2 sentences to add to the story context:
-
-        Previous context: {game_state.story_context}
-        New event: Player chose "{choice}" which led to: {narrative_text}
-        """
-        new_context = generate_ai_content(context_prompt, temperature=0.5)
-        game_state.story_context += " " + new_context
-
-        # Determine if this is an ending
-        ending_prompt = f"""
-        Does the following narrative represent the end of the adventure?
-
-        Clues to look for:
-        - Has the player saved or failed the mission?
-        - Did they face final consequences or resolution?
-        - Is this the climax or conclusion of their journey?
-
-        Narrative: {narrative_text}
-        Story context: {game_state.story_context}
-
-        Respond with ONLY ONE word:
-        - "continue"
-        - "victory"
-        - "defeat"
-        """
-        ending_decision = generate_ai_content(ending_prompt, temperature=0.4).strip().lower()
-
-        is_ending = False
-        ending_type = None
-        if "victory" in ending_decision:
-            ending_type = "victorious_ending"
-            is_ending = True
-        elif "defeat" in ending_decision:
-            ending_type = "tragic_ending"
-            is_ending = True
-
-        # Generate options or final ending
-        if is_ending:
-            scene_data = story_framework.get(ending_type, {})
-            ending_narrative = generate_ai_content(scene_data.get("ai_prompt", "Create a satisfying superhero ending."))
-            return {
-                "narrative": narrative_text + "\n\n" + ending_narrative,
-                "scene_description": scene_description,
-                "options": [{"text": "Start a new adventure", "next_scene": "start"}],
-                "is_ending": True
-            }
-        else:
-            options = generate_options(game_state, narrative_text)
-            return {
-                "narrative": narrative_text,
-                "scene_description": scene_description,
-                "options": options,
-                "is_ending": False
-            }
-
-    except Exception as e:
-        print(f"Error in narrative generation: {str(e)}")
-        return {
-            "narrative": "Something went wrong in your Marvel journey, but your mission continues...",
-            "scene_description": "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
-            "options": generate_options(game_state, "The hero faces the unknown."),
-            "is_ending": False
-        }
-
-
-@app.route('/start_game', methods=['POST'])
-def start_game():
-    """Initialize a new Marvel superhero game session"""
-    session_id = os.urandom(16).hex()
-    game_state = GameState()
-    sessions[session_id] = game_state
-
-    # Get the initial scene from story framework
-    scene_data = story_framework.get(game_state.current_scene)
-
-    # Generate the opening scene
-    result = generate_narrative(
-        game_state,
-        "begin your hero's journey",
-        scene_data.get("ai_prompt", "Create an action-packed opening for a Marvel superhero origin.")
-    )
-
-    return jsonify({
-        "session_id": session_id,
-        "narrative": result["narrative"],
-        "scene_description": result["scene_description"],
-        "options": result["options"],
-        "game_state": game_state.to_dict()
-    })
-
-
-@app.route('/make_choice', methods=['POST'])
-def make_choice():
-    """Process player choice and advance the story"""
-    data = request.get_json()
-    session_id = data.get("session_id")
-    choice_index = data.get("choice_index", 0)
-    custom_action = data.get("custom_action", "")
-    
-    if not session_id or session_id not in sessions:
-        return jsonify({"error": "Invalid session"}), 400
-    
-    game_state = sessions[session_id]
-    
-    # Get current options
-    current_options = data.get("current_options", [])
-    if not current_options:
-        return jsonify({"error": "No options provided"}), 400
-    
-    # Handle the choice
-    if choice_index >= len(current_options):
-        return jsonify({"error": "Invalid choice index"}), 400
-    
-    chosen_option = current_options[choice_index]
-    chosen_text = chosen_option.get("text", "Unknown choice")
-    next_scene = chosen_option.get("next_scene", "")
-    
-    # For custom actions (the "Other" option)
-    if next_scene == "custom_action" and custom_action:
-        chosen_text = custom_action
-        # Generate a scene ID for the custom action
-        next_scene = "scene_custom_" + str(len(game_state.visited_locations))
-    
-    # Update game state
-    game_state.visited_locations.append(game_state.current_scene)
-    game_state.current_scene = next_scene
-    
-    # Generate narrative based on choice
-    ai_prompt = f"The player chose to {chosen_text}. Continue the adventure based on this choice, creating a detailed and atmospheric scene."
-    
-    result = generate_narrative(
-        game_state,
-        chosen_text,
-        ai_prompt
-    )
-    
-    # Check if this is an ending
-    if result.get("is_ending", False):
-        # Reset certain game state aspects while preserving session
-        game_state.inventory = []
-        game_state.visited_locations = []
-        game_state.current_scene = "start"
-    
-    return jsonify({
-        "narrative": result["narrative"],
-        "scene_description": result["scene_description"],
-        "options": result["options"],
-        "game_state": game_state.to_dict(),
-        "is_ending": result.get("is_ending", False)
-    })
-
-@app.route('/custom_action', methods=['POST'])
-def custom_action():
-    """Process a custom player action"""
-    data = request.get_json()
-    session_id = data.get("session_id")
-    custom_action = data.get("custom_action", "")
-    
-    if not session_id or session_id not in sessions or not custom_action:
-        return jsonify({"error": "Invalid session or missing custom action"}), 400
-    
-    game_state = sessions[session_id]
-    
-    # Update game state
-    game_state.visited_locations.append(game_state.current_scene)
-    game_state.current_scene = f"scene_custom_{len(game_state.visited_locations)}"
-    
-    # Generate narrative based on custom action
-    ai_prompt = f"The player chose a custom action: '{custom_action}'. Create an engaging continuation of the story based on this unexpected action."
-    
-    result = generate_narrative(
-        game_state,
-        custom_action,
-        ai_prompt
-    )
-    
-    return jsonify({
-        "narrative": result["narrative"],
-        "scene_description": result["scene_description"],
-        "options": result["options"],
-        "game_state": game_state.to_dict(),
-        "is_ending": result.get("is_ending", False)
-    })
-
-@app.route('/save_game', methods=['POST'])
-def save_game():
-    """Save the current game state"""
-    data = request.get_json()
-    session_id = data.get("session_id")
-    
-    if not session_id or session_id not in sessions:
-        return jsonify({"error": "Invalid session"}), 400
-    
-    game_state = sessions[session_id]
-    
-    # In a real implementation, you would save this to a database
-    # For demonstration, we'll just return the serialized state
-    return jsonify({
-        "session_id": session_id,
-        "game_state": game_state.to_dict()
-    })
-
-@app.route("/", methods=["GET", "POST"])
-def index():
-    if request.method == "POST":
-        # handle form input or game logic
-        user_input = request.form.get("user_input", "")
-        prompt = f"{user_input}\nWhat happens next?"
-        ai_response = generate_ai_content(prompt)
-        return render_template("index.html", ai_output=ai_response)
-    
-    # Default GET request (first page load)
-    return render_template("index1.html", ai_output="Welcome to The Crystal Seeker!")
-
-
-@app.route('/load_game', methods=['POST'])
-def load_game():
-    """Load a saved game state"""
-    data = request.get_json()
-    session_id = data.get("session_id")
-    game_state_data = data.get("game_state")
-    
-    if not session_id or not game_state_data:
-        return jsonify({"error": "Invalid session or game state"}), 400
-    
-    # Create a new game state and populate it
-    game_state = GameState()
-    game_state.from_dict(game_state_data)
-    sessions[session_id] = game_state
-    
-    # Generate options for the current state
-    ai_prompt = "The player has returned to the game. Remind them of their current situation and provide options."
-    
-    result = generate_narrative(
-        game_state,
-        "continue the adventure",
-        ai_prompt
-    )
-    
-    return jsonify({
-        "session_id": session_id,
-        "narrative": result["narrative"],
-        "scene_description": result["scene_description"],
-        "options": result["options"],
-        "game_state": game_state.to_dict()
-    })
-
-@app.route('/health')
-def health():
-    return jsonify({"status": "ok"})
-
-if __name__ == '__main__':
+from flask import Flask, Response, request, jsonify, render_template, stream_with_context
+import os
+import copy
+import json
+import hashlib
+import functools
+from openai import OpenAI, DefaultHttpxClient
+import httpx
+from typing import Dict, Iterator, List, Any, Optional, Tuple
+from dotenv import load_dotenv
+from flask_cors import CORS
+import random
+import re
+import sys
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar, copy_context
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from admission import Admission, ServerBusy
+from compression import COMPRESS_MIN_BYTES, choose_encoding, compress, compress_stream, compressible
+from ending_classifier import EndingClassifier, classify_ending, normalize_verdict
+from llm_backend import LLM_BACKEND, FakeOpenAI
+from llm_traffic import LLMTraffic, ReplayMiss, response as reused_response
+from metrics import AdmissionGauges, Registry, Timeline, current_timeline, span, timeline
+from model_routing import MODEL_ROUTES, UNSENT_OUTCOMES, ModelRouter, is_overloaded, load_routing_config
+from resilience import Attempt, Resilience
+from scene_cache import SceneCache
+from scene_index import SceneIndex
+from session_store import SessionBusy, make_session_store
+from snapshot import SnapshotError, Snapshots
+from speculation import Speculator
+from state_sync import state_delta
+from story_context import StoryContext
+from warm_pool import WarmPool
+
+app = Flask(__name__)
+CORS(app)
+app.secret_key = os.urandom(24)  # Secret key for session management
+
+load_dotenv()
+# Configure OpenAI
+# Upstream connection pool and request timeout, shared by every call
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+# The SDK's own retries stack on top of resilience.py's budgeted ones, so they default to off
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "0"))
+
+
+def openai_pool_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+        keepalive_expiry=30.0
+    )
+
+
+if LLM_BACKEND == "fake":
+    # Offline and deterministic, for load tests and benchmarks
+    client = FakeOpenAI()
+else:
+    client = OpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=DefaultHttpxClient(limits=openai_pool_limits())
+    )
+# Caps concurrent LLM calls; routes shed new turns with a 503 when the queue is full
+admission = Admission()
+# Which model, token budget, temperature and timeout each stage's calls use
+model_router = ModelRouter(load_routing_config(MODEL_ROUTES))
+# Deadlines, retries, hedging and the circuit breaker; hedges only go out while nothing is queueing
+resilience = Resilience(spare_capacity=lambda: admission.stats()["waiting"] == 0)
+# Record/replay of LLM traffic (LLM_TRAFFIC_MODE) and the response cache for identical requests
+llm_traffic = LLMTraffic()
+# Load environment variables from .env file
+# load_dotenv()
+
+# Opening premise every story starts from
+DEFAULT_STORY_CONTEXT = (
+    "You are the survivor of a catastrophic quantum breach. Now altered with unstable powers, "
+    "you’ve been taken into SHIELD custody. Nick Fury believes you’re the only one who can stop "
+    "a multiverse collapse — the fate of the Marvel Universe is in your hands."
+)
+
+
+# Visited scene ids a session keeps for prompts and clients; older ones are only counted
+VISITED_LOCATIONS_KEPT = int(os.getenv("VISITED_LOCATIONS_KEPT", "32"))
+
+# Player stats in their fixed order, and where every session starts
+STAT_NAMES = ("health", "courage", "wisdom")
+DEFAULT_STATS = (100, 50, 50)
+
+# GameState fields for replays and deltas, which saves don't show and clients can't set
+SERVER_FIELDS = ("last_choice", "last_delta", "synced")
+
+
+def state_field(data: Dict[str, Any], key: str, kind: Any, default: Any, items: Any = None) -> Any:
+    """
+    data[key], or `default` when it's missing; a ValueError when it isn't a
+    `kind` (or, for lists, has an element that isn't an `items`), so a
+    malformed save is rejected instead of failing halfway through loading.
+    """
+    value = data.get(key, default)
+    if not isinstance(value, kind) or (items is not None and not all(isinstance(item, items) for item in value)):
+        raise ValueError(f"game state field {key!r} has the wrong type")
+    return value
+
+
+# Game state management
+class GameState:
+    """
+    One player's session, kept compact since a server holds many at once.
+
+    Slotted, with scene ids interned so every session shares them, the
+    stats as a fixed-layout tuple of ints and the inventory as a tuple, so
+    sessions at the defaults share them too. Only the latest
+    VISITED_LOCATIONS_KEPT visited scenes are kept, the older ones counted
+    in visited_dropped. Story flags are only allocated once set, and the
+    story context shares the default premise. to_dict() and from_dict()
+    keep the plain-dict layout saves and stores have always used.
+    """
+
+    __slots__ = (
+        "current_scene", "_inventory", "_stats", "_visited", "visited_dropped", "_story_flags", "context",
+        "last_turn", "turn", "last_choice", "last_delta", "synced"
+    )
+
+    def __init__(self):
+        self.current_scene = "start"
+        self._inventory = ()
+        self._stats = DEFAULT_STATS
+        self._visited = []
+        # Visited scenes dropped from the front of _visited to keep it bounded
+        self.visited_dropped = 0
+        self._story_flags = None
+        self.context = StoryContext(DEFAULT_STORY_CONTEXT)
+        # What the player is looking at: narrative, scene description and options, so a save can resume it
+        self.last_turn = None
+        # Sequence number of that turn; choices carry it back, so a resubmitted one replays instead of replaying the LLM
+        self.turn = 0
+        # The choice that led to it, and what it changed in public_dict() for clients one turn behind
+        self.last_choice = None
+        self.last_delta = None
+        # Fingerprints of public_dict() as of `turn`, to work out the next delta from
+        self.synced = None
+
+    @property
+    def inventory(self) -> List[str]:
+        return list(self._inventory)
+
+    @inventory.setter
+    def inventory(self, items: List[str]) -> None:
+        self._inventory = tuple(items)
+
+    @property
+    def player_stats(self) -> Dict[str, int]:
+        return dict(zip(STAT_NAMES, self._stats))
+
+    @player_stats.setter
+    def player_stats(self, stats: Dict[str, Any]) -> None:
+        try:
+            values = tuple(int(stats.get(name, default)) for name, default in zip(STAT_NAMES, DEFAULT_STATS))
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError(f"player_stats must map {', '.join(STAT_NAMES)} to integers")
+        self._stats = DEFAULT_STATS if values == DEFAULT_STATS else values
+
+    @property
+    def story_flags(self) -> Dict[str, Any]:
+        if self._story_flags is None:
+            self._story_flags = {}
+        return self._story_flags
+
+    @story_flags.setter
+    def story_flags(self, flags: Dict[str, Any]) -> None:
+        self._story_flags = dict(flags) if flags else None
+
+    @property
+    def visited_locations(self) -> List[str]:
+        """The latest visited scene ids, oldest first; move to a scene with visit()"""
+        return self._visited
+
+    @visited_locations.setter
+    def visited_locations(self, scenes: List[str]) -> None:
+        self._visited = [sys.intern(scene) for scene in scenes]
+        self.visited_dropped = 0
+        self._trim_visited()
+
+    @property
+    def visited_count(self) -> int:
+        """Scenes visited this story, including the dropped ones"""
+        return self.visited_dropped + len(self._visited)
+
+    def visit(self, next_scene: str) -> None:
+        """Leave the current scene for `next_scene`"""
+        self._visited.append(self.current_scene)
+        self.current_scene = sys.intern(next_scene)
+        self._trim_visited()
+
+    def _trim_visited(self) -> None:
+        # Drop the oldest half at once rather than one per turn, so between
+        # drops clients keep receiving the list as appends, not in full
+        if len(self._visited) > VISITED_LOCATIONS_KEPT:
+            dropped = len(self._visited) - VISITED_LOCATIONS_KEPT // 2
+            del self._visited[:dropped]
+            self.visited_dropped += dropped
+
+    @property
+    def story_context(self) -> str:
+        """The token-budgeted context that goes into every prompt"""
+        return self.context.render()
+
+    def add_context(self, event: str) -> None:
+        self.context.add(event)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "current_scene": self.current_scene,
+            "inventory": list(self._inventory),
+            "player_stats": self.player_stats,
+            "visited_locations": self._visited,
+            "visited_dropped": self.visited_dropped,
+            "story_flags": self._story_flags or {},
+            "story_context": self.story_context,
+            "context_tiers": self.context.to_dict(),
+            "last_turn": self.last_turn,
+            "turn": self.turn,
+            "last_choice": self.last_choice,
+            "last_delta": self.last_delta,
+            "synced": self.synced
+        }
+
+    def save_dict(self) -> Dict[str, Any]:
+        """to_dict() without the bookkeeping only this server uses, for the readable part of a save"""
+        data = self.to_dict()
+        for field in SERVER_FIELDS:
+            del data[field]
+        return data
+
+    def public_dict(self) -> Dict[str, Any]:
+        """
+        The part of the state clients show. The story context only feeds the
+        prompts and saves go through /save_game, so it stays on the server.
+        """
+        return {
+            "current_scene": self.current_scene,
+            "inventory": list(self._inventory),
+            "player_stats": self.player_stats,
+            "visited_locations": self._visited,
+            "story_flags": self._story_flags or {}
+        }
+
+    def advance(self, choice: Dict[str, Any]) -> None:
+        """Move on to the next turn, keeping the choice that got here and the delta clients need"""
+        self.last_delta, self.synced = state_delta(self.synced, self.public_dict())
+        self.last_choice = dict(choice, turn=self.turn)
+        self.turn += 1
+    
+    def from_dict(self, data: Dict[str, Any]) -> None:
+        """Load the to_dict() layout; ValueError if a field has the wrong type, e.g. in a client's save"""
+        if not isinstance(data, dict):
+            raise ValueError("game state must be an object")
+        self.current_scene = sys.intern(state_field(data, "current_scene", str, "start"))
+        self.inventory = state_field(data, "inventory", list, [], items=str)
+        self.player_stats = state_field(data, "player_stats", dict, {})
+        self.visited_locations = state_field(data, "visited_locations", list, [], items=str)
+        self.visited_dropped += max(0, state_field(data, "visited_dropped", int, 0))
+        self.story_flags = state_field(data, "story_flags", dict, {})
+        self.last_turn = state_field(data, "last_turn", (dict, type(None)), None)
+        self.turn = state_field(data, "turn", int, 0)
+        self.last_choice = state_field(data, "last_choice", (dict, type(None)), None)
+        self.last_delta = state_field(data, "last_delta", (dict, type(None)), None)
+        self.synced = state_field(data, "synced", (dict, type(None)), None)
+        if "context_tiers" in data:
+            tiers = state_field(data, "context_tiers", dict, {})
+            self.context = StoryContext(
+                DEFAULT_STORY_CONTEXT,
+                state_field(tiers, "summary", str, ""),
+                state_field(tiers, "recent", list, [], items=str)
+            )
+        else:
+            # Saves from before the context was tiered only carry the flat string
+            self.context = StoryContext.from_text(
+                DEFAULT_STORY_CONTEXT, state_field(data, "story_context", str, DEFAULT_STORY_CONTEXT)
+            )
+
+
+# Game session management
+session_store = make_session_store(GameState)
+
+# Base story framework with key waypoints
+# This will be enhanced by AI-generated content
+story_framework = {
+    "start": {
+        "description": "You awaken in a secure SHIELD bunker. You're told you were caught in a quantum reactor accident and are now exhibiting abilities no one fully understands. Nick Fury left a message: the world needs you.",
+        "ai_prompt": "The protagonist awakens in a SHIELD bunker with newfound powers after a mysterious quantum accident. Nick Fury’s message urges them to prepare — something dangerous is brewing. Write a cinematic opening scene and offer 4 action-packed paths: test your powers, escape, contact Fury, or access the SHIELD mainframe."
+    },
+
+    "final_showdown": {
+        "description": "The battle has reached Stark Tower. A multiverse breach is tearing reality, and the villain stands at its heart. Only you — with your powers and your choices — can stop the collapse.",
+        "ai_prompt": "Atop Stark Tower, the multiverse breach expands. The villain harnesses unstable energy. The hero must act. Present 4 Marvel-style strategies: perhaps a sacrifice, a team-up, a tech gamble, or a morality test."
+    },
+
+    "tragic_ending": {
+        "description": "You made the ultimate sacrifice. The multiverse is safe, but your light is gone. Your story echoes through timelines.",
+        "ai_prompt": "The hero dies saving the multiverse. Write a powerful, emotional ending. Include reactions from iconic heroes and how the world remembers them."
+    },
+
+    "victorious_ending": {
+        "description": "Against all odds, you closed the breach and stopped the villain. The Avengers salute you — the newest legend.",
+        "ai_prompt": "The hero triumphs, saving the multiverse and proving themselves among the greats. Write a victorious Marvel-style ending with hints of new threats and growth."
+    }
+}
+
+
+# What generate_ai_content returns when the API call fails
+AI_ERROR_TEXT = "The journey continues... (Error generating content, please try again)"
+
+# Token counts of the LLM calls made under track_usage(); None when nobody is counting
+llm_usage: ContextVar[Optional[List[int]]] = ContextVar("llm_usage", default=None)
+
+
+@contextmanager
+def track_usage() -> Iterator[List[int]]:
+    """Collect the total_tokens of every LLM call made in this context"""
+    meter: List[int] = []
+    token = llm_usage.set(meter)
+    try:
+        yield meter
+    finally:
+        llm_usage.reset(token)
+
+
+# Everything /metrics exposes for this process
+metrics_registry = Registry()
+llm_call_seconds = metrics_registry.histogram(
+    "llm_call_seconds", "Wall time of LLM calls, queue wait included", ("stage",)
+)
+llm_queue_wait_seconds = metrics_registry.histogram(
+    "llm_queue_wait_seconds", "Time LLM calls waited for an admission slot", ("stage",)
+)
+llm_first_token_seconds = metrics_registry.histogram(
+    "llm_first_token_seconds", "Time from starting a streamed LLM call to its first token", ("stage",)
+)
+llm_calls_total = metrics_registry.counter(
+    "llm_calls_total", "LLM calls by stage, model and outcome", ("stage", "model", "outcome")
+)
+llm_tokens_total = metrics_registry.counter(
+    "llm_tokens_total", "Tokens reported by response.usage", ("stage", "kind")
+)
+llm_cost_dollars_total = metrics_registry.counter(
+    "llm_cost_dollars_total", "Estimated USD spent on LLM calls", ("stage", "model")
+)
+turn_seconds = metrics_registry.histogram("turn_seconds", "Wall time of a turn by route", ("route",))
+turn_stage_seconds = metrics_registry.histogram(
+    "turn_stage_seconds", "Time a turn spent in each stage; fan-out stages overlap", ("route", "stage")
+)
+metrics_registry.gauge("llm_breaker_open", "1 while the LLM circuit breaker is failing calls fast",
+                       lambda: 0 if resilience.breaker.state == "closed" else 1)
+admission_gauges = AdmissionGauges(metrics_registry)
+admission_gauges.bind(admission)
+
+# Turns slower than this many seconds are logged with their stage timeline (0 = off)
+SLOW_TURN_SECONDS = float(os.getenv("SLOW_TURN_SECONDS", "0"))
+# Where slow turns go, one JSON object per line; empty means stdout
+SLOW_TURN_LOG = os.getenv("SLOW_TURN_LOG", "")
+slow_turn_log_lock = threading.Lock()
+
+
+def record_llm_call(stage: str, model: str, started_at: float, waited: float, usage: Any, outcome: str,
+                    first_token: Optional[float] = None) -> None:
+    """Account for one LLM call in the metrics, the router, the current turn's timeline and any usage meter"""
+    seconds = time.monotonic() - started_at
+    cost = model_router.record(stage, model, seconds, usage, outcome)
+    llm_calls_total.inc(stage=stage, model=model, outcome=outcome)
+    if outcome in ("short_circuited", "replay_miss"):
+        # Never answered, so there is no latency to observe
+        return
+    llm_call_seconds.observe(seconds, stage=stage)
+    llm_queue_wait_seconds.observe(waited, stage=stage)
+    if cost:
+        llm_cost_dollars_total.inc(cost, stage=stage, model=model)
+    details = {"llm": True, "model": model, "outcome": outcome, "queue_wait": round(waited, 4)}
+    if first_token is not None:
+        llm_first_token_seconds.observe(first_token, stage=stage)
+        details["first_token"] = round(first_token, 4)
+    if usage is not None and outcome not in UNSENT_OUTCOMES:
+        llm_tokens_total.inc(usage.prompt_tokens, stage=stage, kind="prompt")
+        llm_tokens_total.inc(usage.completion_tokens, stage=stage, kind="completion")
+        details["prompt_tokens"] = usage.prompt_tokens
+        details["completion_tokens"] = usage.completion_tokens
+        meter = llm_usage.get()
+        if meter is not None:
+            meter.append(usage.total_tokens)
+    turn = current_timeline.get()
+    if turn is not None:
+        turn.add(stage, started_at, seconds, **details)
+
+
+def finish_turn(turn: Timeline) -> None:
+    """Observe a finished turn's timings, and log its timeline if it was slow"""
+    seconds = time.monotonic() - turn.started_at
+    turn_seconds.observe(seconds, route=turn.route)
+    for stage, total in turn.stage_totals().items():
+        turn_stage_seconds.observe(total, route=turn.route, stage=stage)
+    if not SLOW_TURN_SECONDS or seconds < SLOW_TURN_SECONDS:
+        return
+    line = json.dumps(dict(turn.to_dict(seconds), at=time.strftime("%Y-%m-%dT%H:%M:%S")))
+    if not SLOW_TURN_LOG:
+        print(f"Slow turn: {line}")
+        return
+    try:
+        with slow_turn_log_lock, open(SLOW_TURN_LOG, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+    except OSError as e:
+        print(f"Error writing slow turn log {SLOW_TURN_LOG}: {str(e)}")
+
+
+def timed_turn(route: str):
+    """Time a turn route; a streamed response keeps its timeline until the stream ends"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with timeline(route) as turn:
+                response = view(*args, **kwargs)
+            if not turn.deferred:
+                finish_turn(turn)
+            return response
+        return wrapper
+    return decorator
+
+
+SYSTEM_PROMPT = "You are a cinematic narrator for a Marvel-style superhero adventure game called 'Marvel: Legacy Awakened'. Create action-packed, emotional, and immersive Marvel-like scenes. Let the player become a new hero in the Marvel Universe, interacting with elements like SHIELD, Stark tech, cosmic threats, and multiverse rifts. Make choices matter."
+
+
+def chat_messages(prompt: str) -> List[Dict[str, str]]:
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def request_llm(model: str, timeout: float, **request) -> Attempt:
+    """One request to one model, queued behind the admission limit; errors are returned, not raised"""
+    attempt = Attempt(model)
+    try:
+        with admission.slot() as attempt.waited:
+            attempt.response = client.chat.completions.create(model=model, timeout=timeout, **request)
+    except Exception as e:
+        attempt.error = e
+    attempt.seconds = time.monotonic() - attempt.started_at
+    return attempt
+
+
+def settle_llm_call(stage: str, attempt: Attempt, outcome: str) -> None:
+    """Account for one attempt of a stage's call once resilience.py has decided its outcome"""
+    if not attempt.ok and outcome != "short_circuited" and is_overloaded(attempt.error):
+        model_router.overloaded(attempt.model)
+    if outcome == "error":
+        print(f"Error calling OpenAI API ({stage}, {attempt.model}): {str(attempt.error)}")
+    record_llm_call(stage, attempt.model, attempt.started_at, attempt.waited,
+                    getattr(attempt.response, "usage", None), outcome)
+
+
+def reused_attempt(stage: str, request: Dict[str, Any]) -> Optional[Attempt]:
+    """
+    A call answered from the replayed recording or the response cache, or
+    None if it has to reach the backend. Its `seconds` are how long a replay
+    should take to answer.
+    """
+    if not llm_traffic.enabled:
+        return None
+    try:
+        reply = llm_traffic.lookup(stage, request)
+    except ReplayMiss as e:
+        print(f"Error replaying LLM call: {str(e)}")
+        return Attempt(model_router.chain(stage)[0], error=e)
+    if reply is None:
+        return None
+    attempt = Attempt(reply["model"])
+    attempt.response = reused_response(reply)
+    attempt.seconds = llm_traffic.delay(reply)
+    return attempt
+
+
+def record_reused_call(stage: str, attempt: Attempt) -> None:
+    """Account for a call reused_attempt() answered, once its reply has been served"""
+    if not attempt.ok:
+        outcome = "replay_miss"
+    else:
+        outcome = "replayed" if llm_traffic.mode == "replay" else "cached"
+    record_llm_call(stage, attempt.model, attempt.started_at, 0.0, getattr(attempt.response, "usage", None), outcome)
+
+
+def store_llm_reply(stage: str, request: Dict[str, Any], model: str, content: Optional[str], usage: Any,
+                    started_at: float, error: Optional[Exception] = None) -> None:
+    """Hand a call that reached the backend to the recording and the response cache"""
+    if llm_traffic.enabled:
+        llm_traffic.store(stage, request, model, content, usage, time.monotonic() - started_at, error)
+
+
+def store_llm_call(stage: str, request: Dict[str, Any], attempt: Attempt, started_at: float) -> None:
+    content = attempt.response.choices[0].message.content if attempt.ok else None
+    store_llm_reply(stage, request, attempt.model, content, getattr(attempt.response, "usage", None), started_at,
+                    attempt.error)
+
+
+def call_llm(stage: str, **request) -> Attempt:
+    """
+    A stage's call, down its model chain and retried, hedged and failed fast
+    by resilience.py, all within the stage's deadline. Replayed and cached
+    replies skip all of that.
+    """
+    attempt = reused_attempt(stage, request)
+    if attempt is not None:
+        time.sleep(attempt.seconds)
+        record_reused_call(stage, attempt)
+        return attempt
+    started_at = time.monotonic()
+    attempt = resilience.call(
+        stage, model_router.chain(stage), model_router.route(stage).timeout,
+        functools.partial(request_llm, **request), functools.partial(settle_llm_call, stage)
+    )
+    store_llm_call(stage, request, attempt, started_at)
+    return attempt
+
+
+def generate_ai_content(prompt: str, temperature: float = 0.7, stage: str = "other") -> str:
+    """Generate content with the stage's routed model; AI_ERROR_TEXT if every attempt failed"""
+    route = model_router.route(stage)
+    attempt = call_llm(
+        stage,
+        messages=chat_messages(prompt),
+        temperature=route.temperature_or(temperature),
+        max_tokens=route.max_tokens,
+        top_p=1.0
+    )
+    if not attempt.ok:
+        return AI_ERROR_TEXT
+    return attempt.response.choices[0].message.content.strip()  # ✅ FIXED
+
+
+def stream_ai_content(prompt: str, temperature: float = 0.7, stage: str = "other") -> Iterator[str]:
+    """
+    Stream content from the stage's routed model, yielding text deltas as they
+    arrive. Failures before the first token move down the model chain and
+    retry like any other call (streams are never hedged); after that, or once
+    the breaker is open, the error text ends the stream.
+    """
+    route = model_router.route(stage)
+    request = {
+        "messages": chat_messages(prompt),
+        "temperature": route.temperature_or(temperature),
+        "max_tokens": route.max_tokens,
+        "top_p": 1.0
+    }
+    reused = reused_attempt(stage, request)
+    if reused is not None:
+        # A replayed or cached reply arrives in one piece
+        time.sleep(reused.seconds)
+        record_reused_call(stage, reused)
+        yield reused.response.choices[0].message.content if reused.ok else AI_ERROR_TEXT
+        return
+    models = model_router.chain(stage)
+    give_up_at = time.monotonic() + route.timeout
+    number = 0
+    while True:
+        model = models[number % len(models)]
+        if not resilience.breaker.allow():
+            record_llm_call(stage, model, time.monotonic(), 0.0, None, "short_circuited")
+            yield AI_ERROR_TEXT
+            return
+        started_at = time.monotonic()
+        waited = 0.0
+        usage = None
+        first_token = None
+        outcome = "error"
+        pieces = []
+        try:
+            with admission.slot() as waited:
+                stream = client.chat.completions.create(
+                    model=model,
+                    # Bounds connecting and each read; a stream that keeps producing runs to the end
+                    timeout=give_up_at - time.monotonic(),
+                    stream=True,
+                    # The last chunk then carries the token usage
+                    stream_options={"include_usage": True},
+                    **request
+                )
+                for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.monotonic() - started_at
+                        pieces.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            outcome = "ok"
+            resilience.observe(True)
+            store_llm_reply(stage, request, model, "".join(pieces), usage, started_at)
+            return
+        except GeneratorExit:
+            # The client went away mid-stream; if this was the breaker's probe, the next call probes instead
+            outcome = "cancelled"
+            resilience.breaker.abandon()
+            raise
+        except Exception as e:
+            resilience.observe(False, e)
+            if is_overloaded(e):
+                model_router.overloaded(model)
+            number += 1
+            delay = resilience.retry_delay(number, len(models), e, give_up_at) if first_token is None else None
+            if delay is None:
+                print(f"Error streaming from OpenAI API ({stage}, {model}): {str(e)}")
+                store_llm_reply(stage, request, model, None, usage, started_at, e)
+                yield AI_ERROR_TEXT
+                return
+            outcome = "retried"
+        finally:
+            record_llm_call(stage, model, started_at, waited, usage, outcome, first_token)
+        time.sleep(delay)
+
+
+def parse_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """Pull a JSON object out of a model reply, tolerating code fences and chatter"""
+    text = text.strip()
+    if text.startswith("```"):
+        text = re.sub(r"^```[a-zA-Z]*\s*|\s*```$", "", text)
+    start, end = text.find("{"), text.rfind("}")
+    if start == -1 or end <= start:
+        return None
+    try:
+        data = json.loads(text[start:end + 1])
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def turn_response_format(schema: Dict[str, Any], name: str) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema}
+    }
+
+
+class LLMCallFailed(Exception):
+    """Every attempt at a call failed or the breaker failed it fast, as opposed to an unusable reply"""
+
+
+def generate_structured_content(prompt: str, schema: Dict[str, Any], name: str, temperature: float = 0.7,
+                                stage: str = "structured") -> Optional[Dict[str, Any]]:
+    """
+    Generate a JSON object constrained to `schema`; returns None if the reply
+    can't be parsed and raises LLMCallFailed if there was no reply at all.
+    """
+    route = model_router.route(stage)
+    attempt = call_llm(
+        stage,
+        messages=chat_messages(prompt),
+        temperature=route.temperature_or(temperature),
+        max_tokens=route.max_tokens,
+        top_p=1.0,
+        response_format=turn_response_format(schema, name)
+    )
+    if not attempt.ok:
+        raise LLMCallFailed(f"{stage} call failed: {str(attempt.error)}")
+    return parse_json_object(attempt.response.choices[0].message.content or "")
+
+
+# Options used whenever the AI doesn't give us 4 usable choices
+DEFAULT_OPTIONS = [
+    {"text": "Explore further ahead", "next_scene": "scene_explore_ahead"},
+    {"text": "Examine your surroundings carefully", "next_scene": "scene_examine_surroundings"},
+    {"text": "Rest and recover your strength", "next_scene": "scene_rest_recover"},
+    {"text": "Try a different approach", "next_scene": "scene_different_approach"},
+    {"text": "Other (write your own action)", "next_scene": "custom_action"}
+]
+
+# Options used when option generation fails outright
+ERROR_OPTIONS = [
+    {"text": "Continue forward cautiously", "next_scene": "scene_continue_forward"},
+    {"text": "Look for an alternative path", "next_scene": "scene_alternative_path"},
+    {"text": "Take a moment to think", "next_scene": "scene_think"},
+    {"text": "Prepare for potential danger", "next_scene": "scene_prepare"},
+    {"text": "Other (write your own action)", "next_scene": "custom_action"}
+]
+
+OTHER_OPTION = {"text": "Other (write your own action)", "next_scene": "custom_action"}
+
+
+def error_turn() -> Dict[str, Any]:
+    """The turn served when the story couldn't be generated at all; makes no LLM calls"""
+    return {
+        "narrative": "Something went wrong in your Marvel journey, but your mission continues...",
+        "scene_description": "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
+        "options": [dict(option) for option in ERROR_OPTIONS],
+        "is_ending": False
+    }
+
+
+def make_option(option_text: str) -> Dict[str, str]:
+    """Build an option with a deterministic scene id derived from its text"""
+    scene_id = "scene_" + "_".join(option_text.lower().split()[:3]).replace("'", "").replace('"', '')
+    return {"text": option_text, "next_scene": scene_id}
+
+
+def options_prompt(game_state: GameState, current_situation: str) -> str:
+    """Build the prompt asking for 4 numbered choices"""
+    return f"""
+    In the superhero adventure game 'Marvel: Legacy Awakened':
+
+    Current situation: {current_situation}
+
+    Game state:
+    - Current location: {game_state.current_scene}
+    - Inventory: {', '.join(game_state.inventory) if game_state.inventory else 'empty'}
+    - Player visited: {', '.join(game_state.visited_locations) if game_state.visited_locations else 'nowhere yet'}
+    - Player stats: Health {game_state.player_stats.get('health')}, Courage {game_state.player_stats.get('courage')}, Wisdom {game_state.player_stats.get('wisdom')}
+    - Story context: {game_state.story_context}
+
+    Based on this Marvel-style situation, generate EXACTLY 4 dramatic, cinematic choices.
+
+    Each choice must:
+    1. Be under 15 words
+    2. Feel heroic, risky, or clever
+    3. Be meaningfully distinct
+    4. Lead to a unique outcome or direction
+
+    Format exactly like:
+    1. Activate your repulsor cannon and blast the wall
+    2. Hack the Stark console to access intel
+    3. Call for backup using the SHIELD beacon
+    4. Fly through the breach before it closes
+"""
+
+
+def parse_options(options_text: str) -> List[Dict[str, str]]:
+    """Turn a numbered list from the AI into options, falling back if it's malformed"""
+    options = []
+
+    # Extract the numbered options from the AI response
+    for line in options_text.split('\n'):
+        match = re.match(r"^\d+[\.\:\)\-]\s+(.*)", line.strip())
+        if match:
+            options.append(make_option(match.group(1).strip()))
+
+    # Add the "Other" option where player can input their own choice
+    options.append(dict(OTHER_OPTION))
+
+    # If we somehow don't have 5 options, generate a fallback set
+    if len(options) < 5:
+        options = [dict(option) for option in DEFAULT_OPTIONS]
+
+    return options
+
+
+def generate_options(game_state: GameState, current_situation: str) -> List[Dict[str, str]]:
+    """Generate 4 options plus the 'other' option using the AI"""
+    if resilience.breaker.is_open:
+        # The upstream is failing: don't spend a call (or a probe) on options
+        return [dict(option) for option in ERROR_OPTIONS]
+    try:
+        options_text = generate_ai_content(
+            options_prompt(game_state, current_situation), temperature=0.8, stage="options"
+        )
+        if options_text == AI_ERROR_TEXT:
+            return [dict(option) for option in ERROR_OPTIONS]
+        return parse_options(options_text)
+
+    except Exception as e:
+        print(f"Error generating options: {str(e)}")
+        # Fallback options if AI generation fails
+        return [dict(option) for option in ERROR_OPTIONS]
+
+
+def narrative_prompt(game_state: GameState, choice: str, ai_prompt: str) -> str:
+    """Build the main storytelling prompt for the player's latest choice"""
+    current_scene = game_state.current_scene
+    visited = ", ".join(game_state.visited_locations) if game_state.visited_locations else "nowhere yet"
+    items = ", ".join(game_state.inventory) if game_state.inventory else "nothing"
+
+    return f"""
+    You are the storyteller for 'Marvel: Legacy Awakened', a cinematic superhero text adventure where the player takes on the role of a rising Marvel hero caught in a multiverse crisis.
+
+    Current game state:
+    - Current location: {current_scene}
+    - Player has visited: {visited}
+    - Player has in inventory: {items}
+    - Player stats: Health {game_state.player_stats.get('health')}, Courage {game_state.player_stats.get('courage')}, Wisdom {game_state.player_stats.get('wisdom')}
+    - Story context so far: {game_state.story_context}
+
+    Player just chose: "{choice}"
+
+    Additional context: {ai_prompt}
+
+    Generate a thrilling continuation of the story (about 2-4 paragraphs) that:
+    1. Reacts to the player's choice
+    2. Describes what happens next in cinematic, vivid Marvel-style detail
+    3. Builds tension and stakes fitting the superhero genre
+    4. Keeps the story immersive and fast-paced
+
+    Write in second person ("you") and present tense. Do NOT include choices at the end.
+    """
+
+
+# A multi-call turn costs narrative, description, summary and ending check,
+# plus either the options or the ending narrative
+MULTI_CALL_ROUND_TRIPS = 5
+
+# Running totals for the structured single-call turn engine
+turn_stats = {"structured_turns": 0, "fallback_turns": 0, "round_trips_saved": 0}
+turn_stats_lock = threading.Lock()
+
+# Everything a turn needs, produced by one JSON-schema-constrained completion
+TURN_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "narrative": {"type": "string"},
+        "scene_description": {"type": "string"},
+        "context_summary": {"type": "string"},
+        "ending": {"type": "string", "enum": ["continue", "victory", "defeat"]},
+        "ending_narrative": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}}
+    },
+    "required": ["narrative", "scene_description", "context_summary", "ending", "ending_narrative", "options"],
+    "additionalProperties": False
+}
+
+
+def record_turn(round_trips: int, structured: bool = True) -> int:
+    """Record how many LLM round trips a turn used and return how many it saved"""
+    saved = MULTI_CALL_ROUND_TRIPS - round_trips
+    with turn_stats_lock:
+        if structured:
+            turn_stats["structured_turns"] += 1
+        else:
+            turn_stats["fallback_turns"] += 1
+        turn_stats["round_trips_saved"] += saved
+    return saved
+
+
+def structured_turn_prompt(game_state: GameState, choice: str, ai_prompt: str) -> str:
+    """Extend the narrative prompt so a single reply carries the whole turn"""
+    return narrative_prompt(game_state, choice, ai_prompt) + f"""
+    Reply with a JSON object containing:
+    - "narrative": the story continuation described above
+    - "scene_description": a short scene description (max 3 sentences) that sets the stage visually as a Marvel-style cinematic moment
+    - "context_summary": 1-2 sentences summarizing this event to add to the story context
+    - "ending": "victory" or "defeat" if the player has saved or failed the mission and this is the conclusion of their journey, otherwise "continue"
+    - "ending_narrative": empty unless the story ends. For "victory": {story_framework["victorious_ending"]["ai_prompt"]} For "defeat": {story_framework["tragic_ending"]["ai_prompt"]}
+    - "options": empty if the story ends, otherwise EXACTLY 4 dramatic, cinematic, meaningfully distinct choices, each under 15 words, that feel heroic, risky, or clever
+    """
+
+
+def repair_turn(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Validate a structured turn, filling in whatever can be salvaged; None if unusable"""
+    narrative = data.get("narrative")
+    if not isinstance(narrative, str) or not narrative.strip():
+        return None
+
+    def text_field(key: str) -> str:
+        value = data.get(key)
+        return value.strip() if isinstance(value, str) else ""
+
+    ending = text_field("ending").lower()
+    if "victory" in ending:
+        ending = "victory"
+    elif "defeat" in ending:
+        ending = "defeat"
+    else:
+        ending = "continue"
+
+    option_texts = []
+    raw_options = data.get("options")
+    for item in raw_options if isinstance(raw_options, list) else []:
+        if isinstance(item, dict):
+            item = item.get("text", "")
+        if not isinstance(item, str):
+            continue
+        # Models sometimes number the options despite the schema
+        item = re.sub(r"^\d+[\.\:\)\-]\s*", "", item.strip())
+        if item and item not in option_texts:
+            option_texts.append(item)
+
+    return {
+        "narrative": narrative.strip(),
+        "scene_description": text_field("scene_description")
+        or "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
+        "context_summary": text_field("context_summary"),
+        "ending": ending,
+        "ending_narrative": text_field("ending_narrative"),
+        "option_texts": option_texts[:4]
+    }
+
+
+def structured_turn_result(game_state: GameState, turn: Dict[str, Any], ending_narrative: str) -> Dict[str, Any]:
+    """Apply a repaired structured turn to the game state and build the turn result"""
+    if turn["context_summary"]:
+        game_state.add_context(turn["context_summary"])
+
+    if turn["ending"] != "continue":
+        return {
+            "narrative": turn["narrative"] + "\n\n" + ending_narrative,
+            "scene_description": turn["scene_description"],
+            "options": [{"text": "Start a new adventure", "next_scene": "start"}],
+            "is_ending": True,
+            # A second round trip was needed if the model left out the ending text
+            "round_trips_saved": record_turn(1 if turn["ending_narrative"] else 2)
+        }
+
+    options = [make_option(text) for text in turn["option_texts"]]
+    # Top up a short list rather than throwing the whole turn away
+    for fallback in DEFAULT_OPTIONS[:4]:
+        if len(options) >= 4:
+            break
+        if all(option["text"] != fallback["text"] for option in options):
+            options.append(dict(fallback))
+    options.append(dict(OTHER_OPTION))
+
+    return {
+        "narrative": turn["narrative"],
+        "scene_description": turn["scene_description"],
+        "options": options,
+        "is_ending": False,
+        "round_trips_saved": record_turn(1)
+    }
+
+
+def generate_turn_structured(game_state: GameState, choice: str, ai_prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    Generate a whole turn in one round trip. None means the reply was unusable
+    and the caller should fall back; LLMCallFailed means there was no reply.
+    """
+    data = generate_structured_content(
+        structured_turn_prompt(game_state, choice, ai_prompt), TURN_SCHEMA, "story_turn", stage="turn"
+    )
+    turn = repair_turn(data) if data else None
+    if turn is None:
+        return None
+
+    ending_narrative = turn["ending_narrative"]
+    if turn["ending"] != "continue" and not ending_narrative:
+        # The verdict is still good, only the ending text is missing
+        ending_narrative = generate_ai_content(ending_narrative_prompt(turn["ending"]), stage="ending_narrative")
+    return structured_turn_result(game_state, turn, ending_narrative)
+
+
+def compact_context(game_state: GameState) -> None:
+    """Fold older turns into the summary tier once the recent ones outgrow their budget"""
+    prompt = game_state.context.fold_prompt()
+    if prompt is None:
+        return
+    summary = generate_ai_content(prompt, temperature=0.3, stage="fold")
+    game_state.context.apply_fold(None if summary == AI_ERROR_TEXT else summary)
+
+
+def generate_narrative(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """
+    Generate narrative and scene details using OpenAI's GPT model for Marvel-style superhero storytelling.
+
+    Tries the single structured-output turn first and only falls back to the
+    multi-call chain when that reply can't be parsed. When the call itself
+    failed, the chain would only send more calls to a failing upstream, so
+    the error turn is served instead.
+    """
+    try:
+        result = generate_turn_structured(game_state, choice, ai_prompt)
+    except LLMCallFailed as e:
+        print(f"Error in narrative generation: {str(e)}")
+        return error_turn()
+    if result is None:
+        result = generate_narrative_multi_call(game_state, choice, ai_prompt)
+        # The failed structured attempt counts against the multi-call turn
+        result["round_trips_saved"] = record_turn(MULTI_CALL_ROUND_TRIPS + 1, structured=False)
+
+    compact_context(game_state)
+    return result
+
+
+# Shared, bounded pool for the independent calls that follow the narrative
+LLM_FANOUT_WORKERS = int(os.getenv("LLM_FANOUT_WORKERS", "16"))
+# Seconds each fanned-out call may take before we fall back without it
+LLM_CALL_TIMEOUT = float(os.getenv("LLM_CALL_TIMEOUT", "30"))
+llm_executor = ThreadPoolExecutor(max_workers=LLM_FANOUT_WORKERS, thread_name_prefix="llm")
+
+
+def submit_llm(fn, *args) -> Future:
+    """Run an LLM call on the fan-out pool, keeping the caller's usage meter"""
+    return llm_executor.submit(copy_context().run, fn, *args)
+
+
+def description_prompt(narrative_text: str) -> str:
+    """Build the prompt for a short visual scene description"""
+    return f"""
+        Based on this narrative, create a short scene description (max 3 sentences) that sets the stage visually:
+
+        {narrative_text}
+
+        The description should paint a clear Marvel-style cinematic moment.
+        """
+
+
+def context_prompt(story_context: str, choice: str, narrative_text: str) -> str:
+    """Build the prompt summarizing the latest event for the story context"""
+    return f"""
+        Summarize the following event in 1-2 sentences to add to the story context:
+
+        Previous context: {story_context}
+        New event: Player chose "{choice}" which led to: {narrative_text}
+        """
+
+
+def ending_prompt(narrative_text: str, story_context: str) -> str:
+    """Build the prompt asking whether the narrative ends the adventure"""
+    return f"""
+        Does the following narrative represent the end of the adventure?
+
+        Clues to look for:
+        - Has the player saved or failed the mission?
+        - Did they face final consequences or resolution?
+        - Is this the climax or conclusion of their journey?
+
+        Narrative: {narrative_text}
+        Story context: {story_context}
+
+        Respond with ONLY ONE word:
+        - "continue"
+        - "victory"
+        - "defeat"
+        """
+
+
+def await_call(future: Future, fallback: Any, deadline: float, label: str) -> Any:
+    """
+    Wait for a fanned-out call until the shared deadline, returning `fallback`
+    on failure. A call that times out isn't stopped: a worker thread can't be
+    interrupted, so it runs to the end and its tokens are still spent.
+    """
+    try:
+        return future.result(timeout=max(0.0, deadline - time.monotonic()))
+    except FutureTimeoutError:
+        print(f"Timed out waiting for {label}")
+    except Exception as e:
+        print(f"Error generating {label}: {str(e)}")
+    return fallback
+
+
+# The ending check runs locally; the LLM is only asked when the classifier is less
+# confident than this (set it above 1 to always ask the LLM)
+ENDING_CONFIDENCE = float(os.getenv("ENDING_CONFIDENCE", "0.9"))
+# Fraction of confident turns still sent to the LLM, so agreement keeps being measured
+ENDING_AUDIT_RATE = float(os.getenv("ENDING_AUDIT_RATE", "0"))
+# JSON lines of every LLM ending verdict next to the local one, for eval_ending.py
+ENDING_SAMPLE_LOG = os.getenv("ENDING_SAMPLE_LOG", "")
+ending_classifier = EndingClassifier(ENDING_CONFIDENCE, ENDING_AUDIT_RATE, ENDING_SAMPLE_LOG)
+ending_checks_total = metrics_registry.counter(
+    "ending_checks_total", "Ending checks by whether the local classifier or the LLM decided", ("decided_by",)
+)
+
+
+def check_ending(game_state: GameState, narrative_text: str) -> Tuple[str, float, Optional[str]]:
+    """
+    Classify a narrative locally: the verdict, its confidence, and the decision
+    to use, which is None when the LLM has to be asked.
+    """
+    verdict, confidence = classify_ending(narrative_text, game_state.visited_count, game_state.player_stats)
+    decision = ending_classifier.decide(verdict, confidence)
+    ending_checks_total.inc(decided_by="local" if decision is not None else "llm")
+    return verdict, confidence, decision
+
+
+def settle_ending(game_state: GameState, narrative_text: str, verdict: str, confidence: float,
+                  reply: Optional[str]) -> str:
+    """The decision for an escalated ending check: the LLM's, or the local verdict if the call failed"""
+    if reply is None or reply == AI_ERROR_TEXT:
+        return verdict
+    llm_verdict = normalize_verdict(reply)
+    ending_classifier.record(
+        narrative_text, game_state.visited_count, game_state.player_stats, verdict, confidence, llm_verdict
+    )
+    return llm_verdict
+
+
+def ending_type_for(decision: str) -> Optional[str]:
+    """Map an ending verdict ("continue"/"victory"/"defeat") to its story_framework scene"""
+    decision = decision.strip().lower()
+    if "victory" in decision:
+        return "victorious_ending"
+    if "defeat" in decision:
+        return "tragic_ending"
+    return None
+
+
+def ending_narrative_prompt(ending: str) -> str:
+    """Look up the closing prompt for a verdict or ending scene id"""
+    ending_type = ending_type_for(ending) or ending
+    scene_data = story_framework.get(ending_type, {})
+    return scene_data.get("ai_prompt", "Create a satisfying superhero ending.")
+
+
+def assemble_turn(game_state: GameState, narrative_text: str, ending_narrative: Optional[str],
+                  options_text: Optional[str], scene_description: str, new_context: str) -> Dict[str, Any]:
+    """Put the pieces of a multi-call turn together and apply its context update"""
+    # A failed auxiliary call falls back here rather than leaking the error text into the turn or the context
+    if options_text == AI_ERROR_TEXT:
+        options_text = None
+    if scene_description == AI_ERROR_TEXT:
+        scene_description = "You're standing on the edge of something bigger — the fate of the multiverse is at stake."
+    if new_context == AI_ERROR_TEXT:
+        new_context = ""
+    if ending_narrative is not None:
+        result = {
+            "narrative": narrative_text + "\n\n" + ending_narrative,
+            "options": [{"text": "Start a new adventure", "next_scene": "start"}],
+            "is_ending": True
+        }
+    else:
+        result = {
+            "narrative": narrative_text,
+            "options": parse_options(options_text) if options_text else [dict(option) for option in ERROR_OPTIONS],
+            "is_ending": False
+        }
+    result["scene_description"] = scene_description
+
+    if new_context:
+        game_state.add_context(new_context)
+
+    return result
+
+
+def complete_turn(game_state: GameState, choice: str, narrative_text: str) -> Dict[str, Any]:
+    """
+    Fan out the calls that only depend on the narrative and assemble the turn.
+
+    Every prompt is built on the request thread from the same snapshot, so the
+    workers never read game_state; the story context is only updated here once
+    all of them are done.
+    """
+    story_context = game_state.story_context
+    deadline = time.monotonic() + LLM_CALL_TIMEOUT
+
+    description_future = submit_llm(generate_ai_content, description_prompt(narrative_text), 0.6, "description")
+    context_future = submit_llm(
+        generate_ai_content, context_prompt(story_context, choice, narrative_text), 0.5, "summary"
+    )
+    verdict, confidence, decision = check_ending(game_state, narrative_text)
+    if decision is None:
+        ending_future = submit_llm(
+            generate_ai_content, ending_prompt(narrative_text, story_context), 0.4, "ending"
+        )
+    # Started speculatively; if the story turns out to be over, its reply is
+    # ignored (the thread can't be stopped, so the call is still paid for)
+    options_future = submit_llm(generate_ai_content, options_prompt(game_state, narrative_text), 0.8, "options")
+
+    if decision is None:
+        reply = await_call(ending_future, None, deadline, "ending check")
+        decision = settle_ending(game_state, narrative_text, verdict, confidence, reply)
+    ending_type = ending_type_for(decision)
+
+    ending_narrative = None
+    options_text = None
+    if ending_type:
+        ending_narrative = generate_ai_content(ending_narrative_prompt(ending_type), stage="ending_narrative")
+    else:
+        options_text = await_call(options_future, None, deadline, "options")
+
+    scene_description = await_call(
+        description_future,
+        "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
+        deadline,
+        "scene description"
+    )
+    new_context = await_call(context_future, "", deadline, "context summary")
+
+    return assemble_turn(game_state, narrative_text, ending_narrative, options_text, scene_description, new_context)
+
+
+def generate_narrative_multi_call(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """Generate a turn with one LLM call per piece: the narrative, then the rest concurrently"""
+    prompt = narrative_prompt(game_state, choice, ai_prompt)
+
+    try:
+        narrative_text = generate_ai_content(prompt, stage="narrative")
+        if narrative_text == AI_ERROR_TEXT:
+            # Don't build descriptions, options and summaries on top of the error text
+            raise RuntimeError("narrative call failed")
+        return complete_turn(game_state, choice, narrative_text)
+
+    except Exception as e:
+        print(f"Error in narrative generation: {str(e)}")
+        return {
+            "narrative": "Something went wrong in your Marvel journey, but your mission continues...",
+            "scene_description": "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
+            "options": generate_options(game_state, "The hero faces the unknown."),
+            "is_ending": False
+        }
+
+
+# Warm pool of pre-generated opening turns for /start_game
+OPENING_POOL_SIZE = int(os.getenv("OPENING_POOL_SIZE", "8"))
+OPENING_POOL_LOW_WATER = int(os.getenv("OPENING_POOL_LOW_WATER", "3"))
+OPENING_POOL_PATH = os.getenv("OPENING_POOL_PATH", "opening_pool.json")
+OPENING_POOL_MAX_AGE = float(os.getenv("OPENING_POOL_MAX_AGE", str(24 * 3600)))
+
+# The choice an opening turn is generated (and indexed) for
+OPENING_CHOICE = "begin your hero's journey"
+
+
+def generate_opening(game_state: GameState) -> Dict[str, Any]:
+    """Generate the opening turn for a fresh game state"""
+    # Get the initial scene from story framework
+    scene_data = story_framework.get(game_state.current_scene)
+
+    return generate_narrative(
+        game_state,
+        OPENING_CHOICE,
+        scene_data.get("ai_prompt", "Create an action-packed opening for a Marvel superhero origin.")
+    )
+
+
+def turn_failed(result: Dict[str, Any]) -> bool:
+    """Whether a generated turn is one of the error fallbacks"""
+    return AI_ERROR_TEXT in result["narrative"] or result["narrative"].startswith("Something went wrong")
+
+
+def pregenerate_opening() -> Dict[str, Any]:
+    """One warm-pool entry: an opening turn and the game state it leaves behind"""
+    game_state = GameState()
+    result = generate_opening(game_state)
+    if turn_failed(result):
+        # Never bank a failed turn; the pool retries later
+        raise RuntimeError("opening generation failed")
+    if result.get("is_ending", False):
+        # An opening that ends the story would only offer "Start a new adventure"
+        raise RuntimeError("opening generation ended the story")
+    return {"result": result, "game_state": game_state.to_dict()}
+
+
+# Openings only depend on these, so a change to any of them invalidates the saved pool
+opening_fingerprint = hashlib.sha256(
+    (SYSTEM_PROMPT + DEFAULT_STORY_CONTEXT + story_framework["start"]["ai_prompt"]).encode("utf-8")
+).hexdigest()
+opening_pool = WarmPool(
+    pregenerate_opening,
+    OPENING_POOL_PATH,
+    target=OPENING_POOL_SIZE,
+    low_water=OPENING_POOL_LOW_WATER,
+    fingerprint=opening_fingerprint,
+    max_age=OPENING_POOL_MAX_AGE
+)
+
+
+def pooled_opening(opening_pool: WarmPool = opening_pool) -> Optional[Tuple[GameState, Dict[str, Any]]]:
+    """An opening from the scene index or the warm pool, without generating one"""
+    opening = indexed_opening()
+    if opening is not None:
+        return opening
+    pooled = opening_pool.pop()
+    if pooled is None:
+        return None
+    game_state = GameState()
+    game_state.from_dict(pooled["game_state"])
+    return game_state, pooled["result"]
+
+
+def take_opening() -> Tuple[GameState, Dict[str, Any]]:
+    """Serve a pre-generated opening, generating one live on a miss"""
+    opening = pooled_opening()
+    if opening is None:
+        game_state = GameState()
+        return game_state, generate_opening(game_state)
+    return opening
+
+
+# Signed save codes; /load_game resumes a fresh one without any LLM call
+snapshots = Snapshots()
+# Accept plain, unsigned game_state bodies from save codes made before snapshots (1), or only snapshots (0).
+# Their stats, inventory and flags are whatever the client sent.
+ALLOW_UNSIGNED_SAVES = os.getenv("ALLOW_UNSIGNED_SAVES", "0") == "1"
+snapshot_loads_total = metrics_registry.counter(
+    "snapshot_loads_total", "Loaded saves by whether the scene was restored, regenerated or rejected", ("outcome",)
+)
+
+
+def restore_snapshot(data: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    The game state a /load_game body carries and, when its snapshot is fresh
+    and has a scene, the turn to resume as-is. Plain game_state bodies from
+    older save codes are only accepted with ALLOW_UNSIGNED_SAVES, without the
+    server's fields, and always get a regenerated scene.
+    """
+    if not data.get("snapshot"):
+        if not ALLOW_UNSIGNED_SAVES:
+            raise SnapshotError("unsigned save codes are not accepted")
+        state = data.get("game_state")
+        if isinstance(state, dict):
+            state = {key: value for key, value in state.items() if key not in SERVER_FIELDS}
+        return state, None
+    state, fresh = snapshots.load(data["snapshot"])
+    if not fresh or not state.get("last_turn"):
+        return state, None
+    return state, dict(state["last_turn"])
+
+
+@app.before_request
+def warm_opening_pool() -> None:
+    """Start filling the opening pool with the first request, whatever it is, rather than the first miss"""
+    start_opening_pool()
+
+
+@app.after_request
+def compress_response(response: Response) -> Response:
+    """gzip or brotli for JSON and pages the client accepts it for; SSE is compressed in sse_response()"""
+    if response.is_streamed or response.direct_passthrough or not compressible(response.mimetype):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None or "Content-Encoding" in response.headers:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.errorhandler(ServerBusy)
+def server_busy(e: ServerBusy):
+    """Shed load with a 503 instead of queueing turns we can't serve soon"""
+    response = jsonify({"error": str(e)})
+    response.status_code = 503
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+
+@app.errorhandler(SessionBusy)
+def session_busy(e: SessionBusy):
+    """Another request is still playing a turn on this session"""
+    return jsonify({"error": "Session is busy, please wait for the current turn"}), 409
+
+
+class ChoiceError(Exception):
+    """Raised when a choice request can't be applied to its session"""
+
+
+class StaleTurn(Exception):
+    """Raised for a choice made on a turn the session has already moved past"""
+
+    def __init__(self, turn: int):
+        super().__init__(f"This choice was made on an earlier turn; the game is on turn {turn}")
+        self.turn = turn
+
+
+@app.errorhandler(StaleTurn)
+def stale_turn(e: StaleTurn):
+    """The client is behind (another tab played on): it should reload, not replay an old turn"""
+    return jsonify({"error": str(e), "turn": e.turn}), 409
+
+
+turn_replays_total = metrics_registry.counter(
+    "turn_replays_total", "Resubmitted choices answered with the turn they already produced"
+)
+
+
+def choice_options(game_state: GameState, data: Dict[str, Any]) -> List[Dict[str, str]]:
+    """The options a choice picks from: the session's own, unless an older client sent them along"""
+    return data.get("current_options") or (game_state.last_turn or {}).get("options", [])
+
+
+def choice_key(data: Dict[str, Any]) -> Dict[str, Any]:
+    """What identifies a choice when it is submitted twice"""
+    return {"choice_index": data.get("choice_index"), "custom_action": data.get("custom_action", "")}
+
+
+def replayed_turn(game_state: Optional[GameState], data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Check the turn a choice body says it was made on. Resubmitting the choice
+    that produced the current turn (a double click, or a retry after a lost
+    response) gets that turn back without playing it again; a choice on any
+    other past turn raises StaleTurn. None means play it: it is for the
+    current turn, or comes from a client that doesn't send turns.
+    """
+    turn = data.get("turn")
+    if game_state is None or turn is None or turn == game_state.turn:
+        return None
+    if (turn == game_state.turn - 1 and game_state.last_turn is not None
+            and game_state.last_choice == dict(choice_key(data), turn=turn)):
+        turn_replays_total.inc()
+        return dict(game_state.last_turn)
+    raise StaleTurn(game_state.turn)
+
+
+def advance_turn(game_state: GameState, data: Dict[str, Any]) -> None:
+    """Number the turn a choice body just produced; call once, after remember_turn()"""
+    game_state.advance(choice_key(data))
+
+
+def state_fields(game_state: GameState, since: Optional[int] = None) -> Dict[str, Any]:
+    """
+    The game state part of a response: only what changed if the client is on
+    the turn before this one (`since`), otherwise the whole public state
+    """
+    if since is not None and since == game_state.turn - 1 and game_state.last_delta is not None:
+        return {"turn": game_state.turn, "game_state_delta": game_state.last_delta}
+    return {"turn": game_state.turn, "game_state": game_state.public_dict()}
+
+
+def apply_choice(game_state: Optional[GameState], data: Dict[str, Any]) -> Tuple[str, str]:
+    """Validate a /make_choice body and move the session to the chosen scene"""
+    choice_index = data.get("choice_index", 0)
+    custom_action = data.get("custom_action", "")
+
+    if game_state is None:
+        raise ChoiceError("Invalid session")
+
+    # Get current options
+    current_options = choice_options(game_state, data)
+    if not current_options:
+        raise ChoiceError("No options provided")
+
+    # Handle the choice
+    if not isinstance(choice_index, int) or not 0 <= choice_index < len(current_options):
+        raise ChoiceError("Invalid choice index")
+
+    chosen_option = current_options[choice_index]
+    chosen_text = chosen_option.get("text", "Unknown choice")
+    next_scene = chosen_option.get("next_scene", "")
+
+    # For custom actions (the "Other" option)
+    if next_scene == "custom_action" and custom_action:
+        chosen_text = custom_action
+        # Generate a scene ID for the custom action
+        next_scene = "scene_custom_" + str(game_state.visited_count)
+
+    # Update game state
+    game_state.visit(next_scene)
+
+    ai_prompt = f"The player chose to {chosen_text}. Continue the adventure based on this choice, creating a detailed and atmospheric scene."
+    return chosen_text, ai_prompt
+
+
+def remember_turn(game_state: GameState, result: Dict[str, Any]) -> None:
+    """Keep the turn the player is now looking at, so a save can resume it without the LLM"""
+    game_state.last_turn = {
+        "narrative": result["narrative"],
+        "scene_description": result["scene_description"],
+        "options": result["options"],
+        "is_ending": result.get("is_ending", False)
+    }
+
+
+def finish_choice(game_state: GameState, result: Dict[str, Any]) -> None:
+    """Reset certain game state aspects after an ending while preserving the session"""
+    if result.get("is_ending", False):
+        game_state.inventory = []
+        game_state.visited_locations = []
+        game_state.current_scene = "start"
+
+
+def apply_custom_action(game_state: Optional[GameState], data: Dict[str, Any]) -> Tuple[str, str]:
+    """Validate a /custom_action body and move the session to a fresh custom scene"""
+    custom_action = data.get("custom_action", "")
+
+    if game_state is None or not custom_action:
+        raise ChoiceError("Invalid session or missing custom action")
+
+    # Update game state
+    game_state.visit(f"scene_custom_{game_state.visited_count + 1}")
+
+    ai_prompt = f"The player chose a custom action: '{custom_action}'. Create an engaging continuation of the story based on this unexpected action."
+    return custom_action, ai_prompt
+
+
+# Turns shared between players who follow the same path of choices
+SCENE_CACHE_DIR = os.getenv("SCENE_CACHE_DIR", "scene_cache")
+SCENE_CACHE_MAX_PATHS = int(os.getenv("SCENE_CACHE_MAX_PATHS", "10000"))
+# Chance of replaying a cached turn while a path still has room for more variants
+SCENE_CACHE_REUSE = float(os.getenv("SCENE_CACHE_REUSE", "0.8"))
+SCENE_CACHE_VARIANTS = int(os.getenv("SCENE_CACHE_VARIANTS", "3"))
+
+# Turns depend on the same prompts as openings, so they share the fingerprint
+scene_cache = SceneCache(
+    SCENE_CACHE_DIR or None,
+    max_paths=SCENE_CACHE_MAX_PATHS,
+    reuse=SCENE_CACHE_REUSE,
+    variants=SCENE_CACHE_VARIANTS,
+    fingerprint=opening_fingerprint
+)
+
+
+def scene_path(game_state: GameState, choice: str) -> Optional[List[str]]:
+    """
+    The path of scene ids and the choice a chosen option's turn is cached
+    under, or None when it runs through a custom action nobody else shares
+    or is too long to still be known in full.
+    """
+    if game_state.visited_dropped:
+        return None
+    path = game_state.visited_locations + [game_state.current_scene]
+    if any(scene.startswith("scene_custom_") or scene == "custom_action" for scene in path):
+        return None
+    return path + [choice]
+
+
+# Pre-generated story tree (see pregenerate.py); mapped read-only, so worker processes share one copy
+SCENE_INDEX_PATH = os.getenv("SCENE_INDEX_PATH", "scene_index.bin")
+
+scene_index = SceneIndex(SCENE_INDEX_PATH, fingerprint=opening_fingerprint)
+
+
+def indexed_turn(game_state: GameState, path: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """The pre-generated turn for `path`, taking over the story context it left behind"""
+    if path is None or not scene_index.enabled:
+        return None
+    with span("scene_index"):
+        turn = scene_index.get(path)
+    if turn is None:
+        return None
+    game_state.context = StoryContext.from_dict(DEFAULT_STORY_CONTEXT, turn["context_tiers"])
+    return turn["result"]
+
+
+def start_opening_pool(opening_pool: WarmPool = opening_pool) -> None:
+    """Fill the warm pool from the first request on, unless the scene index serves every opening"""
+    if opening_pool.started or scene_path(GameState(), OPENING_CHOICE) in scene_index:
+        return
+    opening_pool.start()
+
+
+def indexed_opening() -> Optional[Tuple[GameState, Dict[str, Any]]]:
+    """A fresh game state and its pre-generated opening, if the index has one"""
+    game_state = GameState()
+    result = indexed_turn(game_state, scene_path(game_state, OPENING_CHOICE))
+    if result is None:
+        return None
+    return game_state, result
+
+
+def cached_turn(game_state: GameState, path: Optional[List[str]]) -> Optional[Dict[str, Any]]:
+    """
+    Replay a turn for `path` from the scene index, or else from the scene
+    cache, taking over the story context it left behind. Paths past the
+    index's frontier fall through to the cache and then live generation.
+    """
+    if path is None:
+        return None
+    result = indexed_turn(game_state, path)
+    if result is not None:
+        return result
+    with span("scene_cache"):
+        turn = scene_cache.get(path)
+    if turn is None:
+        return None
+    game_state.context = StoryContext.from_dict(DEFAULT_STORY_CONTEXT, turn["context_tiers"])
+    return turn["result"]
+
+
+def cache_turn(path: Optional[List[str]], game_state: GameState, result: Dict[str, Any]) -> None:
+    if path is not None and not turn_failed(result):
+        scene_cache.put(path, {"result": result, "context_tiers": game_state.context.to_dict()})
+
+
+def play_choice(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """Generate the turn for a chosen option, or replay one cached for the same path"""
+    path = scene_path(game_state, choice)
+    result = cached_turn(game_state, path)
+    if result is None:
+        result = generate_narrative(game_state, choice, ai_prompt)
+        cache_turn(path, game_state, result)
+    return result
+
+
+# Speculative next turns: options per turn to play ahead while the player reads
+# (0 turns it off) and how many may be generating at once across all sessions
+SPECULATE_BRANCHES = int(os.getenv("SPECULATE_BRANCHES", "0"))
+SPECULATE_MAX_INFLIGHT = int(os.getenv("SPECULATE_MAX_INFLIGHT", "8"))
+SPECULATE_TTL = float(os.getenv("SPECULATE_TTL", "600"))
+
+
+def speculate_branch(state: Dict[str, Any], option: Dict[str, str]) -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+    """Play one option ahead of time from a serialized game state"""
+    game_state = GameState()
+    # Branches share the snapshot; each plays on its own copy
+    game_state.from_dict(copy.deepcopy(state))
+    with track_usage() as usage:
+        chosen_text, ai_prompt = apply_choice(game_state, {"choice_index": 0, "current_options": [option]})
+        result = play_choice(game_state, chosen_text, ai_prompt)
+    if turn_failed(result):
+        # Let the live request retry instead of serving a failed turn
+        raise RuntimeError("speculative turn failed")
+    finish_choice(game_state, result)
+    remember_turn(game_state, result)
+    return game_state.to_dict(), result, sum(usage)
+
+
+speculator = Speculator(
+    speculate_branch,
+    branches=SPECULATE_BRANCHES,
+    max_inflight=SPECULATE_MAX_INFLIGHT,
+    ttl=SPECULATE_TTL,
+    # Only spend spare capacity: never queue ahead of live turns
+    spare_capacity=lambda: admission.stats()["waiting"] == 0
+)
+
+
+def speculate_next(session_id: str, game_state: GameState, result: Dict[str, Any],
+                   speculator: Speculator = speculator) -> None:
+    """Start playing the likely next turns while the player reads this one"""
+    if not speculator.enabled or result.get("is_ending", False):
+        return
+    speculator.speculate(session_id, copy.deepcopy(game_state.to_dict()), result["options"])
+
+
+def claim_speculation(session_id: str, game_state: Optional[GameState], data: Dict[str, Any],
+                      speculator: Speculator = speculator) -> Optional[Future]:
+    """
+    The speculated turn for the option a /make_choice body picks, as a future
+    of (game_state dict, result); None if the turn has to be generated live.
+    """
+    if not speculator.enabled or game_state is None:
+        return None
+    current_options = choice_options(game_state, data)
+    choice_index = data.get("choice_index", 0)
+    if not isinstance(choice_index, int) or not 0 <= choice_index < len(current_options):
+        speculator.discard(session_id)
+        return None
+    return speculator.claim(session_id, game_state.to_dict(), current_options[choice_index])
+
+
+def speculated_turn(session_id: str, game_state: Optional[GameState], data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Serve a /make_choice from its speculated turn, moving game_state to where it left off"""
+    claimed = claim_speculation(session_id, game_state, data)
+    if claimed is None:
+        return None
+    try:
+        # Only the part of the branch still running is waited for
+        with span("speculation_wait"):
+            new_state, result = claimed.result()
+    except Exception as e:
+        print(f"Error in speculative turn, generating live: {str(e)}")
+        return None
+    game_state.from_dict(new_state)
+    return result
+
+
+@app.route('/start_game', methods=['POST'])
+@timed_turn("start_game")
+def start_game():
+    """Initialize a new Marvel superhero game session"""
+    admission.check()
+    session_id = os.urandom(16).hex()
+
+    # Serve the opening scene, pre-generated if the pool has one
+    game_state, result = take_opening()
+    remember_turn(game_state, result)
+    session_store.put(session_id, game_state)
+    speculate_next(session_id, game_state, result)
+
+    return jsonify({
+        "session_id": session_id,
+        "narrative": result["narrative"],
+        "scene_description": result["scene_description"],
+        "options": result["options"],
+        **state_fields(game_state)
+    })
+
+
+@app.route('/make_choice', methods=['POST'])
+@timed_turn("make_choice")
+def make_choice():
+    """Process player choice and advance the story"""
+    admission.check()
+    data = request.get_json()
+    session_id = data.get("session_id")
+    with session_store.checkout(session_id) as game_state:
+        # A resubmitted choice gets the turn it already produced
+        result = replayed_turn(game_state, data)
+        if result is None:
+            # Served as-is if this turn was already played while the player read
+            result = speculated_turn(session_id, game_state, data)
+            if result is None:
+                try:
+                    chosen_text, ai_prompt = apply_choice(game_state, data)
+                except ChoiceError as e:
+                    return jsonify({"error": str(e)}), 400
+
+                # Generate narrative based on choice
+                result = play_choice(
+                    game_state,
+                    chosen_text,
+                    ai_prompt
+                )
+
+                # Check if this is an ending
+                finish_choice(game_state, result)
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+
+        return jsonify({
+            "narrative": result["narrative"],
+            "scene_description": result["scene_description"],
+            "options": result["options"],
+            **state_fields(game_state, data.get("turn")),
+            "is_ending": result.get("is_ending", False)
+        })
+
+@app.route('/custom_action', methods=['POST'])
+@timed_turn("custom_action")
+def custom_action():
+    """Process a custom player action"""
+    admission.check()
+    data = request.get_json()
+    session_id = data.get("session_id")
+    with session_store.checkout(session_id) as game_state:
+        # A resubmitted action gets the turn it already produced
+        result = replayed_turn(game_state, data)
+        if result is None:
+            try:
+                action, ai_prompt = apply_custom_action(game_state, data)
+            except ChoiceError as e:
+                return jsonify({"error": str(e)}), 400
+            speculator.discard(session_id)
+
+            # Generate narrative based on custom action
+            result = generate_narrative(
+                game_state,
+                action,
+                ai_prompt
+            )
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+
+        return jsonify({
+            "narrative": result["narrative"],
+            "scene_description": result["scene_description"],
+            "options": result["options"],
+            **state_fields(game_state, data.get("turn")),
+            "is_ending": result.get("is_ending", False)
+        })
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_turn(game_state: GameState, choice: str, ai_prompt: str, reset_on_ending: bool = False,
+                session_id: Optional[str] = None, cache_path: Optional[List[str]] = None,
+                played: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+    """
+    Stream a turn as SSE: narrative tokens as they arrive, then the scene
+    description, options and updated game state as separate events. With a
+    session_id the next turns are speculated once this one is complete, and
+    with a cache_path the turn is added to the scene cache. `played` is the
+    body of the choice being played, which numbers the new turn.
+    """
+    try:
+        narrative_text = ""
+        for delta in stream_ai_content(narrative_prompt(game_state, choice, ai_prompt), stage="narrative"):
+            narrative_text += delta
+            yield sse_event("token", {"text": delta})
+        if AI_ERROR_TEXT in narrative_text:
+            raise RuntimeError("narrative stream failed")
+
+        result = complete_turn(game_state, choice, narrative_text.strip())
+        compact_context(game_state)
+        cache_turn(cache_path, game_state, result)
+        if reset_on_ending:
+            finish_choice(game_state, result)
+        remember_turn(game_state, result)
+        if played is not None:
+            advance_turn(game_state, played)
+        if session_id:
+            speculate_next(session_id, game_state, result)
+
+        if result["is_ending"]:
+            # The ending text is appended after the streamed part
+            yield sse_event("narrative", {"narrative": result["narrative"]})
+        yield from result_events(game_state, result, played.get("turn") if played is not None else None)
+    except Exception as e:
+        print(f"Error streaming turn: {str(e)}")
+        yield sse_event("error", {"error": "Something went wrong in your Marvel journey, please try again"})
+
+
+def result_events(game_state: GameState, result: Dict[str, Any], since: Optional[int] = None) -> Iterator[str]:
+    """The SSE events that follow the narrative of a finished turn"""
+    yield sse_event("scene_description", {"scene_description": result["scene_description"]})
+    yield sse_event("options", {"options": result["options"]})
+    yield sse_event("game_state", dict(state_fields(game_state, since), is_ending=result["is_ending"]))
+    yield sse_event("done", {})
+
+
+def finished_turn_events(game_state: GameState, result: Dict[str, Any], since: Optional[int] = None) -> List[str]:
+    """
+    A turn that is already complete as the events a streamed one would send.
+    Rendered up front, so the session can be released before they go out.
+    """
+    events = [sse_event("token", {"text": result["narrative"]})]
+    events.extend(result_events(game_state, result, since))
+    return events
+
+
+def timed_events(turn: Timeline, events: Iterator[str]) -> Iterator[str]:
+    """Keep a turn's timeline current while its stream is produced"""
+    current_timeline.set(turn)
+    try:
+        yield from events
+    finally:
+        current_timeline.set(None)
+        finish_turn(turn)
+
+
+def sse_response(events: Iterator[str], checkout: Optional[ExitStack] = None) -> Response:
+    """
+    Wrap an SSE generator in an unbuffered streaming response, compressed
+    event by event when the client accepts it. A session checkout is held
+    until the stream is closed, however that happens, and a timed turn is
+    finished then too.
+    """
+    turn = current_timeline.get()
+    if turn is not None:
+        turn.deferred = True
+        events = timed_events(turn, events)
+    body = stream_with_context(events)
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is not None:
+        body = compress_stream(body, encoding)
+    response = Response(
+        body,
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    if checkout is not None:
+        response.call_on_close(checkout.close)
+    return response
+
+
+@app.route('/start_game_stream', methods=['POST'])
+@timed_turn("start_game_stream")
+def start_game_stream():
+    """Streaming variant of /start_game"""
+    admission.check()
+    session_id = os.urandom(16).hex()
+
+    opening = pooled_opening()
+    if opening is not None:
+        # A pre-generated opening is already complete: send it in one go
+        game_state, result = opening
+        remember_turn(game_state, result)
+        session_store.put(session_id, game_state)
+        speculate_next(session_id, game_state, result)
+
+        def pooled_events():
+            yield sse_event("session", {"session_id": session_id})
+            yield sse_event("token", {"text": result["narrative"]})
+            yield from result_events(game_state, result)
+
+        return sse_response(pooled_events())
+
+    session_store.put(session_id, GameState())
+    checkout = ExitStack()
+    game_state = checkout.enter_context(session_store.checkout(session_id))
+    scene_data = story_framework.get(game_state.current_scene)
+
+    def events():
+        yield sse_event("session", {"session_id": session_id})
+        yield from stream_turn(
+            game_state,
+            OPENING_CHOICE,
+            scene_data.get("ai_prompt", "Create an action-packed opening for a Marvel superhero origin."),
+            session_id=session_id
+        )
+
+    return sse_response(events(), checkout)
+
+
+@app.route('/make_choice_stream', methods=['POST'])
+@timed_turn("make_choice_stream")
+def make_choice_stream():
+    """Streaming variant of /make_choice"""
+    admission.check()
+    data = request.get_json()
+    session_id = data.get("session_id")
+    with ExitStack() as checkout:
+        game_state = checkout.enter_context(session_store.checkout(session_id))
+        result = replayed_turn(game_state, data)
+        if result is not None:
+            # A resubmitted choice: send the turn it already produced
+            return sse_response(iter(finished_turn_events(game_state, result, data.get("turn"))))
+
+        result = speculated_turn(session_id, game_state, data)
+        if result is not None:
+            # Already played while the player read: send it in one go
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+            return sse_response(iter(finished_turn_events(game_state, result, data.get("turn"))))
+
+        try:
+            chosen_text, ai_prompt = apply_choice(game_state, data)
+        except ChoiceError as e:
+            return jsonify({"error": str(e)}), 400
+
+        path = scene_path(game_state, chosen_text)
+        result = cached_turn(game_state, path)
+        if result is not None:
+            # Another player already went this way: no need to stream
+            finish_choice(game_state, result)
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+            return sse_response(iter(finished_turn_events(game_state, result, data.get("turn"))))
+
+        # The stream now owns the checkout and releases it when it closes
+        return sse_response(
+            stream_turn(
+                game_state, chosen_text, ai_prompt, reset_on_ending=True, session_id=session_id, cache_path=path,
+                played=data
+            ),
+            checkout.pop_all()
+        )
+
+
+@app.route('/custom_action_stream', methods=['POST'])
+@timed_turn("custom_action_stream")
+def custom_action_stream():
+    """Streaming variant of /custom_action"""
+    admission.check()
+    data = request.get_json()
+    session_id = data.get("session_id")
+    with ExitStack() as checkout:
+        game_state = checkout.enter_context(session_store.checkout(session_id))
+        result = replayed_turn(game_state, data)
+        if result is not None:
+            # A resubmitted action: send the turn it already produced
+            return sse_response(iter(finished_turn_events(game_state, result, data.get("turn"))))
+        try:
+            action, ai_prompt = apply_custom_action(game_state, data)
+        except ChoiceError as e:
+            return jsonify({"error": str(e)}), 400
+        speculator.discard(session_id)
+
+        # The stream now owns the checkout and releases it when it closes
+        return sse_response(
+            stream_turn(game_state, action, ai_prompt, session_id=session_id, played=data), checkout.pop_all()
+        )
+
+@app.route('/save_game', methods=['POST'])
+def save_game():
+    """Save the current game state"""
+    data = request.get_json()
+    session_id = data.get("session_id")
+    
+    game_state = session_store.get(session_id) if session_id else None
+    if game_state is None:
+        return jsonify({"error": "Invalid session"}), 400
+    
+    # The signed snapshot lets /load_game resume this exact scene without the LLM
+    return jsonify({
+        "session_id": session_id,
+        "game_state": game_state.save_dict(),
+        "snapshot": snapshots.dump(game_state.to_dict())
+    })
+
+@app.route("/", methods=["GET", "POST"])
+def index():
+    if request.method == "POST":
+        # handle form input or game logic
+        user_input = request.form.get("user_input", "")
+        prompt = f"{user_input}\nWhat happens next?"
+        ai_response = generate_ai_content(prompt, stage="index")
+        return render_template("index.html", ai_output=ai_response)
+    
+    # Default GET request (first page load)
+    return render_template("index1.html", ai_output="Welcome to The Crystal Seeker!")
+
+
+@app.route('/load_game', methods=['POST'])
+@timed_turn("load_game")
+def load_game():
+    """Load a saved game, resuming its snapshot's scene or regenerating one"""
+    data = request.get_json()
+    session_id = data.get("session_id")
+    try:
+        game_state_data, result = restore_snapshot(data)
+    except SnapshotError as e:
+        snapshot_loads_total.inc(outcome="rejected")
+        print(f"Rejected save snapshot: {str(e)}")
+        return jsonify({"error": "Invalid save code"}), 400
+
+    if not session_id or not game_state_data:
+        return jsonify({"error": "Invalid session or game state"}), 400
+    # Create a new game state and populate it
+    game_state = GameState()
+    try:
+        game_state.from_dict(game_state_data)
+    except ValueError as e:
+        snapshot_loads_total.inc(outcome="rejected")
+        print(f"Rejected game state: {str(e)}")
+        return jsonify({"error": "Invalid game state"}), 400
+    if result is None:
+        # Only a regenerated scene needs the LLM
+        admission.check()
+    snapshot_loads_total.inc(outcome="restored" if result is not None else "regenerated")
+
+    with session_store.lock(session_id):
+        speculator.discard(session_id)
+
+        if result is None:
+            # Generate options for the current state
+            ai_prompt = "The player has returned to the game. Remind them of their current situation and provide options."
+
+            result = generate_narrative(
+                game_state,
+                "continue the adventure",
+                ai_prompt
+            )
+            remember_turn(game_state, result)
+        session_store.put(session_id, game_state)
+        speculate_next(session_id, game_state, result)
+
+    return jsonify({
+        "session_id": session_id,
+        "narrative": result["narrative"],
+        "scene_description": result["scene_description"],
+        "options": result["options"],
+        **state_fields(game_state)
+    })
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus metrics for this process"""
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/health')
+def health():
+    with turn_stats_lock:
+        stats = dict(turn_stats)
+    return jsonify({
+        "status": "ok",
+        "turn_stats": stats,
+        "admission": admission.stats(),
+        "sessions": session_store.stats(),
+        "opening_pool": opening_pool.stats(),
+        "scene_cache": scene_cache.stats(),
+        "scene_index": scene_index.stats(),
+        "speculation": speculator.stats(),
+        "ending_classifier": ending_classifier.stats(),
+        "models": model_router.stats(),
+        "resilience": resilience.stats(),
+        "llm_traffic": llm_traffic.stats()
+    })
+
+if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
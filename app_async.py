@@ -0,0 +1,975 @@
+"""
+ASGI serving mode for 'Marvel: Legacy Awakened'.
+
+Same routes and game logic as app1.py, but every LLM call is awaited on
+AsyncOpenAI instead of pinning a worker thread, so one process can hold
+thousands of sessions waiting on upstream. Needs quart and quart-cors on
+top of app1's dependencies; run it with an ASGI server, e.g.
+
+    uvicorn app_async:app --host 0.0.0.0 --port 5000
+
+With the default in-memory session store, run a single worker.
+"""
+import asyncio
+import copy
+import functools
+import os
+import time
+import weakref
+from concurrent.futures import Future
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from quart import Quart, Response, jsonify, request
+from quart_cors import cors
+
+from admission import AsyncAdmission, ServerBusy
+from compression import COMPRESS_MIN_BYTES, acompress_stream, choose_encoding, compress, compressible
+from llm_backend import LLM_BACKEND, FakeAsyncOpenAI
+from metrics import Timeline, current_timeline, span, timeline
+from model_routing import is_overloaded
+from resilience import Attempt, Resilience
+from session_store import LEASE_POLL_SECONDS, SESSION_LOCK_TIMEOUT, SessionBusy
+from snapshot import SnapshotError
+from speculation import AsyncSpeculator
+from warm_pool import AsyncWarmPool
+from app1 import (
+    AI_ERROR_TEXT,
+    LLM_CALL_TIMEOUT,
+    MULTI_CALL_ROUND_TRIPS,
+    OPENING_CHOICE,
+    OPENING_POOL_LOW_WATER,
+    OPENING_POOL_MAX_AGE,
+    OPENING_POOL_PATH,
+    OPENING_POOL_SIZE,
+    OPENAI_MAX_RETRIES,
+    OPENAI_TIMEOUT,
+    SPECULATE_BRANCHES,
+    SPECULATE_MAX_INFLIGHT,
+    SPECULATE_TTL,
+    LLMCallFailed,
+    StaleTurn,
+    TURN_SCHEMA,
+    ChoiceError,
+    GameState,
+    admission_gauges,
+    advance_turn,
+    apply_choice,
+    apply_custom_action,
+    assemble_turn,
+    cache_turn,
+    cached_turn,
+    chat_messages,
+    check_ending,
+    claim_speculation as thread_claim_speculation,
+    client,
+    context_prompt,
+    description_prompt,
+    ending_classifier,
+    ending_narrative_prompt,
+    ending_prompt,
+    ending_type_for,
+    error_turn,
+    finish_choice,
+    finish_turn,
+    llm_traffic,
+    metrics_registry,
+    model_router,
+    narrative_prompt,
+    opening_fingerprint,
+    pooled_opening as thread_pooled_opening,
+    result_events,
+    scene_cache,
+    scene_index,
+    scene_path,
+    openai_pool_limits,
+    options_prompt,
+    parse_json_object,
+    record_llm_call,
+    record_reused_call,
+    record_turn,
+    remember_turn,
+    repair_turn,
+    replayed_turn,
+    resilience as thread_resilience,
+    restore_snapshot,
+    reused_attempt,
+    session_store,
+    snapshot_loads_total,
+    snapshots,
+    settle_ending,
+    settle_llm_call,
+    speculate_next as thread_speculate_next,
+    sse_event,
+    start_opening_pool,
+    state_fields,
+    store_llm_call,
+    store_llm_reply,
+    story_framework,
+    structured_turn_prompt,
+    structured_turn_result,
+    track_usage,
+    turn_failed,
+    turn_response_format,
+    turn_stats,
+    turn_stats_lock,
+)
+
+app = Quart(__name__)
+app = cors(app)
+
+if LLM_BACKEND == "fake":
+    # Shares the sync fake's settings and counters
+    async_client = FakeAsyncOpenAI(client.llm)
+else:
+    async_client = AsyncOpenAI(
+        api_key=os.getenv("OPENAI_API_KEY"),
+        timeout=OPENAI_TIMEOUT,
+        max_retries=OPENAI_MAX_RETRIES,
+        http_client=DefaultAsyncHttpxClient(limits=openai_pool_limits())
+    )
+# Caps concurrent LLM calls on this event loop
+admission = AsyncAdmission()
+admission_gauges.bind(admission)
+# Retries and hedging for this event loop, behind the same circuit breaker as app1's threads
+resilience = Resilience(spare_capacity=lambda: admission.stats()["waiting"] == 0, breaker=thread_resilience.breaker)
+# Per-session locks for this event loop; the store's thread locks would block it
+session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+async def store_io(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run a session store call, in a thread when the store blocks on I/O (SQLite)"""
+    if session_store.blocking_io:
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
+
+
+@asynccontextmanager
+async def locked(session_id: str) -> AsyncIterator[None]:
+    """
+    Async counterpart of SessionStore.lock: an asyncio.Lock within this
+    process, then the store's lease across worker processes, polled without
+    blocking the event loop.
+    """
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = session_locks[session_id] = asyncio.Lock()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SESSION_LOCK_TIMEOUT
+    try:
+        await asyncio.wait_for(lock.acquire(), timeout=SESSION_LOCK_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise SessionBusy(session_id)
+    try:
+        while not await store_io(session_store.try_lease, session_id):
+            if loop.time() > deadline:
+                raise SessionBusy(session_id)
+            await asyncio.sleep(LEASE_POLL_SECONDS)
+        try:
+            yield
+        finally:
+            await store_io(session_store.release_lease, session_id)
+    finally:
+        lock.release()
+
+
+@asynccontextmanager
+async def checkout(session_id: Optional[str]) -> AsyncIterator[Optional[GameState]]:
+    """Async counterpart of SessionStore.checkout"""
+    if not session_id:
+        yield None
+        return
+    async with locked(session_id):
+        game_state = await store_io(session_store.get, session_id)
+        if game_state is None:
+            yield None
+            return
+        savepoint = session_store.savepoint(game_state)
+        try:
+            yield game_state
+        except BaseException:
+            await store_io(session_store.rollback, session_id, savepoint)
+            raise
+        await store_io(session_store.put, session_id, game_state)
+
+
+async def request_llm(stage: str, model: str, timeout: float, **request) -> Attempt:
+    """Async counterpart of app1.request_llm; a cancelled request accounts for itself"""
+    attempt = Attempt(model)
+    try:
+        async with admission.slot() as attempt.waited:
+            attempt.response = await async_client.chat.completions.create(model=model, timeout=timeout, **request)
+    except asyncio.CancelledError:
+        # Never reported to the breaker: if this was its probe, the next call probes instead
+        resilience.breaker.abandon()
+        record_llm_call(stage, model, attempt.started_at, attempt.waited, None, "cancelled")
+        raise
+    except Exception as e:
+        attempt.error = e
+    attempt.seconds = time.monotonic() - attempt.started_at
+    return attempt
+
+
+async def call_llm(stage: str, **request) -> Attempt:
+    """Async counterpart of app1.call_llm"""
+    attempt = reused_attempt(stage, request)
+    if attempt is not None:
+        await asyncio.sleep(attempt.seconds)
+        record_reused_call(stage, attempt)
+        return attempt
+    started_at = time.monotonic()
+    attempt = await resilience.acall(
+        stage, model_router.chain(stage), model_router.route(stage).timeout,
+        functools.partial(request_llm, stage, **request), functools.partial(settle_llm_call, stage)
+    )
+    store_llm_call(stage, request, attempt, started_at)
+    return attempt
+
+
+async def generate_ai_content(prompt: str, temperature: float = 0.7, stage: str = "other") -> str:
+    """Async counterpart of app1.generate_ai_content"""
+    route = model_router.route(stage)
+    attempt = await call_llm(
+        stage,
+        messages=chat_messages(prompt),
+        temperature=route.temperature_or(temperature),
+        max_tokens=route.max_tokens,
+        top_p=1.0
+    )
+    if not attempt.ok:
+        return AI_ERROR_TEXT
+    return attempt.response.choices[0].message.content.strip()
+
+
+async def stream_ai_content(prompt: str, temperature: float = 0.7, stage: str = "other") -> AsyncIterator[str]:
+    """Async counterpart of app1.stream_ai_content"""
+    route = model_router.route(stage)
+    request = {
+        "messages": chat_messages(prompt),
+        "temperature": route.temperature_or(temperature),
+        "max_tokens": route.max_tokens,
+        "top_p": 1.0
+    }
+    reused = reused_attempt(stage, request)
+    if reused is not None:
+        await asyncio.sleep(reused.seconds)
+        record_reused_call(stage, reused)
+        yield reused.response.choices[0].message.content if reused.ok else AI_ERROR_TEXT
+        return
+    models = model_router.chain(stage)
+    give_up_at = time.monotonic() + route.timeout
+    number = 0
+    while True:
+        model = models[number % len(models)]
+        if not resilience.breaker.allow():
+            record_llm_call(stage, model, time.monotonic(), 0.0, None, "short_circuited")
+            yield AI_ERROR_TEXT
+            return
+        started_at = time.monotonic()
+        waited = 0.0
+        usage = None
+        first_token = None
+        outcome = "error"
+        pieces = []
+        try:
+            async with admission.slot() as waited:
+                stream = await async_client.chat.completions.create(
+                    model=model,
+                    timeout=give_up_at - time.monotonic(),
+                    stream=True,
+                    stream_options={"include_usage": True},
+                    **request
+                )
+                async for chunk in stream:
+                    if getattr(chunk, "usage", None) is not None:
+                        usage = chunk.usage
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token is None:
+                            first_token = time.monotonic() - started_at
+                        pieces.append(chunk.choices[0].delta.content)
+                        yield chunk.choices[0].delta.content
+            outcome = "ok"
+            resilience.observe(True)
+            store_llm_reply(stage, request, model, "".join(pieces), usage, started_at)
+            return
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"
+            resilience.breaker.abandon()
+            raise
+        except Exception as e:
+            resilience.observe(False, e)
+            if is_overloaded(e):
+                model_router.overloaded(model)
+            number += 1
+            delay = resilience.retry_delay(number, len(models), e, give_up_at) if first_token is None else None
+            if delay is None:
+                print(f"Error streaming from OpenAI API ({stage}, {model}): {str(e)}")
+                store_llm_reply(stage, request, model, None, usage, started_at, e)
+                yield AI_ERROR_TEXT
+                return
+            outcome = "retried"
+        finally:
+            record_llm_call(stage, model, started_at, waited, usage, outcome, first_token)
+        await asyncio.sleep(delay)
+
+
+async def generate_structured_content(prompt: str, schema: Dict[str, Any], name: str, temperature: float = 0.7,
+                                      stage: str = "structured") -> Optional[Dict[str, Any]]:
+    """Async counterpart of app1.generate_structured_content"""
+    route = model_router.route(stage)
+    attempt = await call_llm(
+        stage,
+        messages=chat_messages(prompt),
+        temperature=route.temperature_or(temperature),
+        max_tokens=route.max_tokens,
+        top_p=1.0,
+        response_format=turn_response_format(schema, name)
+    )
+    if not attempt.ok:
+        raise LLMCallFailed(f"{stage} call failed: {str(attempt.error)}")
+    return parse_json_object(attempt.response.choices[0].message.content or "")
+
+
+async def await_call(task: Awaitable, fallback: Any, deadline: float, label: str) -> Any:
+    """Wait for a fanned-out call until the shared deadline, returning `fallback` on failure"""
+    try:
+        return await asyncio.wait_for(task, timeout=max(0.0, deadline - asyncio.get_running_loop().time()))
+    except asyncio.TimeoutError:
+        print(f"Timed out waiting for {label}")
+    except Exception as e:
+        print(f"Error generating {label}: {str(e)}")
+    return fallback
+
+
+async def generate_turn_structured(game_state: GameState, choice: str, ai_prompt: str) -> Optional[Dict[str, Any]]:
+    """Async counterpart of app1.generate_turn_structured"""
+    data = await generate_structured_content(
+        structured_turn_prompt(game_state, choice, ai_prompt), TURN_SCHEMA, "story_turn", stage="turn"
+    )
+    turn = repair_turn(data) if data else None
+    if turn is None:
+        return None
+
+    ending_narrative = turn["ending_narrative"]
+    if turn["ending"] != "continue" and not ending_narrative:
+        ending_narrative = await generate_ai_content(ending_narrative_prompt(turn["ending"]), stage="ending_narrative")
+    return structured_turn_result(game_state, turn, ending_narrative)
+
+
+async def complete_turn(game_state: GameState, choice: str, narrative_text: str) -> Dict[str, Any]:
+    """Async counterpart of app1.complete_turn, fanning out as tasks on the event loop"""
+    story_context = game_state.story_context
+    deadline = asyncio.get_running_loop().time() + LLM_CALL_TIMEOUT
+
+    description_task = asyncio.create_task(
+        generate_ai_content(description_prompt(narrative_text), 0.6, "description")
+    )
+    context_task = asyncio.create_task(
+        generate_ai_content(context_prompt(story_context, choice, narrative_text), 0.5, "summary")
+    )
+    verdict, confidence, decision = check_ending(game_state, narrative_text)
+    if decision is None:
+        ending_task = asyncio.create_task(
+            generate_ai_content(ending_prompt(narrative_text, story_context), 0.4, "ending")
+        )
+    # Started speculatively; cancelled if the story turns out to be over
+    options_task = asyncio.create_task(
+        generate_ai_content(options_prompt(game_state, narrative_text), 0.8, "options")
+    )
+
+    if decision is None:
+        reply = await await_call(ending_task, None, deadline, "ending check")
+        decision = settle_ending(game_state, narrative_text, verdict, confidence, reply)
+    ending_type = ending_type_for(decision)
+
+    ending_narrative = None
+    options_text = None
+    if ending_type:
+        options_task.cancel()
+        ending_narrative = await generate_ai_content(ending_narrative_prompt(ending_type), stage="ending_narrative")
+    else:
+        options_text = await await_call(options_task, None, deadline, "options")
+
+    scene_description = await await_call(
+        description_task,
+        "You're standing on the edge of something bigger — the fate of the multiverse is at stake.",
+        deadline,
+        "scene description"
+    )
+    new_context = await await_call(context_task, "", deadline, "context summary")
+
+    return assemble_turn(game_state, narrative_text, ending_narrative, options_text, scene_description, new_context)
+
+
+async def compact_context(game_state: GameState) -> None:
+    """Async counterpart of app1.compact_context"""
+    prompt = game_state.context.fold_prompt()
+    if prompt is None:
+        return
+    summary = await generate_ai_content(prompt, temperature=0.3, stage="fold")
+    game_state.context.apply_fold(None if summary == AI_ERROR_TEXT else summary)
+
+
+async def generate_narrative(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """Async counterpart of app1.generate_narrative"""
+    try:
+        result = await generate_turn_structured(game_state, choice, ai_prompt)
+    except LLMCallFailed as e:
+        print(f"Error in narrative generation: {str(e)}")
+        return error_turn()
+    if result is None:
+        result = await generate_narrative_multi_call(game_state, choice, ai_prompt)
+        result["round_trips_saved"] = record_turn(MULTI_CALL_ROUND_TRIPS + 1, structured=False)
+
+    await compact_context(game_state)
+    return result
+
+
+async def generate_narrative_multi_call(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """Async counterpart of app1.generate_narrative_multi_call"""
+    try:
+        narrative_text = await generate_ai_content(narrative_prompt(game_state, choice, ai_prompt), stage="narrative")
+        if narrative_text == AI_ERROR_TEXT:
+            raise RuntimeError("narrative call failed")
+        result = await complete_turn(game_state, choice, narrative_text)
+    except Exception as e:
+        print(f"Error in narrative generation: {str(e)}")
+        result = error_turn()
+    return result
+
+
+async def play_choice(game_state: GameState, choice: str, ai_prompt: str) -> Dict[str, Any]:
+    """Async counterpart of app1.play_choice"""
+    path = scene_path(game_state, choice)
+    result = cached_turn(game_state, path)
+    if result is None:
+        result = await generate_narrative(game_state, choice, ai_prompt)
+        cache_turn(path, game_state, result)
+    return result
+
+
+async def stream_turn(game_state: GameState, choice: str, ai_prompt: str, reset_on_ending: bool = False,
+                      session_id: Optional[str] = None, cache_path: Optional[List[str]] = None,
+                      played: Optional[Dict[str, Any]] = None) -> AsyncIterator[str]:
+    """Async counterpart of app1.stream_turn"""
+    try:
+        narrative_text = ""
+        async for delta in stream_ai_content(narrative_prompt(game_state, choice, ai_prompt), stage="narrative"):
+            narrative_text += delta
+            yield sse_event("token", {"text": delta})
+        if AI_ERROR_TEXT in narrative_text:
+            raise RuntimeError("narrative stream failed")
+
+        result = await complete_turn(game_state, choice, narrative_text.strip())
+        await compact_context(game_state)
+        cache_turn(cache_path, game_state, result)
+        if reset_on_ending:
+            finish_choice(game_state, result)
+        remember_turn(game_state, result)
+        if played is not None:
+            advance_turn(game_state, played)
+        if session_id:
+            speculate_next(session_id, game_state, result)
+
+        if result["is_ending"]:
+            yield sse_event("narrative", {"narrative": result["narrative"]})
+        for event in result_events(game_state, result, played.get("turn") if played is not None else None):
+            yield event
+    except Exception as e:
+        print(f"Error streaming turn: {str(e)}")
+        yield sse_event("error", {"error": "Something went wrong in your Marvel journey, please try again"})
+
+
+async def speculate_branch(state: Dict[str, Any], option: Dict[str, str]) -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+    """Async counterpart of app1.speculate_branch; its calls take this loop's admission slots"""
+    game_state = GameState()
+    game_state.from_dict(copy.deepcopy(state))
+    with track_usage() as usage:
+        chosen_text, ai_prompt = apply_choice(game_state, {"choice_index": 0, "current_options": [option]})
+        result = await play_choice(game_state, chosen_text, ai_prompt)
+    if turn_failed(result):
+        raise RuntimeError("speculative turn failed")
+    finish_choice(game_state, result)
+    remember_turn(game_state, result)
+    return game_state.to_dict(), result, sum(usage)
+
+
+# Branches are tasks on this loop, spending its spare capacity rather than app1's threads
+speculator = AsyncSpeculator(
+    speculate_branch,
+    branches=SPECULATE_BRANCHES,
+    max_inflight=SPECULATE_MAX_INFLIGHT,
+    ttl=SPECULATE_TTL,
+    spare_capacity=lambda: admission.stats()["waiting"] == 0
+)
+
+
+def speculate_next(session_id: str, game_state: GameState, result: Dict[str, Any]) -> None:
+    """app1.speculate_next on this loop's speculator"""
+    thread_speculate_next(session_id, game_state, result, speculator)
+
+
+def claim_speculation(session_id: str, game_state: Optional[GameState], data: Dict[str, Any]) -> Optional[Future]:
+    """app1.claim_speculation on this loop's speculator"""
+    return thread_claim_speculation(session_id, game_state, data, speculator)
+
+
+async def speculated_turn(session_id: str, game_state: Optional[GameState],
+                          data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Async counterpart of app1.speculated_turn; waits on the branch without blocking the loop"""
+    claimed = claim_speculation(session_id, game_state, data)
+    if claimed is None:
+        return None
+    try:
+        with span("speculation_wait"):
+            new_state, result = await asyncio.wrap_future(claimed)
+    except Exception as e:
+        print(f"Error in speculative turn, generating live: {str(e)}")
+        return None
+    game_state.from_dict(new_state)
+    return result
+
+
+async def generate_opening(game_state: GameState) -> Dict[str, Any]:
+    """Async counterpart of app1.generate_opening"""
+    scene_data = story_framework.get(game_state.current_scene)
+    return await generate_narrative(
+        game_state,
+        OPENING_CHOICE,
+        scene_data.get("ai_prompt", "Create an action-packed opening for a Marvel superhero origin.")
+    )
+
+
+async def pregenerate_opening() -> Dict[str, Any]:
+    """Async counterpart of app1.pregenerate_opening; its calls take this loop's admission slots"""
+    game_state = GameState()
+    result = await generate_opening(game_state)
+    if turn_failed(result):
+        raise RuntimeError("opening generation failed")
+    if result.get("is_ending", False):
+        raise RuntimeError("opening generation ended the story")
+    return {"result": result, "game_state": game_state.to_dict()}
+
+
+# Refilled by a task on this loop rather than app1's thread, so refills count against this loop's admission
+opening_pool = AsyncWarmPool(
+    pregenerate_opening,
+    OPENING_POOL_PATH,
+    target=OPENING_POOL_SIZE,
+    low_water=OPENING_POOL_LOW_WATER,
+    fingerprint=opening_fingerprint,
+    max_age=OPENING_POOL_MAX_AGE
+)
+
+
+def pooled_opening() -> Optional[Tuple[GameState, Dict[str, Any]]]:
+    """app1.pooled_opening from this loop's pool"""
+    return thread_pooled_opening(opening_pool)
+
+
+def timed_turn(route: str):
+    """Async counterpart of app1.timed_turn"""
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            with timeline(route) as turn:
+                response = await view(*args, **kwargs)
+            if not turn.deferred:
+                finish_turn(turn)
+            return response
+        return wrapper
+    return decorator
+
+
+async def timed_events(turn: Timeline, events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Keep a turn's timeline current while its stream is produced"""
+    current_timeline.set(turn)
+    try:
+        async for event in events:
+            yield event
+    finally:
+        current_timeline.set(None)
+        finish_turn(turn)
+
+
+def sse_response(events: AsyncIterator[str]) -> Response:
+    """
+    Wrap an SSE generator in an unbuffered streaming response, compressed
+    event by event when the client accepts it; a timed turn is finished when it ends
+    """
+    turn = current_timeline.get()
+    if turn is not None:
+        turn.deferred = True
+        events = timed_events(turn, events)
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is not None:
+        events = acompress_stream(events, encoding)
+    response = Response(events, mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    response.vary.add("Accept-Encoding")
+    if encoding is not None:
+        response.headers["Content-Encoding"] = encoding
+    response.timeout = None
+    return response
+
+
+@app.before_serving
+async def warm_opening_pool() -> None:
+    """Start filling the opening pool when the server starts, rather than on the first miss"""
+    start_opening_pool(opening_pool)
+
+
+@app.after_request
+async def compress_response(response: Response) -> Response:
+    """Async counterpart of app1.compress_response"""
+    if not isinstance(response.response, response.data_body_class) or not compressible(response.mimetype):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if encoding is None or "Content-Encoding" in response.headers:
+        return response
+    data = await response.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return response
+    response.set_data(compress(data, encoding))
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+
+@app.errorhandler(StaleTurn)
+async def stale_turn(e: StaleTurn):
+    return jsonify({"error": str(e), "turn": e.turn}), 409
+
+
+@app.errorhandler(SessionBusy)
+async def session_busy(e: SessionBusy):
+    """Another request is still playing a turn on this session"""
+    return jsonify({"error": "Session is busy, please wait for the current turn"}), 409
+
+
+@app.errorhandler(ServerBusy)
+async def server_busy(e: ServerBusy):
+    """Shed load with a 503 instead of queueing turns we can't serve soon"""
+    return jsonify({"error": str(e)}), 503, {"Retry-After": str(e.retry_after)}
+
+
+@app.route('/start_game', methods=['POST'])
+@timed_turn("start_game")
+async def start_game():
+    """Initialize a new Marvel superhero game session"""
+    admission.check()
+    session_id = os.urandom(16).hex()
+    game_state = GameState()
+
+    # Serve the opening scene, pre-generated if the index or the pool has one
+    opening = pooled_opening()
+    if opening is not None:
+        game_state, result = opening
+    else:
+        result = await generate_opening(game_state)
+    remember_turn(game_state, result)
+    await store_io(session_store.put, session_id, game_state)
+    speculate_next(session_id, game_state, result)
+
+    return jsonify({
+        "session_id": session_id,
+        "narrative": result["narrative"],
+        "scene_description": result["scene_description"],
+        "options": result["options"],
+        **state_fields(game_state)
+    })
+
+
+@app.route('/make_choice', methods=['POST'])
+@timed_turn("make_choice")
+async def make_choice():
+    """Process player choice and advance the story"""
+    admission.check()
+    data = await request.get_json()
+    session_id = data.get("session_id")
+    async with checkout(session_id) as game_state:
+        result = replayed_turn(game_state, data)
+        if result is None:
+            result = await speculated_turn(session_id, game_state, data)
+            if result is None:
+                try:
+                    chosen_text, ai_prompt = apply_choice(game_state, data)
+                except ChoiceError as e:
+                    return jsonify({"error": str(e)}), 400
+
+                result = await play_choice(game_state, chosen_text, ai_prompt)
+                finish_choice(game_state, result)
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+
+        return jsonify({
+            "narrative": result["narrative"],
+            "scene_description": result["scene_description"],
+            "options": result["options"],
+            **state_fields(game_state, data.get("turn")),
+            "is_ending": result.get("is_ending", False)
+        })
+
+
+@app.route('/custom_action', methods=['POST'])
+@timed_turn("custom_action")
+async def custom_action():
+    """Process a custom player action"""
+    admission.check()
+    data = await request.get_json()
+    session_id = data.get("session_id")
+    async with checkout(session_id) as game_state:
+        result = replayed_turn(game_state, data)
+        if result is None:
+            try:
+                action, ai_prompt = apply_custom_action(game_state, data)
+            except ChoiceError as e:
+                return jsonify({"error": str(e)}), 400
+            speculator.discard(session_id)
+
+            result = await generate_narrative(game_state, action, ai_prompt)
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+
+        return jsonify({
+            "narrative": result["narrative"],
+            "scene_description": result["scene_description"],
+            "options": result["options"],
+            **state_fields(game_state, data.get("turn")),
+            "is_ending": result.get("is_ending", False)
+        })
+
+
+@app.route('/start_game_stream', methods=['POST'])
+@timed_turn("start_game_stream")
+async def start_game_stream():
+    """Streaming variant of /start_game"""
+    admission.check()
+    session_id = os.urandom(16).hex()
+
+    opening = pooled_opening()
+    if opening is not None:
+        # A pre-generated opening is already complete: send it in one go
+        game_state, result = opening
+        remember_turn(game_state, result)
+        await store_io(session_store.put, session_id, game_state)
+        speculate_next(session_id, game_state, result)
+
+        async def pooled_events():
+            yield sse_event("session", {"session_id": session_id})
+            yield sse_event("token", {"text": result["narrative"]})
+            for event in result_events(game_state, result):
+                yield event
+
+        return sse_response(pooled_events())
+
+    await store_io(session_store.put, session_id, GameState())
+
+    async def events():
+        async with checkout(session_id) as game_state:
+            scene_data = story_framework.get(game_state.current_scene)
+            yield sse_event("session", {"session_id": session_id})
+            async for event in stream_turn(
+                game_state,
+                OPENING_CHOICE,
+                scene_data.get("ai_prompt", "Create an action-packed opening for a Marvel superhero origin."),
+                session_id=session_id
+            ):
+                yield event
+
+    return sse_response(events())
+
+
+async def stream_choice(data: Dict[str, Any], apply, reset_on_ending: bool,
+                       speculated: bool = False) -> AsyncIterator[str]:
+    """
+    Hold the session for the whole stream. Quart has no close hook to release
+    a lock taken in the route, so the generator takes it itself. Validation
+    errors (StaleTurn, ChoiceError) are raised before the first item, for
+    choice_stream() to answer with app1's status codes; a choice that is
+    played live first yields an empty marker, so the headers go out at once.
+    """
+    session_id = data.get("session_id")
+    async with checkout(session_id) as game_state:
+        result = replayed_turn(game_state, data)
+        if result is not None:
+            # A resubmitted choice: send the turn it already produced
+            yield sse_event("token", {"text": result["narrative"]})
+            for event in result_events(game_state, result, data.get("turn")):
+                yield event
+            return
+
+        result = await speculated_turn(session_id, game_state, data) if speculated else None
+        if result is not None:
+            # Already played while the player read: send it in one go
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+            yield sse_event("token", {"text": result["narrative"]})
+            for event in result_events(game_state, result, data.get("turn")):
+                yield event
+            return
+
+        choice, ai_prompt = apply(game_state, data)
+        yield ""
+        if not speculated:
+            speculator.discard(session_id)
+
+        path = scene_path(game_state, choice)
+        result = cached_turn(game_state, path)
+        if result is not None:
+            # Another player already went this way: no need to stream
+            if reset_on_ending:
+                finish_choice(game_state, result)
+            remember_turn(game_state, result)
+            advance_turn(game_state, data)
+            speculate_next(session_id, game_state, result)
+            yield sse_event("token", {"text": result["narrative"]})
+            for event in result_events(game_state, result, data.get("turn")):
+                yield event
+            return
+
+        async for event in stream_turn(
+            game_state, choice, ai_prompt, reset_on_ending=reset_on_ending, session_id=session_id, cache_path=path,
+            played=data
+        ):
+            yield event
+
+
+async def choice_stream(events: AsyncIterator[str]):
+    """
+    Run stream_choice() up to its first item before committing to a 200, so a
+    stale turn gets a 409 and a bad choice or session a 400, as in app1
+    """
+    try:
+        first = await events.__anext__()
+    except ChoiceError as e:
+        return jsonify({"error": str(e)}), 400
+    except StopAsyncIteration:
+        first = ""
+
+    async def resumed() -> AsyncIterator[str]:
+        try:
+            if first:
+                yield first
+            async for event in events:
+                yield event
+        finally:
+            # Releases the session as soon as the client goes away
+            await events.aclose()
+
+    return sse_response(resumed())
+
+
+@app.route('/make_choice_stream', methods=['POST'])
+@timed_turn("make_choice_stream")
+async def make_choice_stream():
+    """Streaming variant of /make_choice"""
+    admission.check()
+    return await choice_stream(
+        stream_choice(await request.get_json(), apply_choice, reset_on_ending=True, speculated=True)
+    )
+
+
+@app.route('/custom_action_stream', methods=['POST'])
+@timed_turn("custom_action_stream")
+async def custom_action_stream():
+    """Streaming variant of /custom_action"""
+    admission.check()
+    return await choice_stream(stream_choice(await request.get_json(), apply_custom_action, reset_on_ending=False))
+
+
+@app.route('/save_game', methods=['POST'])
+async def save_game():
+    """Save the current game state"""
+    data = await request.get_json()
+    session_id = data.get("session_id")
+
+    game_state = await store_io(session_store.get, session_id) if session_id else None
+    if game_state is None:
+        return jsonify({"error": "Invalid session"}), 400
+
+    return jsonify({
+        "session_id": session_id,
+        "game_state": game_state.save_dict(),
+        "snapshot": snapshots.dump(game_state.to_dict())
+    })
+
+
+@app.route('/load_game', methods=['POST'])
+@timed_turn("load_game")
+async def load_game():
+    """Load a saved game, resuming its snapshot's scene or regenerating one"""
+    data = await request.get_json()
+    session_id = data.get("session_id")
+    try:
+        game_state_data, result = restore_snapshot(data)
+    except SnapshotError as e:
+        snapshot_loads_total.inc(outcome="rejected")
+        print(f"Rejected save snapshot: {str(e)}")
+        return jsonify({"error": "Invalid save code"}), 400
+
+    if not session_id or not game_state_data:
+        return jsonify({"error": "Invalid session or game state"}), 400
+    game_state = GameState()
+    try:
+        game_state.from_dict(game_state_data)
+    except ValueError as e:
+        snapshot_loads_total.inc(outcome="rejected")
+        print(f"Rejected game state: {str(e)}")
+        return jsonify({"error": "Invalid game state"}), 400
+    if result is None:
+        admission.check()
+    snapshot_loads_total.inc(outcome="restored" if result is not None else "regenerated")
+
+    async with locked(session_id):
+        speculator.discard(session_id)
+
+        if result is None:
+            ai_prompt = "The player has returned to the game. Remind them of their current situation and provide options."
+            result = await generate_narrative(game_state, "continue the adventure", ai_prompt)
+            remember_turn(game_state, result)
+        await store_io(session_store.put, session_id, game_state)
+        speculate_next(session_id, game_state, result)
+
+    return jsonify({
+        "session_id": session_id,
+        "narrative": result["narrative"],
+        "scene_description": result["scene_description"],
+        "options": result["options"],
+        **state_fields(game_state)
+    })
+
+
+@app.route('/metrics')
+async def metrics():
+    """Prometheus metrics for this process"""
+    return Response(metrics_registry.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route('/health')
+async def health():
+    with turn_stats_lock:
+        stats = dict(turn_stats)
+    return jsonify({
+        "status": "ok",
+        "turn_stats": stats,
+        "admission": admission.stats(),
+        "sessions": await store_io(session_store.stats),
+        "opening_pool": opening_pool.stats(),
+        "scene_cache": scene_cache.stats(),
+        "scene_index": scene_index.stats(),
+        "speculation": speculator.stats(),
+        "ending_classifier": ending_classifier.stats(),
+        "models": model_router.stats(),
+        "resilience": resilience.stats(),
+        "llm_traffic": llm_traffic.stats()
+    })
+
+
+if __name__ == '__main__':
+    app.run(debug=True)
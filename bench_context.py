@@ -0,0 +1,70 @@
+"""
+Prompt-size benchmark for the token-budgeted story context.
+
+Plays a long session offline (no API calls) and prints the size of the
+narrative prompt at checkpoints, for the old append-forever context and for
+the budgeted StoryContext. Run with:
+
+    python bench_context.py --turns 200
+"""
+import argparse
+import os
+import re
+
+# app1 builds an OpenAI client at import time; nothing here calls it
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from app1 import DEFAULT_STORY_CONTEXT, GameState, narrative_prompt
+from story_context import count_tokens
+
+EVENTS = [
+    "You overload the quantum dampener and the bunker lights die as Fury's voice crackles over comms.",
+    "Hydra agents breach the east wing; you shield Agent Hill and lose the Tesseract shard in the chaos.",
+    "Tony Stark patches into your suit, warning that the rift over Manhattan is doubling every hour.",
+    "A variant of yourself steps out of the rift, claiming the collapse started with your accident.",
+    "You trade the shard for safe passage, but Loki smiles a little too widely as the deal is sealed.",
+]
+
+
+def turn_event(turn: int) -> str:
+    """A context summary the size the model usually writes (1-2 sentences)"""
+    return f"Turn {turn}: {EVENTS[turn % len(EVENTS)]}"
+
+
+def fake_summarizer(prompt: str) -> str:
+    """Deterministic stand-in for the summary call: keeps the gist of each event"""
+    summary = re.search(r"Summary so far: (.*)", prompt).group(1)
+    events = re.search(r"Events to fold in: (.*)", prompt).group(1)
+    gist = [" ".join(sentence.split()[:10]) for sentence in re.split(r"(?<=\.)\s+", events) if sentence]
+    return " ".join(([] if summary == "(none yet)" else [summary]) + gist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=200)
+    args = parser.parse_args()
+
+    checkpoints = {1, 10, 25, 50, 100, 150, args.turns}
+    unbounded_context = DEFAULT_STORY_CONTEXT
+    game_state = GameState()
+
+    print(f"{'turn':>5} {'unbounded prompt':>17} {'budgeted prompt':>16} {'budgeted context':>17}")
+    for turn in range(1, args.turns + 1):
+        event = turn_event(turn)
+
+        # Old behaviour: story_context += " " + new_context, forever
+        unbounded_context += " " + event
+
+        game_state.add_context(event)
+        game_state.context.fold(fake_summarizer)
+
+        if turn in checkpoints:
+            old_state = GameState()
+            old_state.context.premise = unbounded_context
+            old_tokens = count_tokens(narrative_prompt(old_state, "press on", "Continue the adventure."))
+            new_tokens = count_tokens(narrative_prompt(game_state, "press on", "Continue the adventure."))
+            print(f"{turn:>5} {old_tokens:>17} {new_tokens:>16} {game_state.context.tokens():>17}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,385 @@
+"""
+Load and latency benchmark on the fake LLM backend.
+
+Plays --sessions games, each one /start_game followed by --turns
+/make_choice calls, with --concurrency games in flight at once. Reports
+p50/p95/p99 latency per route, turn throughput, LLM calls and tokens per
+turn, and memory per session. Nothing leaves the machine, and the same
+flags and --seed always produce the same LLM traffic, so runs can be
+compared from one change to the next:
+
+    python bench_load.py --sessions 200 --turns 10 --concurrency 32
+    python bench_load.py --stream --ttft-ms 300 --tokens-per-sec 80 --json results.json
+    python bench_load.py --turns 40 --compress
+
+Request and response bytes are reported per turn number, so payloads that
+grow with the length of a session show up as a rising last column.
+
+By default the app runs in-process. With --url the same load is sent over
+HTTP to a server started with LLM_BACKEND=fake (app1 or app_async).
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import threading
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100)
+    parser.add_argument("--turns", type=int, default=10, help="/make_choice calls per session")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--seed", default="0", help="seeds both the fake LLM and the players' choices")
+    parser.add_argument("--stream", action="store_true", help="use the *_stream routes and also time the first token")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process app")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    parser.add_argument("--compress", action="store_true", help="accept gzip/brotli responses")
+    # Fake LLM behaviour (defaults come from the FAKE_LLM_* settings)
+    parser.add_argument("--ttft-ms", type=float)
+    parser.add_argument("--ttft-sigma", type=float)
+    parser.add_argument("--tokens-per-sec", type=float)
+    parser.add_argument("--error-rate", type=float)
+    parser.add_argument("--ending-rate", type=float)
+    # Server-side optimizations are off unless asked for, so the baseline is stable
+    parser.add_argument("--opening-pool", type=int, default=0, help="OPENING_POOL_SIZE")
+    parser.add_argument("--scene-cache", type=int, default=0, help="SCENE_CACHE_MAX_PATHS")
+    parser.add_argument("--speculate", type=int, default=0, help="SPECULATE_BRANCHES")
+    return parser.parse_args()
+
+
+def configure(args: argparse.Namespace) -> None:
+    """Settings are read at import time, so this runs before app1 is imported"""
+    os.environ["LLM_BACKEND"] = "fake"
+    os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+    os.environ["FAKE_LLM_SEED"] = args.seed
+    for flag, name in [("ttft_ms", "FAKE_LLM_TTFT_MS"), ("ttft_sigma", "FAKE_LLM_TTFT_SIGMA"),
+                       ("tokens_per_sec", "FAKE_LLM_TOKENS_PER_SEC"), ("error_rate", "FAKE_LLM_ERROR_RATE"),
+                       ("ending_rate", "FAKE_LLM_ENDING_RATE")]:
+        if getattr(args, flag) is not None:
+            os.environ[name] = str(getattr(args, flag))
+    os.environ["OPENING_POOL_SIZE"] = str(args.opening_pool)
+    os.environ["OPENING_POOL_PATH"] = ""
+    os.environ["SCENE_CACHE_MAX_PATHS"] = str(args.scene_cache)
+    os.environ["SCENE_CACHE_DIR"] = ""
+    os.environ["SPECULATE_BRANCHES"] = str(args.speculate)
+    os.environ.setdefault("SESSION_STORE", "memory")
+
+
+def parse_sse(lines: List[str]) -> Dict[str, Any]:
+    """Fold a turn's SSE events into the same shape as the JSON routes return"""
+    result: Dict[str, Any] = {"narrative": ""}
+    event = None
+    for line in lines:
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            data = json.loads(line[len("data: "):])
+            if event == "token":
+                result["narrative"] += data["text"]
+            elif event == "error":
+                result["error"] = data["error"]
+            else:
+                result.update(data)
+    return result
+
+
+def accept_encoding(compress: bool) -> str:
+    if not compress:
+        return "identity"
+    try:
+        import brotli  # noqa: F401
+        return "br, gzip"
+    except ImportError:
+        return "gzip"
+
+
+def decoder(encoding: Optional[str]) -> Callable[[bytes], bytes]:
+    """Incremental decoder for a response's Content-Encoding"""
+    if encoding == "gzip":
+        return zlib.decompressobj(31).decompress
+    if encoding == "br":
+        import brotli
+        return brotli.Decompressor().process
+    return lambda chunk: chunk
+
+
+# What a post returns: status, parsed body, seconds (to the first token when streaming),
+# and the bytes sent and received on the wire
+PostResult = Tuple[int, Dict[str, Any], float, int, int]
+
+
+class InProcessTransport:
+    """Calls the Flask app directly; one per worker thread"""
+
+    def __init__(self, app, compress: bool = False):
+        self.client = app.test_client()
+        self.headers = {"Accept-Encoding": accept_encoding(compress)}
+
+    def post(self, path: str, body: Dict[str, Any], stream: bool) -> PostResult:
+        sent = len(json.dumps(body))
+        start = time.perf_counter()
+        response = self.client.post(path, json=body, buffered=False, headers=self.headers)
+        decode = decoder(response.headers.get("Content-Encoding"))
+        if not stream or response.status_code != 200:
+            raw = response.get_data()
+            try:
+                data = json.loads(decode(raw))
+            except ValueError:
+                data = {}
+            return response.status_code, data, time.perf_counter() - start, sent, len(raw)
+        first_token = None
+        received = 0
+        text = ""
+        for chunk in response.response:
+            received += len(chunk)
+            text += decode(chunk).decode("utf-8")
+            if first_token is None and "event: token" in text:
+                first_token = time.perf_counter() - start
+        response.close()
+        return (response.status_code, parse_sse(text.splitlines()), first_token or time.perf_counter() - start,
+                sent, received)
+
+
+class HttpTransport:
+    """Sends the same requests to a running server"""
+
+    def __init__(self, url: str, compress: bool = False):
+        import httpx
+        self.client = httpx.Client(base_url=url, timeout=600, headers={"Accept-Encoding": accept_encoding(compress)})
+
+    def post(self, path: str, body: Dict[str, Any], stream: bool) -> PostResult:
+        sent = len(json.dumps(body))
+        start = time.perf_counter()
+        if not stream:
+            response = self.client.post(path, json=body)
+            try:
+                data = response.json()
+            except ValueError:
+                data = {}
+            return response.status_code, data, time.perf_counter() - start, sent, response.num_bytes_downloaded
+        first_token = None
+        lines: List[str] = []
+        with self.client.stream("POST", path, json=body) as response:
+            for line in response.iter_lines():
+                if first_token is None and line.startswith("event: token"):
+                    first_token = time.perf_counter() - start
+                lines.append(line)
+        return (response.status_code, parse_sse(lines), first_token or time.perf_counter() - start,
+                sent, response.num_bytes_downloaded)
+
+
+class Recorder:
+    """Latencies per route, collected from every worker"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_token: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+        self.session_ids: List[str] = []
+        # Turn number -> (request bytes, response bytes) of every /make_choice played at it
+        self.payloads: Dict[int, List[Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+
+    def add_session(self, session_id: str) -> None:
+        with self._lock:
+            self.session_ids.append(session_id)
+
+    def record(self, route: str, seconds: float, first_token: Optional[float], ok: bool) -> None:
+        with self._lock:
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+                return
+            self.latencies.setdefault(route, []).append(seconds)
+            if first_token is not None:
+                self.first_token.setdefault(route, []).append(first_token)
+
+    def record_payload(self, turn: int, sent: int, received: int) -> None:
+        with self._lock:
+            self.payloads.setdefault(turn, []).append((sent, received))
+
+
+def play_session(index: int, args: argparse.Namespace, transport, recorder: Recorder) -> None:
+    """One player: open a game, then pick options at random (seeded) until out of turns"""
+    rng = random.Random(f"{args.seed}:{index}")
+    suffix = "_stream" if args.stream else ""
+
+    start = time.perf_counter()
+    status, data, first, _, _ = transport.post(f"/start_game{suffix}", {}, args.stream)
+    ok = status == 200 and "error" not in data and "session_id" in data
+    recorder.record("start_game", time.perf_counter() - start, first if args.stream else None, ok)
+    if not ok:
+        return
+    session_id = data["session_id"]
+    options = data.get("options", [])
+    turn = data.get("turn", 0)
+    recorder.add_session(session_id)
+
+    for number in range(1, args.turns + 1):
+        playable = [i for i, option in enumerate(options) if option.get("next_scene") != "custom_action"]
+        if not playable:
+            return
+        # The server keeps the options; the turn number is all it needs to place the choice
+        body = {"session_id": session_id, "choice_index": rng.choice(playable), "turn": turn}
+        start = time.perf_counter()
+        status, data, first, sent, received = transport.post(f"/make_choice{suffix}", body, args.stream)
+        ok = status == 200 and "error" not in data and "options" in data
+        recorder.record("make_choice", time.perf_counter() - start, first if args.stream else None, ok)
+        if not ok:
+            return
+        recorder.record_payload(number, sent, received)
+        options = data["options"]
+        turn = data.get("turn", turn + 1)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def summarize(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000
+    }
+
+
+def session_memory(app1, session_ids: List[str], sample: int = 500) -> Dict[str, float]:
+    """Live-object and serialized size of a session, measured on a sample of the played ones"""
+    states = [app1.session_store.get(session_id) for session_id in session_ids[:sample]]
+    blobs = [json.dumps(state.to_dict()) for state in states if state is not None]
+    if not blobs:
+        return {}
+    from session_store import encode_state
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    rebuilt = []
+    for blob in blobs:
+        game_state = app1.GameState()
+        game_state.from_dict(json.loads(blob))
+        rebuilt.append(game_state)
+    gc.collect()
+    live = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+    stored = sum(len(encode_state(state.to_dict())) for state in rebuilt)
+    return {"live_bytes_per_session": live / len(rebuilt), "stored_bytes_per_session": stored / len(rebuilt)}
+
+
+def main():
+    args = parse_args()
+    configure(args)
+
+    app1 = None
+    if args.url:
+        transports = threading.local()
+
+        def transport():
+            if not hasattr(transports, "value"):
+                transports.value = HttpTransport(args.url, args.compress)
+            return transports.value
+    else:
+        import app1
+        transports = threading.local()
+
+        def transport():
+            if not hasattr(transports, "value"):
+                transports.value = InProcessTransport(app1.app, args.compress)
+            return transports.value
+
+    recorder = Recorder()
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(lambda i=i: play_session(i, args, transport(), recorder))
+                   for i in range(args.sessions)]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - started
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    turns = sum(len(values) for values in recorder.latencies.values())
+    results: Dict[str, Any] = {
+        "config": {key: value for key, value in vars(args).items() if key != "json_path"},
+        "wall_seconds": elapsed,
+        "turns": turns,
+        "turns_per_second": turns / elapsed if elapsed else 0.0,
+        "errors": recorder.errors,
+        "latency": {route: summarize(values) for route, values in recorder.latencies.items()},
+        "first_token": {route: summarize(values) for route, values in recorder.first_token.items()},
+        "payload_bytes": {
+            turn: {
+                "request": sum(sent for sent, _ in sizes) / len(sizes),
+                "response": sum(received for _, received in sizes) / len(sizes)
+            }
+            for turn, sizes in sorted(recorder.payloads.items())
+        }
+    }
+    if app1 is not None:
+        llm = app1.client.llm.stats()
+        results["llm"] = dict(llm, calls_per_turn=llm["calls"] / turns if turns else 0.0,
+                              tokens_per_turn=llm["tokens"] / turns if turns else 0.0)
+        results["memory"] = session_memory(app1, recorder.session_ids)
+        # ru_maxrss is in KiB on Linux
+        results["memory"]["peak_rss_growth_per_session"] = (
+            (rss_after - rss_before) * 1024 / max(1, len(recorder.session_ids))
+        )
+        results["server"] = app1.app.test_client().get("/health").get_json()
+
+    print(f"{args.sessions} sessions x (1 + {args.turns}) turns, concurrency {args.concurrency}, "
+          f"{'streaming' if args.stream else 'json'}: {elapsed:.1f}s, {results['turns_per_second']:.1f} turns/s")
+    print(f"{'route':<24} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for label, table in [("", results["latency"]), (" first token", results["first_token"])]:
+        for route, stats in table.items():
+            if stats["count"]:
+                print(f"{route + label:<24} {stats['count']:>6} {stats['p50_ms']:>8.0f} {stats['p95_ms']:>8.0f} "
+                      f"{stats['p99_ms']:>8.0f} {stats['max_ms']:>8.0f}")
+    if recorder.errors:
+        print(f"errors: {recorder.errors}")
+    payloads = results["payload_bytes"]
+    if payloads:
+        first, last = payloads[min(payloads)], payloads[max(payloads)]
+        print(f"bytes/turn ({'compressed' if args.compress else 'identity'}): "
+              f"request {first['request']:.0f} -> {last['request']:.0f}, "
+              f"response {first['response']:.0f} -> {last['response']:.0f} (turn {min(payloads)} -> {max(payloads)})")
+    if "llm" in results:
+        print(f"LLM: {results['llm']['calls_per_turn']:.2f} calls/turn, "
+              f"{results['llm']['tokens_per_turn']:.0f} tokens/turn, {results['llm']['errors']} injected errors")
+        models = results["server"].get("models", {})
+        if models:
+            print(f"{'stage':<18} {'model':<16} {'calls':>6} {'retries':>8} {'hedges':>7} {'mean ms':>8} "
+                  f"{'tokens':>9} {'USD':>9}")
+            total_cost = 0.0
+            for stage, by_model in sorted(models.items()):
+                for model, entry in sorted(by_model.items()):
+                    total_cost += entry["cost_usd"]
+                    print(f"{stage:<18} {model:<16} {entry['calls']:>6} {entry['retries']:>8} {entry['hedges_lost']:>7} "
+                          f"{entry['mean_ms']:>8.0f} {entry['prompt_tokens'] + entry['completion_tokens']:>9} "
+                          f"{entry['cost_usd']:>9.4f}")
+            print(f"estimated cost: ${total_cost:.4f} total, ${total_cost / turns if turns else 0.0:.5f}/turn")
+        memory = results["memory"]
+        if "live_bytes_per_session" in memory:
+            print(f"memory/session: {memory['live_bytes_per_session'] / 1024:.1f} KiB live, "
+                  f"{memory['stored_bytes_per_session'] / 1024:.1f} KiB stored, "
+                  f"{memory['peak_rss_growth_per_session'] / 1024:.1f} KiB peak RSS growth")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
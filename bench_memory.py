@@ -0,0 +1,178 @@
+"""
+Memory benchmark for live sessions.
+
+Builds --sessions game states that have each played --turns turns, once with
+the plain GameState layout (a per-instance __dict__, unbounded visited list,
+stats dict) and once with the current compact one. Each variant runs in its
+own process and reports resident memory before and after, and bytes per
+session. Scene ids are decoded from JSON the way they arrive from the model,
+so nothing is shared unless GameState shares it. The turn text is shared
+between sessions, as it is when served from the scene index or cache, so the
+numbers are the cost of the state itself. Run with:
+
+    python bench_memory.py --sessions 100000 --turns 40
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List
+
+# app1 builds an OpenAI client at import time; nothing here calls it
+os.environ.setdefault("OPENAI_API_KEY", "offline-benchmark")
+
+from app1 import DEFAULT_STORY_CONTEXT, GameState, remember_turn
+from state_sync import state_delta
+from story_context import StoryContext
+
+VARIANTS = ("plain", "compact")
+
+SCENES = [
+    "scene_shield_mainframe_breach", "scene_fury_contact_channel", "scene_power_test_chamber",
+    "scene_bunker_escape_route", "scene_stark_tower_rooftop", "scene_hydra_ambush_east_wing",
+    "scene_quantum_rift_manhattan", "scene_variant_confrontation", "scene_asgard_bifrost_site",
+    "scene_wakanda_lab_consult", "scene_sanctum_sanctorum_visit", "scene_helicarrier_bridge"
+]
+EVENTS = [
+    "You overload the quantum dampener and the bunker lights die as Fury's voice crackles over comms.",
+    "Hydra agents breach the east wing; you shield Agent Hill and lose the Tesseract shard in the chaos.",
+    "Tony Stark patches into your suit, warning that the rift over Manhattan is doubling every hour.",
+    "A variant of yourself steps out of the rift, claiming the collapse started with your accident.",
+]
+NARRATIVE = "The bunker shakes as the breach widens overhead. " * 20
+SUMMARY = "You escaped SHIELD custody, allied with Stark and learned the rift began with your accident."
+
+
+class PlainGameState:
+    """The GameState layout this replaced: a plain object holding its own lists and dicts"""
+
+    def __init__(self):
+        self.current_scene = "start"
+        self.inventory = []
+        self.player_stats = {"health": 100, "courage": 50, "wisdom": 50}
+        self.visited_locations = []
+        self.story_flags = {}
+        self.context = StoryContext(DEFAULT_STORY_CONTEXT)
+        self.last_turn = None
+        self.turn = 0
+        self.last_choice = None
+        self.last_delta = None
+        self.synced = None
+
+    def visit(self, next_scene: str) -> None:
+        self.visited_locations.append(self.current_scene)
+        self.current_scene = next_scene
+
+    def add_context(self, event: str) -> None:
+        self.context.add(event)
+
+    def public_dict(self) -> Dict[str, Any]:
+        return {
+            "current_scene": self.current_scene,
+            "inventory": self.inventory,
+            "player_stats": self.player_stats,
+            "visited_locations": self.visited_locations,
+            "story_flags": self.story_flags
+        }
+
+    def advance(self, choice: Dict[str, Any]) -> None:
+        self.last_delta, self.synced = state_delta(self.synced, self.public_dict())
+        self.last_choice = dict(choice, turn=self.turn)
+        self.turn += 1
+
+
+def play_session(game_state: Any, turns: int, rng: random.Random) -> Any:
+    """Play `turns` turns the way the routes do, with shared turn text"""
+    for _ in range(turns):
+        # A fresh string per turn, like an option decoded from the model's JSON
+        options = json.loads(json.dumps([
+            {"text": "Follow the signal", "next_scene": rng.choice(SCENES)},
+            {"text": "Hold your ground", "next_scene": rng.choice(SCENES)},
+            {"text": "Call for backup", "next_scene": rng.choice(SCENES)},
+            {"text": "Other", "next_scene": "custom_action"}
+        ]))
+        game_state.visit(options[0]["next_scene"])
+        game_state.add_context(rng.choice(EVENTS))
+        game_state.context.fold(lambda prompt: SUMMARY)
+        remember_turn(game_state, {"narrative": NARRATIVE, "scene_description": SUMMARY, "options": options})
+        game_state.advance({"choice_index": 0})
+    return game_state
+
+
+def resident_bytes() -> int:
+    """Current RSS; peak RSS where /proc isn't available"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        scale = 1 if sys.platform == "darwin" else 1024
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+
+def measure(variant: str, sessions: int, turns: int, seed: int) -> Dict[str, Any]:
+    """Build the sessions in this process and report what they cost"""
+    factory = PlainGameState if variant == "plain" else GameState
+    rng = random.Random(seed)
+    gc.collect()
+    before = resident_bytes()
+    started = time.perf_counter()
+    live: List[Any] = [play_session(factory(), turns, rng) for _ in range(sessions)]
+    seconds = time.perf_counter() - started
+    gc.collect()
+    after = resident_bytes()
+    return {
+        "variant": variant,
+        "sessions": len(live),
+        "turns": turns,
+        "rss_before_mb": before / 2 ** 20,
+        "rss_after_mb": after / 2 ** 20,
+        "bytes_per_session": (after - before) / len(live),
+        "build_seconds": seconds
+    }
+
+
+def run_variant(variant: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Measure one variant in a fresh interpreter, so neither inherits the other's heap"""
+    command = [sys.executable, os.path.abspath(__file__), "--variant", variant,
+               "--sessions", str(args.sessions), "--turns", str(args.turns), "--seed", str(args.seed)]
+    completed = subprocess.run(command, capture_output=True, text=True, check=True)
+    # app1 may print notices at import; the result is the last line
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=40, help="turns each session has played")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--variant", choices=VARIANTS, help="measure one variant in this process and print JSON")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.sessions, args.turns, args.seed)))
+        return
+
+    results = [run_variant(variant, args) for variant in VARIANTS]
+    print(f"{args.sessions} sessions, {args.turns} turns each")
+    print(f"{'layout':>8} {'rss before':>11} {'rss after':>10} {'bytes/session':>14} {'build':>8}")
+    for row in results:
+        print(f"{row['variant']:>8} {row['rss_before_mb']:>9.1f}MB {row['rss_after_mb']:>8.1f}MB "
+              f"{row['bytes_per_session']:>14,.0f} {row['build_seconds']:>7.1f}s")
+    plain, compact = results
+    if plain["bytes_per_session"] > 0:
+        print(f"compact sessions take {compact['bytes_per_session'] / plain['bytes_per_session']:.0%} "
+              f"of the plain layout's memory")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import gzip
+import os
+import zlib
+from typing import AsyncIterator, Iterator, Optional, Union
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it responses are only ever gzipped
+    brotli = None
+
+# Response compression (0 turns it off); bodies smaller than COMPRESS_MIN_BYTES go out as-is
+COMPRESS_RESPONSES = os.getenv("COMPRESS_RESPONSES", "1") == "1"
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "512"))
+COMPRESS_LEVEL = int(os.getenv("COMPRESS_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+COMPRESSIBLE_TYPES = ("application/json", "application/javascript", "text/")
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """"br" or "gzip" if the client accepts it (brotli preferred), else None"""
+    if not COMPRESS_RESPONSES:
+        return None
+    accepted = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compressible(mimetype: Optional[str]) -> bool:
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def compress(data: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=COMPRESS_LEVEL, mtime=0)
+
+
+class StreamCompressor:
+    """Incremental compression flushed after every chunk, so each SSE event still reaches the client at once"""
+
+    def __init__(self, encoding: str):
+        self.encoding = encoding
+        if encoding == "br":
+            self._compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            # wbits 31: a gzip container rather than raw zlib
+            self._compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, chunk: bytes) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.process(chunk) + self._compressor.flush()
+        return self._compressor.compress(chunk) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self) -> bytes:
+        if self.encoding == "br":
+            return self._compressor.finish()
+        return self._compressor.flush()
+
+
+def compress_stream(chunks: Iterator[Union[str, bytes]], encoding: str) -> Iterator[bytes]:
+    """Compress a streamed body chunk by chunk, closing the source if the client goes away"""
+    compressor = StreamCompressor(encoding)
+    try:
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+async def acompress_stream(chunks: AsyncIterator[Union[str, bytes]], encoding: str) -> AsyncIterator[bytes]:
+    """Async counterpart of compress_stream()"""
+    compressor = StreamCompressor(encoding)
+    try:
+        async for chunk in chunks:
+            yield compressor.compress(chunk.encode("utf-8") if isinstance(chunk, str) else chunk)
+        yield compressor.finish()
+    finally:
+        close = getattr(chunks, "aclose", None)
+        if close is not None:
+            await close()
@@ -0,0 +1,201 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+VERDICTS = ("continue", "victory", "defeat")
+
+# Weighted cue phrases, matched as whole words in the lowercased narrative
+VICTORY_CUES = {
+    "victory": 1.5, "victorious": 1.5, "triumph": 1.2, "triumphant": 1.2, "you won": 1.5, "you have won": 1.5,
+    "saved the multiverse": 2.0, "multiverse is saved": 2.0, "saved the world": 1.8, "world is saved": 1.8,
+    "rift closes": 1.2, "rift seals": 1.4, "breach is sealed": 1.6, "breach seals": 1.4, "reality stabilizes": 1.4,
+    "villain falls": 1.2, "villain is defeated": 1.6, "peace returns": 1.5, "celebrate": 0.8, "cheers": 0.6,
+    "welcomes you": 0.8, "among the greats": 1.5, "true hero": 1.0, "hero's welcome": 1.5,
+}
+DEFEAT_CUES = {
+    "you die": 2.0, "you died": 2.0, "your death": 1.8, "last breath": 1.8, "final breath": 1.8,
+    "darkness takes you": 1.8, "everything goes dark": 1.2, "never wakes": 1.8, "mission failed": 2.0,
+    "you failed": 1.6, "too late": 0.8, "multiverse collapses": 1.6, "reality collapses": 1.4,
+    "lost forever": 1.2, "fallen hero": 1.5, "mourn": 1.2, "funeral": 1.5, "sacrifice": 0.8,
+    "sacrificed": 1.2, "gives your life": 1.8, "gave your life": 1.8, "defeat": 1.2, "defeated you": 1.6,
+}
+# Signs of a conclusion without saying which kind
+CLOSURE_CUES = {
+    "the end": 1.5, "epilogue": 1.5, "years later": 1.5, "in the end": 0.8, "your journey ends": 2.0,
+    "journey is over": 2.0, "finally over": 1.2, "at last": 0.5, "legacy": 0.6, "remembered": 0.8,
+    "will never forget": 1.0, "history will": 0.8,
+}
+# Signs the scene is still open: hooks, threats, pending decisions
+CONTINUE_CUES = {
+    "what will you do": 2.0, "you must decide": 1.8, "you must choose": 1.8, "choose": 0.6, "decide": 0.6,
+    "suddenly": 0.8, "but then": 0.8, "before you can": 0.8, "ahead": 0.5, "next": 0.4, "meanwhile": 0.6,
+    "hurry": 0.6, "approaches": 0.5, "waits": 0.5, "the clock": 0.6, "not over": 1.2, "only the beginning": 1.0,
+}
+
+# Stories almost never end this early, so the continue prior is boosted for the first turns
+EARLY_TURNS = 5
+CONTINUE_BIAS = 2.0
+# How much each turn played (up to LATE_TURNS) pulls towards an ending
+TURN_WEIGHT = 0.1
+LATE_TURNS = 20
+
+
+_WORD = re.compile(r"[a-z']+")
+
+
+def _index_cues(groups: Dict[str, Dict[str, float]]) -> Dict[str, List[Tuple[Tuple[str, ...], str, float]]]:
+    """First word -> (phrase words, group, weight), so a scan is one dict lookup per word"""
+    index: Dict[str, List[Tuple[Tuple[str, ...], str, float]]] = {}
+    for group, cues in groups.items():
+        for cue, weight in cues.items():
+            words = tuple(_WORD.findall(cue))
+            index.setdefault(words[0], []).append((words, group, weight))
+    return index
+
+
+_CUES = _index_cues({"victory": VICTORY_CUES, "defeat": DEFEAT_CUES, "closure": CLOSURE_CUES, "continue": CONTINUE_CUES})
+
+
+def _score_cues(text: str) -> Dict[str, float]:
+    """Sum of the weights of the distinct cues of each group found in the text"""
+    words = _WORD.findall(text)
+    found = set()
+    for i, word in enumerate(words):
+        for phrase, group, weight in _CUES.get(word, ()):
+            if len(phrase) == 1 or tuple(words[i:i + len(phrase)]) == phrase:
+                found.add((phrase, group, weight))
+    scores = {"victory": 0.0, "defeat": 0.0, "closure": 0.0, "continue": 0.0}
+    for phrase, group, weight in found:
+        scores[group] += weight
+    return scores
+
+
+def normalize_verdict(reply: str) -> str:
+    """The verdict in a one-word LLM reply, read the way the game always has"""
+    reply = reply.strip().lower()
+    if "victory" in reply:
+        return "victory"
+    if "defeat" in reply:
+        return "defeat"
+    return "continue"
+
+
+def ending_features(narrative: str, turn: int, player_stats: Dict[str, Any]) -> Dict[str, float]:
+    """The classifier's inputs for one narrative"""
+    text = narrative.lower()
+    cues = _score_cues(text)
+    try:
+        health = float(player_stats.get("health", 100))
+    except (TypeError, ValueError):
+        health = 100.0
+    return {
+        "victory": cues["victory"],
+        "defeat": cues["defeat"],
+        "closure": cues["closure"],
+        "continue": cues["continue"],
+        # A scene that ends on a question is handing the player a choice
+        "open_question": 1.0 if "?" in text[-300:] else 0.0,
+        "turn": float(turn),
+        "health": health,
+    }
+
+
+def classify_ending(narrative: str, turn: int, player_stats: Dict[str, Any]) -> Tuple[str, float]:
+    """Local ending verdict for a narrative and the classifier's confidence in it (0-1)"""
+    features = ending_features(narrative, turn, player_stats)
+    lateness = TURN_WEIGHT * min(features["turn"], LATE_TURNS)
+    logits = {
+        "continue": (CONTINUE_BIAS + features["continue"] + 1.5 * features["open_question"]
+                     + 0.5 * max(0.0, EARLY_TURNS - features["turn"])),
+        "victory": features["victory"] + 0.8 * features["closure"] + lateness,
+        "defeat": features["defeat"] + 0.8 * features["closure"] + lateness,
+    }
+    if features["health"] <= 0:
+        logits["defeat"] += 3.0
+    elif features["health"] < 20:
+        logits["defeat"] += 1.0
+    top = max(logits.values())
+    weights = {verdict: math.exp(logit - top) for verdict, logit in logits.items()}
+    total = sum(weights.values())
+    verdict = max(VERDICTS, key=lambda name: weights[name])
+    return verdict, weights[verdict] / total
+
+
+class EndingClassifier:
+    """
+    Decides whether a turn ends the story without an LLM round trip when it can.
+
+    decide() returns the local verdict if its confidence reaches `threshold`,
+    or None when the caller should ask the LLM and report the answer back
+    with record(). A fraction `audit_rate` of confident turns is escalated
+    anyway so agreement keeps being measured. Every LLM verdict can be
+    appended to `sample_log` as JSON lines for eval_ending.py to replay.
+    """
+
+    def __init__(self, threshold: float, audit_rate: float = 0.0, sample_log: str = ""):
+        self.threshold = threshold
+        self.audit_rate = audit_rate
+        self.sample_log = sample_log
+        self._lock = threading.Lock()
+        self.local = 0
+        self.escalated = 0
+        self.audited = 0
+        self.agreed = 0
+        self.disagreed = 0
+
+    def decide(self, verdict: str, confidence: float) -> Optional[str]:
+        """The verdict to use without asking the LLM, or None to escalate"""
+        confident = confidence >= self.threshold
+        audit = confident and self.audit_rate > 0 and random.random() < self.audit_rate
+        with self._lock:
+            if confident and not audit:
+                self.local += 1
+                return verdict
+            self.escalated += 1
+            if audit:
+                self.audited += 1
+        return None
+
+    def record(self, narrative: str, turn: int, player_stats: Dict[str, Any],
+               verdict: str, confidence: float, llm_verdict: str) -> None:
+        """Compare an escalated turn's local verdict with the LLM's, and log the sample"""
+        with self._lock:
+            if verdict == llm_verdict:
+                self.agreed += 1
+            else:
+                self.disagreed += 1
+        if not self.sample_log:
+            return
+        line = json.dumps({
+            "narrative": narrative,
+            "turn": turn,
+            "player_stats": player_stats,
+            "local": verdict,
+            "confidence": round(confidence, 4),
+            "llm": llm_verdict,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+        try:
+            with self._lock, open(self.sample_log, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            print(f"Error writing ending sample log {self.sample_log}: {str(e)}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            checks = self.local + self.escalated
+            compared = self.agreed + self.disagreed
+            return {
+                "threshold": self.threshold,
+                "local": self.local,
+                "escalated": self.escalated,
+                "audited": self.audited,
+                "agreed": self.agreed,
+                "disagreed": self.disagreed,
+                "calls_avoided": round(self.local / checks, 3) if checks else 0.0,
+                "agreement": round(self.agreed / compared, 3) if compared else None
+            }
@@ -0,0 +1,144 @@
+"""
+Offline evaluation of the local ending classifier against recorded LLM verdicts.
+
+Replays ending samples (JSON lines with narrative, turn, player_stats and the
+LLM's verdict in "llm") through the current classifier and reports, for each
+confidence threshold, the fraction of ending-check calls it would avoid, how
+often it agrees with the LLM on those turns, and how many endings it would
+miss or invent. It also prints a reliability table and the lowest threshold
+that reaches --target agreement.
+
+Samples are written by the app when ENDING_SAMPLE_LOG is set. Only escalated
+turns are logged, so record with ENDING_CONFIDENCE above 1 (every turn asks
+the LLM) to get an unbiased sample:
+
+    ENDING_CONFIDENCE=1.1 ENDING_SAMPLE_LOG=endings.jsonl python app1.py
+    python eval_ending.py endings.jsonl --target 0.98
+"""
+import argparse
+import json
+import time
+from typing import Any, Dict, List
+
+from ending_classifier import VERDICTS, classify_ending
+
+DEFAULT_THRESHOLDS = "0.5,0.6,0.7,0.8,0.85,0.9,0.95,0.98,0.99"
+# Confidence is a softmax over three verdicts, so it never drops below 1/3
+CONFIDENCE_BINS = [1 / 3, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 1.0]
+
+
+def load_samples(paths: List[str]) -> List[Dict[str, Any]]:
+    samples = []
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    sample = json.loads(line)
+                except ValueError as e:
+                    print(f"Skipping {path}:{number}: {str(e)}")
+                    continue
+                if sample.get("llm") in VERDICTS and sample.get("narrative"):
+                    samples.append(sample)
+    return samples
+
+
+def evaluate(samples: List[Dict[str, Any]], thresholds: List[float]) -> Dict[str, Any]:
+    started_at = time.perf_counter()
+    predictions = [
+        classify_ending(sample["narrative"], int(sample.get("turn", 0)), sample.get("player_stats") or {})
+        for sample in samples
+    ]
+    micros_per_call = (time.perf_counter() - started_at) * 1e6 / max(1, len(samples))
+    labels = [sample["llm"] for sample in samples]
+
+    rows = []
+    for threshold in thresholds:
+        local = agreed = missed = invented = 0
+        for (verdict, confidence), label in zip(predictions, labels):
+            if confidence < threshold:
+                continue
+            local += 1
+            if verdict == label:
+                agreed += 1
+            elif verdict == "continue":
+                missed += 1
+            elif label == "continue":
+                invented += 1
+        escalated = len(samples) - local
+        rows.append({
+            "threshold": threshold,
+            "calls_avoided": local / len(samples),
+            "local_agreement": agreed / local if local else None,
+            # Escalated turns take the LLM's verdict, so they agree by definition
+            "overall_agreement": (agreed + escalated) / len(samples),
+            "missed_endings": missed,
+            "invented_endings": invented,
+        })
+
+    reliability = []
+    for low, high in zip(CONFIDENCE_BINS, CONFIDENCE_BINS[1:]):
+        in_bin = [
+            verdict == label for (verdict, confidence), label in zip(predictions, labels)
+            if low <= confidence < high or (high == 1.0 and confidence == 1.0)
+        ]
+        reliability.append({
+            "confidence": f"{low:.2f}-{high:.2f}",
+            "count": len(in_bin),
+            "agreement": sum(in_bin) / len(in_bin) if in_bin else None
+        })
+
+    return {
+        "samples": len(samples),
+        "labels": {verdict: labels.count(verdict) for verdict in VERDICTS},
+        "micros_per_call": micros_per_call,
+        "thresholds": rows,
+        "reliability": reliability,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("samples", nargs="+", help="JSON-lines files written via ENDING_SAMPLE_LOG")
+    parser.add_argument("--thresholds", default=DEFAULT_THRESHOLDS, help="comma-separated confidence thresholds")
+    parser.add_argument("--target", type=float, default=0.98, help="overall agreement the recommendation must reach")
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    samples = load_samples(args.samples)
+    if not samples:
+        print("No usable samples: each line needs a narrative and an LLM verdict in \"llm\"")
+        return
+    thresholds = sorted(float(value) for value in args.thresholds.split(",") if value.strip())
+    results = evaluate(samples, thresholds)
+
+    labels = ", ".join(f"{count} {verdict}" for verdict, count in results["labels"].items())
+    print(f"{results['samples']} samples ({labels}), {results['micros_per_call']:.1f} us per local check")
+    print(f"{'threshold':>9} {'avoided':>8} {'local agree':>12} {'overall':>8} {'missed':>7} {'invented':>9}")
+    for row in results["thresholds"]:
+        local_agreement = f"{row['local_agreement']:.1%}" if row["local_agreement"] is not None else "-"
+        print(f"{row['threshold']:>9.2f} {row['calls_avoided']:>8.1%} {local_agreement:>12} "
+              f"{row['overall_agreement']:>8.1%} {row['missed_endings']:>7} {row['invented_endings']:>9}")
+
+    print(f"{'confidence':>11} {'count':>6} {'agreement':>10}")
+    for row in results["reliability"]:
+        agreement = f"{row['agreement']:.1%}" if row["agreement"] is not None else "-"
+        print(f"{row['confidence']:>11} {row['count']:>6} {agreement:>10}")
+
+    passing = [row for row in results["thresholds"] if row["overall_agreement"] >= args.target]
+    if passing:
+        best = passing[0]
+        results["recommended_threshold"] = best["threshold"]
+        print(f"ENDING_CONFIDENCE={best['threshold']} reaches {best['overall_agreement']:.1%} agreement "
+              f"and avoids {best['calls_avoided']:.1%} of ending-check calls")
+    else:
+        print(f"No threshold reaches {args.target:.0%} agreement; keep escalating (ENDING_CONFIDENCE above 1)")
+
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
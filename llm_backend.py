@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+
+import httpx
+import openai
+
+from story_context import count_tokens
+
+# Which LLM the apps talk to: "openai", or "fake" for offline load tests and benchmarks.
+# A backend is anything with the chat.completions.create() surface of the OpenAI client.
+LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+
+# Fake backend: same seed and prompt always give the same reply, latency and failures
+FAKE_LLM_SEED = os.getenv("FAKE_LLM_SEED", "0")
+# Time to first token: lognormal around the median, sigma sets the tail
+FAKE_LLM_TTFT_MS = float(os.getenv("FAKE_LLM_TTFT_MS", "400"))
+FAKE_LLM_TTFT_SIGMA = float(os.getenv("FAKE_LLM_TTFT_SIGMA", "0.5"))
+# Output speed once tokens start flowing; 0 returns the whole reply at once
+FAKE_LLM_TOKENS_PER_SEC = float(os.getenv("FAKE_LLM_TOKENS_PER_SEC", "60"))
+# Fraction of calls that fail after their time to first token
+FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+# Fraction of turns the fake declares to be the end of the story
+FAKE_LLM_ENDING_RATE = float(os.getenv("FAKE_LLM_ENDING_RATE", "0.03"))
+
+HEROES = ["Nick Fury", "Tony Stark", "Agent Hill", "Shuri", "Doctor Strange", "Captain Marvel", "Loki"]
+PLACES = ["the Helicarrier deck", "a collapsing Stark lab", "the Sanctum's mirror hall",
+          "a Hydra bunker", "the rift above Manhattan", "a frozen Wakandan outpost"]
+THREATS = ["a Hydra strike team", "a shard of the Tesseract", "a variant of yourself",
+           "an unstable multiverse rift", "a rogue Sentinel", "a swarm of Chitauri drones"]
+VERBS = ["Blast", "Hack", "Trace", "Shield", "Confront", "Follow", "Disable", "Rewire", "Negotiate with", "Outrun"]
+MOODS = ["Sparks rain from the ceiling.", "The air hums with quantum static.",
+         "Sirens wail somewhere far below.", "Your powers flicker under your skin.",
+         "Comms crackle with half-heard orders.", "The ground shudders beneath you."]
+# In every sentence the fake writes, so its summaries show up in later prompts' story context
+HISTORY_MARKER = "watches as you face"
+
+
+class FakeLLMError(openai.APIConnectionError):
+    """
+    An injected failure. It is the real client's APIConnectionError, so the
+    apps treat it like a dropped connection without knowing about the fake.
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message=message, request=httpx.Request("POST", "http://fake-llm.invalid/v1/chat/completions"))
+
+
+class FakeCall:
+    """One planned reply: its text, split into streamable pieces, and its timing"""
+
+    def __init__(self, content: str, prompt_tokens: int, ttft: float, per_token: float, fail: bool):
+        self.content = content
+        self.pieces = [word + " " for word in content.split(" ")]
+        self.pieces[-1] = self.pieces[-1][:-1]
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = count_tokens(content)
+        self.ttft = ttft
+        self.per_token = per_token
+        self.fail = fail
+
+    def usage(self) -> SimpleNamespace:
+        return SimpleNamespace(
+            prompt_tokens=self.prompt_tokens,
+            completion_tokens=self.completion_tokens,
+            total_tokens=self.prompt_tokens + self.completion_tokens
+        )
+
+    def response(self, model: str) -> SimpleNamespace:
+        message = SimpleNamespace(role="assistant", content=self.content)
+        return SimpleNamespace(
+            model=model,
+            choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+            usage=self.usage()
+        )
+
+    def chunk(self, piece: str) -> SimpleNamespace:
+        return SimpleNamespace(choices=[SimpleNamespace(index=0, delta=SimpleNamespace(content=piece))], usage=None)
+
+
+class FakeLLM:
+    """
+    Deterministic offline stand-in for the model behind the game.
+
+    Replies are picked by recognising which of the app's prompts was sent
+    (narrative, numbered options, ending verdict, scene description, context
+    summary, or a JSON-schema turn) and are well-formed for that prompt.
+    Each reply is seeded from the prompt, so runs are reproducible however
+    the calls interleave across threads. Only turns after the opening may
+    end the story.
+    """
+
+    def __init__(self, seed: str = FAKE_LLM_SEED, ttft_ms: float = FAKE_LLM_TTFT_MS,
+                 ttft_sigma: float = FAKE_LLM_TTFT_SIGMA, tokens_per_sec: float = FAKE_LLM_TOKENS_PER_SEC,
+                 error_rate: float = FAKE_LLM_ERROR_RATE, ending_rate: float = FAKE_LLM_ENDING_RATE):
+        self.seed = seed
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.ending_rate = ending_rate
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.tokens = 0
+
+    def plan(self, messages: List[Dict[str, str]], temperature: float = 1.0,
+             max_tokens: Optional[int] = None, response_format: Optional[Dict[str, Any]] = None,
+             model: str = "") -> FakeCall:
+        prompt = "\n".join(message.get("content", "") for message in messages)
+        # The model is part of the seed, so falling back to another one can succeed
+        digest = hashlib.sha256(f"{self.seed}|{model}|{temperature}|{prompt}".encode("utf-8")).digest()
+        rng = random.Random(digest)
+
+        if response_format and response_format.get("type") == "json_schema":
+            content = json.dumps(self._structured(rng, response_format["json_schema"]["schema"], prompt))
+        else:
+            content = self._text(rng, prompt)
+        if max_tokens and count_tokens(content) > max_tokens and not response_format:
+            # Rough cut, like a reply that ran out of tokens
+            content = " ".join(content.split(" ")[:max_tokens * 3 // 4])
+
+        ttft = self.ttft_ms / 1000 * math.exp(rng.gauss(0, self.ttft_sigma)) if self.ttft_ms > 0 else 0.0
+        per_token = 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0.0
+        call = FakeCall(content, count_tokens(prompt), ttft, per_token, rng.random() < self.error_rate)
+        with self._lock:
+            self.calls += 1
+            if call.fail:
+                self.errors += 1
+            else:
+                self.tokens += call.prompt_tokens + call.completion_tokens
+        return call
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors, "tokens": self.tokens}
+
+    def _text(self, rng: random.Random, prompt: str) -> str:
+        if "generate EXACTLY 4" in prompt:
+            return "\n".join(f"{number}. {text}" for number, text in enumerate(self._options(rng), 1))
+        if "Respond with ONLY ONE word" in prompt:
+            return self._verdict(rng, prompt)
+        if "short scene description" in prompt:
+            return self._sentences(rng, 2)
+        if "Summarize the following event" in prompt:
+            return self._sentences(rng, 1)
+        if "Condense the story so far" in prompt:
+            return self._sentences(rng, 4)
+        return self._narrative(rng)
+
+    def _structured(self, rng: random.Random, schema: Dict[str, Any], prompt: str) -> Dict[str, Any]:
+        """Fill a JSON schema; the game's turn schema gets a coherent turn"""
+        ending = self._verdict(rng, prompt)
+        data = {}
+        for name, spec in schema.get("properties", {}).items():
+            if "enum" in spec:
+                data[name] = ending if ending in spec["enum"] else spec["enum"][0]
+            elif spec.get("type") == "array":
+                data[name] = [] if ending != "continue" else self._options(rng)
+            elif name == "narrative":
+                data[name] = self._narrative(rng)
+            elif name == "ending_narrative":
+                data[name] = self._narrative(rng, paragraphs=1) if ending != "continue" else ""
+            else:
+                data[name] = self._sentences(rng, 1 if "summary" in name else 2)
+        return data
+
+    def _verdict(self, rng: random.Random, prompt: str) -> str:
+        # The opening prompt is the same for every session, so it never ends the story
+        if not self._has_history(prompt) or rng.random() >= self.ending_rate:
+            return "continue"
+        return rng.choice(["victory", "defeat"])
+
+    @staticmethod
+    def _has_history(prompt: str) -> bool:
+        """
+        Whether a prompt comes after the opening: a turn prompt for a player
+        who has been somewhere, or an ending check whose story context holds
+        summaries of earlier turns (which this fake wrote).
+        """
+        if "Player has visited:" in prompt:
+            return "Player has visited: nowhere yet" not in prompt
+        context = prompt.partition("Story context:")[2].partition("Respond with")[0]
+        return HISTORY_MARKER in context
+
+    def _options(self, rng: random.Random) -> List[str]:
+        verbs = rng.sample(VERBS, 4)
+        return [f"{verb} {rng.choice(THREATS)} near {rng.choice(PLACES)}" for verb in verbs]
+
+    def _sentences(self, rng: random.Random, count: int) -> str:
+        sentences = []
+        for _ in range(count):
+            sentences.append(
+                f"{rng.choice(HEROES)} {HISTORY_MARKER} {rng.choice(THREATS)} in {rng.choice(PLACES)}. "
+                f"{rng.choice(MOODS)}"
+            )
+        return " ".join(sentences)
+
+    def _narrative(self, rng: random.Random, paragraphs: int = 3) -> str:
+        return "\n\n".join(self._sentences(rng, rng.randint(2, 4)) for _ in range(paragraphs))
+
+
+class FakeCompletions:
+    def __init__(self, llm: FakeLLM):
+        self.llm = llm
+
+    def create(self, model: str, messages: List[Dict[str, str]], temperature: float = 1.0,
+               max_tokens: Optional[int] = None, stream: bool = False,
+               response_format: Optional[Dict[str, Any]] = None, stream_options: Optional[Dict[str, Any]] = None,
+               **kwargs: Any) -> Any:
+        call = self.llm.plan(messages, temperature, max_tokens, response_format, model)
+        if stream:
+            return self._stream(call, model, stream_options)
+        time.sleep(call.ttft)
+        if call.fail:
+            raise FakeLLMError("injected failure")
+        time.sleep(call.per_token * call.completion_tokens)
+        return call.response(model)
+
+    def _stream(self, call: FakeCall, model: str, stream_options: Optional[Dict[str, Any]]) -> Iterator[Any]:
+        time.sleep(call.ttft)
+        if call.fail:
+            raise FakeLLMError("injected failure")
+        for piece in call.pieces:
+            yield call.chunk(piece)
+            time.sleep(call.per_token * count_tokens(piece))
+        if stream_options and stream_options.get("include_usage"):
+            yield SimpleNamespace(choices=[], usage=call.usage())
+
+
+class FakeAsyncCompletions(FakeCompletions):
+    async def create(self, model: str, messages: List[Dict[str, str]], temperature: float = 1.0,
+                     max_tokens: Optional[int] = None, stream: bool = False,
+                     response_format: Optional[Dict[str, Any]] = None,
+                     stream_options: Optional[Dict[str, Any]] = None, **kwargs: Any) -> Any:
+        call = self.llm.plan(messages, temperature, max_tokens, response_format, model)
+        if stream:
+            return self._astream(call, model, stream_options)
+        await asyncio.sleep(call.ttft)
+        if call.fail:
+            raise FakeLLMError("injected failure")
+        await asyncio.sleep(call.per_token * call.completion_tokens)
+        return call.response(model)
+
+    async def _astream(self, call: FakeCall, model: str,
+                       stream_options: Optional[Dict[str, Any]]) -> AsyncIterator[Any]:
+        await asyncio.sleep(call.ttft)
+        if call.fail:
+            raise FakeLLMError("injected failure")
+        for piece in call.pieces:
+            yield call.chunk(piece)
+            await asyncio.sleep(call.per_token * count_tokens(piece))
+        if stream_options and stream_options.get("include_usage"):
+            yield SimpleNamespace(choices=[], usage=call.usage())
+
+
+class FakeOpenAI:
+    """Drop-in for openai.OpenAI, covering the calls the game makes"""
+
+    def __init__(self, llm: Optional[FakeLLM] = None):
+        self.llm = llm or FakeLLM()
+        self.chat = SimpleNamespace(completions=FakeCompletions(self.llm))
+
+
+class FakeAsyncOpenAI:
+    """Drop-in for openai.AsyncOpenAI, covering the calls the game makes"""
+
+    def __init__(self, llm: Optional[FakeLLM] = None):
+        self.llm = llm or FakeLLM()
+        self.chat = SimpleNamespace(completions=FakeAsyncCompletions(self.llm))
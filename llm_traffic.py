@@ -0,0 +1,246 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+# Record/replay of LLM calls: "record" appends every call to LLM_TRAFFIC_PATH as a JSON line,
+# "replay" answers calls from those lines instead of the backend; empty does neither
+LLM_TRAFFIC_MODE = os.getenv("LLM_TRAFFIC_MODE", "")
+LLM_TRAFFIC_PATH = os.getenv("LLM_TRAFFIC_PATH", "llm_traffic.jsonl")
+# A recording moves to .1, .2, ... once it reaches LLM_TRAFFIC_MAX_BYTES; this many old files are kept
+LLM_TRAFFIC_MAX_BYTES = int(os.getenv("LLM_TRAFFIC_MAX_BYTES", str(64 * 1024 * 1024)))
+LLM_TRAFFIC_BACKUPS = int(os.getenv("LLM_TRAFFIC_BACKUPS", "5"))
+# Replay: whether a call nobody recorded fails ("fail") or goes to the backend ("live")
+LLM_REPLAY_MISSES = os.getenv("LLM_REPLAY_MISSES", "fail")
+# Replay: wait as long as the recorded call took (1), or answer at once (0)
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "0") == "1"
+# Response cache for identical requests, e.g. the fixed ending prompts (0 entries turns it off)
+LLM_CACHE_ENTRIES = int(os.getenv("LLM_CACHE_ENTRIES", "0"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "3600"))
+# Comma-separated stages the cache may answer; empty: all of them
+LLM_CACHE_STAGES = os.getenv("LLM_CACHE_STAGES", "")
+
+# Request fields that change the reply; the model, timeout and streaming don't pick a different one
+KEY_PARAMS = ("temperature", "max_tokens", "top_p", "response_format")
+
+
+class ReplayMiss(Exception):
+    """A replayed run made a call that was never recorded"""
+
+
+def normalize_text(text: str) -> str:
+    """Prompts are indented f-strings; only the words and their order matter"""
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def request_params(request: Dict[str, Any]) -> Dict[str, Any]:
+    params = {name: request[name] for name in KEY_PARAMS if request.get(name) is not None}
+    if "temperature" in params:
+        params["temperature"] = round(float(params["temperature"]), 3)
+    return params
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """Hash of a chat.completions request's normalized messages and reply-shaping parameters"""
+    messages = [
+        {"role": message.get("role", ""), "content": normalize_text(message.get("content") or "")}
+        for message in request.get("messages", [])
+    ]
+    blob = json.dumps({"messages": messages, "params": request_params(request)}, sort_keys=True,
+                      separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def usage_dict(usage: Any) -> Optional[Dict[str, int]]:
+    if usage is None:
+        return None
+    return {"prompt_tokens": usage.prompt_tokens, "completion_tokens": usage.completion_tokens}
+
+
+def response(reply: Dict[str, Any]) -> SimpleNamespace:
+    """A chat.completions response carrying a recorded or cached reply"""
+    usage = reply.get("usage") or {"prompt_tokens": 0, "completion_tokens": 0}
+    message = SimpleNamespace(role="assistant", content=reply["content"])
+    return SimpleNamespace(
+        model=reply["model"],
+        choices=[SimpleNamespace(index=0, message=message, finish_reason="stop")],
+        usage=SimpleNamespace(
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            total_tokens=usage["prompt_tokens"] + usage["completion_tokens"]
+        )
+    )
+
+
+class LLMTraffic:
+    """
+    Recorded LLM traffic and the response cache, both keyed by request_key().
+
+    lookup() answers a call without the backend when it can: from the
+    recording in replay mode (a key's replies in the order they were
+    recorded, cycling when a run makes more calls than were recorded), else
+    from the cache. store() hands it every call that did reach the backend,
+    to append to the recording and cache. The cache stays off while recording
+    or replaying, so recordings hold real calls and replays are exact.
+    """
+
+    def __init__(self, mode: str = LLM_TRAFFIC_MODE, path: str = LLM_TRAFFIC_PATH,
+                 max_bytes: int = LLM_TRAFFIC_MAX_BYTES, backups: int = LLM_TRAFFIC_BACKUPS,
+                 replay_misses: str = LLM_REPLAY_MISSES, replay_latency: bool = LLM_REPLAY_LATENCY,
+                 cache_entries: int = LLM_CACHE_ENTRIES, cache_ttl: float = LLM_CACHE_TTL,
+                 cache_stages: str = LLM_CACHE_STAGES):
+        self.mode = mode if mode in ("record", "replay") else ""
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.replay_misses = replay_misses
+        self.replay_latency = replay_latency
+        self.cache_entries = cache_entries if not self.mode else 0
+        self.cache_ttl = cache_ttl
+        self.cache_stages = {stage.strip() for stage in cache_stages.split(",") if stage.strip()}
+        self._lock = threading.Lock()
+        # key -> recorded replies, and how many of them replay has served
+        self._recorded: Dict[str, List[Dict[str, Any]]] = {}
+        self._served: Dict[str, int] = {}
+        # key -> (expires at, reply), least recently used first
+        self._cache: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self.counters = {"recorded": 0, "replayed": 0, "replay_misses": 0, "cache_hits": 0, "cache_misses": 0}
+        if self.mode == "replay":
+            self._load()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.mode or self.cache_entries > 0)
+
+    def lookup(self, stage: str, request: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        The reply to serve instead of calling the backend, or None to call it.
+        Raises ReplayMiss for an unrecorded call when replay misses fail.
+        """
+        if self.mode == "replay":
+            return self._replay(stage, request_key(request))
+        if not self._cacheable(stage):
+            return None
+        key = request_key(request)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                self.counters["cache_hits"] += 1
+                return entry[1]
+            if entry is not None:
+                del self._cache[key]
+            self.counters["cache_misses"] += 1
+        return None
+
+    def store(self, stage: str, request: Dict[str, Any], model: str, content: Optional[str], usage: Any,
+              seconds: float, error: Optional[Exception] = None) -> None:
+        """Account for a call the backend answered (or failed): record it, cache it"""
+        if self.mode == "record":
+            self._record(stage, request, model, content, usage, seconds, error)
+        if error is None and content is not None and self._cacheable(stage):
+            key = request_key(request)
+            reply = {"model": model, "content": content, "usage": usage_dict(usage)}
+            with self._lock:
+                self._cache[key] = (time.monotonic() + self.cache_ttl, reply)
+                self._cache.move_to_end(key)
+                while len(self._cache) > self.cache_entries:
+                    self._cache.popitem(last=False)
+
+    def delay(self, reply: Dict[str, Any]) -> float:
+        """Seconds to wait before serving a replayed reply"""
+        return reply.get("seconds", 0.0) if self.replay_latency and self.mode == "replay" else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(
+                self.counters,
+                mode=self.mode or None,
+                recorded_keys=len(self._recorded),
+                cache_entries=len(self._cache)
+            )
+
+    def _cacheable(self, stage: str) -> bool:
+        return self.cache_entries > 0 and (not self.cache_stages or stage in self.cache_stages)
+
+    def _replay(self, stage: str, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            replies = self._recorded.get(key)
+            if not replies:
+                self.counters["replay_misses"] += 1
+            else:
+                served = self._served.get(key, 0)
+                self._served[key] = served + 1
+                self.counters["replayed"] += 1
+                return replies[served % len(replies)]
+        if self.replay_misses == "live":
+            return None
+        raise ReplayMiss(f"no recorded reply for this {stage} request ({key[:12]})")
+
+    def _record(self, stage: str, request: Dict[str, Any], model: str, content: Optional[str], usage: Any,
+                seconds: float, error: Optional[Exception]) -> None:
+        line = json.dumps({
+            "key": request_key(request),
+            "stage": stage,
+            "model": model,
+            "messages": request.get("messages", []),
+            "params": request_params(request),
+            "content": content,
+            "usage": usage_dict(usage),
+            "seconds": round(seconds, 4),
+            "error": str(error) if error is not None else None,
+            "at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+        try:
+            with self._lock:
+                if self.max_bytes and os.path.exists(self.path) and \
+                        os.path.getsize(self.path) + len(line) + 1 > self.max_bytes:
+                    self._rotate()
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line + "\n")
+                self.counters["recorded"] += 1
+        except OSError as e:
+            print(f"Error recording LLM call to {self.path}: {str(e)}")
+
+    def _rotate(self) -> None:
+        """path -> path.1 -> path.2 ..., dropping the oldest beyond `backups`"""
+        if self.backups <= 0:
+            os.remove(self.path)
+            return
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    def _load(self) -> None:
+        """Read the recording, rotated files first so replies keep their recorded order"""
+        paths = [f"{self.path}.{number}" for number in range(self.backups, 0, -1)] + [self.path]
+        skipped = 0
+        for path in paths:
+            if not os.path.exists(path):
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        call = json.loads(line)
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    if call.get("error") is not None or call.get("content") is None:
+                        continue
+                    self._recorded.setdefault(call["key"], []).append({
+                        "model": call.get("model", ""),
+                        "content": call["content"],
+                        "usage": call.get("usage"),
+                        "seconds": call.get("seconds", 0.0)
+                    })
+        calls = sum(len(replies) for replies in self._recorded.values())
+        print(f"Replaying {calls} recorded LLM calls ({len(self._recorded)} distinct requests) from {self.path}"
+              + (f"; skipped {skipped} unreadable lines" if skipped else ""))
@@ -0,0 +1,216 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+# Latency buckets in seconds, from a cache hit to a slow multi-call turn
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+
+def _label_text(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Counter:
+    """A monotonically increasing Prometheus counter with labels"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.labels, key)} {value}" for key, value in values]
+
+
+class Histogram:
+    """A Prometheus histogram with labels and fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts, sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self) -> List[str]:
+        with self._lock:
+            values = sorted((key, [list(entry[0]), entry[1], entry[2]]) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in values:
+            for bound, bucket_count in zip(self.buckets, counts):
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {bucket_count}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_label_text(self.labels, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_label_text(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_label_text(self.labels, key)} {count}")
+        return lines
+
+
+class Gauge:
+    """A value read from a callback when /metrics is scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, read: Callable[[], float]):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self) -> List[str]:
+        try:
+            return [f"{self.name} {float(self.read())}"]
+        except Exception as e:
+            print(f"Error reading gauge {self.name}: {str(e)}")
+            return []
+
+
+class Registry:
+    """The metrics one process exposes on /metrics"""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def counter(self, name: str, help_text: str, labels: Tuple[str, ...] = ()) -> Counter:
+        metric = Counter(name, help_text, labels)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name: str, help_text: str, labels: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        metric = Histogram(name, help_text, labels, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def gauge(self, name: str, help_text: str, read: Callable[[], float]) -> Gauge:
+        metric = Gauge(name, help_text, read)
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Prometheus text exposition format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class AdmissionGauges:
+    """
+    The llm_in_flight, llm_waiting and turns_shed gauges, summed over every
+    admission controller bound to them. Each app binds its own, so a process
+    serving the async app still reports the calls its threads make.
+    """
+
+    GAUGES = (
+        ("llm_in_flight", "LLM calls holding an admission slot", "in_flight"),
+        ("llm_waiting", "LLM calls queued for an admission slot", "waiting"),
+        ("turns_shed", "Turns turned away with a 503 since start", "shed")
+    )
+
+    def __init__(self, registry: Registry):
+        self._admissions: List[Any] = []
+        for name, help_text, key in self.GAUGES:
+            registry.gauge(name, help_text, lambda key=key: self.read(key))
+
+    def bind(self, admission: Any) -> None:
+        self._admissions.append(admission)
+
+    def read(self, key: str) -> float:
+        return sum(admission.stats()[key] for admission in self._admissions)
+
+
+class Timeline:
+    """Stage-by-stage record of one turn; spans from fan-out calls can overlap"""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.started_at = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        # Set when the turn outlives its route, e.g. a streamed response, and is finished later
+        self.deferred = False
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, started_at: float, seconds: float, **details: Any) -> None:
+        span = {"stage": stage, "start": round(started_at - self.started_at, 4), "seconds": round(seconds, 4)}
+        span.update(details)
+        with self._lock:
+            self.spans.append(span)
+
+    def stage_totals(self) -> Dict[str, float]:
+        totals: Dict[str, float] = {}
+        with self._lock:
+            for span in self.spans:
+                totals[span["stage"]] = totals.get(span["stage"], 0.0) + span["seconds"]
+        return totals
+
+    def to_dict(self, seconds: float) -> Dict[str, Any]:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span["start"])
+        return {"route": self.route, "seconds": round(seconds, 4), "spans": spans}
+
+
+# The turn being timed in this context; fan-out workers inherit it via copy_context()
+current_timeline: ContextVar[Optional[Timeline]] = ContextVar("current_timeline", default=None)
+
+
+@contextmanager
+def timeline(route: str) -> Iterator[Timeline]:
+    """Collect the spans of everything timed while this turn runs"""
+    turn = Timeline(route)
+    token = current_timeline.set(turn)
+    try:
+        yield turn
+    finally:
+        current_timeline.reset(token)
+
+
+@contextmanager
+def span(stage: str, **details: Any) -> Iterator[Dict[str, Any]]:
+    """Time a stage into the current turn's timeline; the yielded dict adds details"""
+    started_at = time.monotonic()
+    try:
+        yield details
+    finally:
+        turn = current_timeline.get()
+        if turn is not None:
+            turn.add(stage, started_at, time.monotonic() - started_at, **details)
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import openai
+
+# Per-stage routing overrides: inline JSON, or the path of a JSON file, shaped like
+# {"routes": {"summary": {"models": ["gpt-4o-mini", "gpt-4o"], "max_tokens": 120}}, "prices": {...}}
+MODEL_ROUTES = os.getenv("MODEL_ROUTES", "")
+# Seconds a model that answered "overloaded" is skipped in favour of the next one in its chain
+MODEL_COOLDOWN = float(os.getenv("MODEL_COOLDOWN", "15"))
+
+FLAGSHIP_MODEL = os.getenv("FLAGSHIP_MODEL", "gpt-4o")
+FAST_MODEL = os.getenv("FAST_MODEL", "gpt-4o-mini")
+
+# Keyed by the stage label every LLM call already carries. "models" is the
+# fallback chain, tried in order; a temperature of None keeps the caller's;
+# "timeout" is the stage's deadline, retries and hedges included.
+DEFAULT_ROUTES: Dict[str, Dict[str, Any]] = {
+    # What the player reads: the flagship model, falling back to the fast one
+    "narrative": {"models": [FLAGSHIP_MODEL, FAST_MODEL], "max_tokens": 800, "temperature": None, "timeout": 60},
+    "turn": {"models": [FLAGSHIP_MODEL, FAST_MODEL], "max_tokens": 1600, "temperature": None, "timeout": 60},
+    "ending_narrative": {"models": [FLAGSHIP_MODEL, FAST_MODEL], "max_tokens": 600, "temperature": None, "timeout": 60},
+    # Auxiliary prompts with short, constrained replies
+    "options": {"models": [FAST_MODEL, FLAGSHIP_MODEL], "max_tokens": 200, "temperature": None, "timeout": 20},
+    "description": {"models": [FAST_MODEL, FLAGSHIP_MODEL], "max_tokens": 150, "temperature": None, "timeout": 20},
+    "summary": {"models": [FAST_MODEL, FLAGSHIP_MODEL], "max_tokens": 120, "temperature": None, "timeout": 20},
+    "ending": {"models": [FAST_MODEL, FLAGSHIP_MODEL], "max_tokens": 5, "temperature": 0.0, "timeout": 10},
+    "fold": {"models": [FAST_MODEL, FLAGSHIP_MODEL], "max_tokens": 400, "temperature": None, "timeout": 30},
+    # Anything not listed above
+    "*": {"models": [FLAGSHIP_MODEL, FAST_MODEL], "max_tokens": 800, "temperature": None, "timeout": 60},
+}
+
+# Outcomes of calls the backend never saw: failed fast, or answered from a
+# recording (a replay miss answers with an error) or the response cache
+UNSENT_OUTCOMES = ("short_circuited", "replay_miss", "replayed", "cached")
+
+# USD per million tokens: [prompt, completion]
+DEFAULT_PRICES: Dict[str, List[float]] = {
+    "gpt-4o": [2.50, 10.00],
+    "gpt-4o-mini": [0.15, 0.60],
+    "gpt-4.1": [2.00, 8.00],
+    "gpt-4.1-mini": [0.40, 1.60],
+    "gpt-4.1-nano": [0.10, 0.40],
+}
+
+# Upstream statuses that mean "try another model", not "this request is bad"
+OVERLOADED_STATUSES = {408, 409, 429, 500, 502, 503, 504, 529}
+
+
+def load_routing_config(value: str) -> Dict[str, Any]:
+    """Parse MODEL_ROUTES: inline JSON, or a path to a JSON file"""
+    if not value:
+        return {}
+    try:
+        if value.lstrip().startswith("{"):
+            return json.loads(value)
+        with open(value, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable MODEL_ROUTES {value!r}: {str(e)}")
+        return {}
+
+
+def is_overloaded(e: Exception) -> bool:
+    """Whether a failed call should move on to the next model in the chain"""
+    if isinstance(e, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    return getattr(e, "status_code", None) in OVERLOADED_STATUSES
+
+
+class Route:
+    """How one stage calls the LLM"""
+
+    def __init__(self, models: List[str], max_tokens: int, temperature: Optional[float], timeout: float):
+        self.models = list(models)
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.timeout = timeout
+
+    def temperature_or(self, default: float) -> float:
+        return default if self.temperature is None else self.temperature
+
+
+class ModelRouter:
+    """
+    Per-stage model, max_tokens, temperature and timeout, with a fallback chain.
+
+    chain() lists a stage's models with any that recently reported overload
+    moved to the back, so callers try them in order and only fall through on
+    is_overloaded() errors. record() keeps latency, tokens and cost per stage
+    and model for /health and the benchmarks.
+    """
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None, cooldown: float = MODEL_COOLDOWN):
+        config = config or {}
+        routes = {stage: dict(route) for stage, route in DEFAULT_ROUTES.items()}
+        for stage, overrides in config.get("routes", {}).items():
+            routes[stage] = dict(routes.get(stage, routes["*"]), **overrides)
+        self.routes = {
+            stage: Route(route["models"], int(route["max_tokens"]), route.get("temperature"), float(route["timeout"]))
+            for stage, route in routes.items()
+        }
+        self.prices = dict(DEFAULT_PRICES, **config.get("prices", {}))
+        self.cooldown = cooldown
+        self._cooling: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        # stage -> model -> counters
+        self._stats: Dict[str, Dict[str, Dict[str, float]]] = {}
+
+    def route(self, stage: str) -> Route:
+        return self.routes.get(stage, self.routes["*"])
+
+    def chain(self, stage: str) -> List[str]:
+        """The models to try for a stage, overloaded ones last"""
+        models = self.route(stage).models
+        now = time.monotonic()
+        with self._lock:
+            ready = [model for model in models if self._cooling.get(model, 0) <= now]
+        return ready + [model for model in models if model not in ready]
+
+    def overloaded(self, model: str) -> None:
+        """Skip `model` for a while after it reported overload"""
+        with self._lock:
+            self._cooling[model] = time.monotonic() + self.cooldown
+
+    def cost(self, model: str, prompt_tokens: int, completion_tokens: int) -> float:
+        """USD for one call, 0 for models without a price"""
+        price = self.prices.get(model)
+        if not price:
+            return 0.0
+        return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1_000_000
+
+    def record(self, stage: str, model: str, seconds: float, usage: Any, outcome: str) -> float:
+        """Account for one call; returns its cost"""
+        prompt_tokens = usage.prompt_tokens if usage is not None else 0
+        completion_tokens = usage.completion_tokens if usage is not None else 0
+        cost = self.cost(model, prompt_tokens, completion_tokens)
+        with self._lock:
+            entry = self._stats.setdefault(stage, {}).setdefault(model, {
+                "calls": 0, "errors": 0, "retries": 0, "hedges_lost": 0, "short_circuited": 0, "replay_miss": 0,
+                "replayed": 0, "cached": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                "cost_usd": 0.0
+            })
+            if outcome in UNSENT_OUTCOMES:
+                # Never sent upstream, so nothing was spent
+                entry[outcome] += 1
+                return 0.0
+            entry["calls"] += 1
+            if outcome == "retried":
+                entry["retries"] += 1
+            elif outcome == "hedge_lost":
+                entry["hedges_lost"] += 1
+            elif outcome != "ok":
+                entry["errors"] += 1
+            entry["seconds"] += seconds
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cost_usd"] += cost
+        return cost
+
+    def stats(self) -> Dict[str, Any]:
+        """Per stage and model: calls, errors, retries, lost hedges, unsent calls, mean latency, tokens and cost"""
+        with self._lock:
+            report = {}
+            for stage, models in self._stats.items():
+                report[stage] = {}
+                for model, entry in models.items():
+                    report[stage][model] = dict(
+                        entry,
+                        seconds=round(entry["seconds"], 3),
+                        mean_ms=round(entry["seconds"] * 1000 / entry["calls"], 1) if entry["calls"] else 0.0,
+                        cost_usd=round(entry["cost_usd"], 6)
+                    )
+            return report
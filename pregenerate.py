@@ -0,0 +1,136 @@
+"""
+Offline pre-generation of the story tree into a scene index.
+
+Plays the opening and then every option breadth-first, down to --depth
+choices, --concurrency turns at a time, appending each turn to an
+append-only index file keyed by its path of choices (the scene cache's
+keys). The app maps the file read-only at startup (SCENE_INDEX_PATH) and
+serves indexed paths without any LLM call; past the frontier it falls back
+to the scene cache and live generation.
+
+The options expanded are the ones each generated turn offers the player,
+so the tree is exactly what players can click through. Runs can be
+interrupted and resumed: turns already written are reused, not
+regenerated, and rerunning with a larger --depth only generates the new
+levels. Every finished level is published for the app's next start.
+
+    python pregenerate.py --depth 3 --concurrency 8
+"""
+import argparse
+import copy
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from app1 import (
+    DEFAULT_STORY_CONTEXT,
+    OPENING_CHOICE,
+    SCENE_INDEX_PATH,
+    GameState,
+    apply_choice,
+    finish_choice,
+    generate_narrative,
+    generate_opening,
+    model_router,
+    opening_fingerprint,
+    remember_turn,
+    scene_path,
+    turn_failed
+)
+from scene_index import SceneIndexWriter
+from story_context import StoryContext
+
+# (game state before the choice, option chosen); the opening is (None, None)
+Node = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, str]]]
+
+
+def play_node(writer: SceneIndexWriter, node: Node) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]], str]:
+    """
+    Play one node of the tree, reusing its turn if the index already has it.
+    Returns the game state after the turn, the turn, and "generated",
+    "reused" or "failed" (no state or turn: failed turns are never written).
+    """
+    state, option = node
+    game_state = GameState()
+    if state is None:
+        path = scene_path(game_state, OPENING_CHOICE)
+        generate = functools.partial(generate_opening, game_state)
+    else:
+        # Siblings share the parent's state; each plays on its own copy
+        game_state.from_dict(copy.deepcopy(state))
+        chosen_text, ai_prompt = apply_choice(game_state, {"choice_index": 0, "current_options": [option]})
+        path = scene_path(game_state, chosen_text)
+        generate = functools.partial(generate_narrative, game_state, chosen_text, ai_prompt)
+
+    turn = writer.get(path)
+    if turn is not None:
+        game_state.context = StoryContext.from_dict(DEFAULT_STORY_CONTEXT, turn["context_tiers"])
+        result, outcome = turn["result"], "reused"
+    else:
+        result = generate()
+        if turn_failed(result):
+            return None, None, "failed"
+        writer.add(path, {"result": result, "context_tiers": game_state.context.to_dict()})
+        outcome = "generated"
+    finish_choice(game_state, result)
+    remember_turn(game_state, result)
+    return game_state.to_dict(), result, outcome
+
+
+def children(state: Dict[str, Any], result: Dict[str, Any], branches: int) -> List[Node]:
+    """The options a turn offers that lead somewhere shared: not custom actions or restarts"""
+    if result.get("is_ending", False):
+        return []
+    options = [option for option in result["options"] if option.get("next_scene") not in ("custom_action", "start")]
+    return [(state, option) for option in options[:branches or None]]
+
+
+def llm_cost() -> float:
+    return sum(entry["cost_usd"] for models in model_router.stats().values() for entry in models.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--depth", type=int, default=3, help="choices to play past the opening")
+    parser.add_argument("--concurrency", type=int, default=8, help="turns generated at once")
+    parser.add_argument("--branches", type=int, default=0, help="options expanded per turn (0: all)")
+    parser.add_argument("--out", default=SCENE_INDEX_PATH or "scene_index.bin", help="index file to write")
+    args = parser.parse_args()
+
+    writer = SceneIndexWriter(args.out, opening_fingerprint)
+    if len(writer):
+        print(f"Resuming {args.out}: {len(writer)} turns already written")
+    pool = ThreadPoolExecutor(max_workers=max(1, args.concurrency), thread_name_prefix="pregenerate")
+    frontier: List[Node] = [(None, None)]
+    finished = False
+    try:
+        for depth in range(args.depth + 1):
+            started = time.monotonic()
+            counts = {"generated": 0, "reused": 0, "failed": 0}
+            next_frontier: List[Node] = []
+            for state, result, outcome in pool.map(functools.partial(play_node, writer), frontier):
+                counts[outcome] += 1
+                if result is not None and depth < args.depth:
+                    next_frontier.extend(children(state, result, args.branches))
+            size = writer.publish()
+            print(f"depth {depth}: {len(frontier)} turns ({counts['generated']} generated, {counts['reused']} reused, "
+                  f"{counts['failed']} failed) in {time.monotonic() - started:.1f}s; "
+                  f"index {len(writer)} turns, {size / 1024:.1f} KiB; ${llm_cost():.4f} so far")
+            frontier = next_frontier
+            if not frontier:
+                break
+        finished = True
+    except KeyboardInterrupt:
+        print("Interrupted; waiting for the turns in flight, rerun to resume")
+        pool.shutdown(wait=True, cancel_futures=True)
+        writer.publish()
+    finally:
+        pool.shutdown(wait=True)
+        writer.close(finished=finished)
+    if finished:
+        print(f"Wrote {args.out}; the app serves it at startup with SCENE_INDEX_PATH={args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,439 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from model_routing import is_overloaded
+
+# Extra attempts after every model in a stage's chain has been tried once
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "2"))
+# Full-jitter backoff between those attempts: random(0, min(cap, base * 2^n)) seconds
+LLM_RETRY_BASE = float(os.getenv("LLM_RETRY_BASE", "0.25"))
+LLM_RETRY_CAP = float(os.getenv("LLM_RETRY_CAP", "4"))
+# Retries and hedges may add at most this fraction of extra calls (plus a small reserve)
+LLM_RETRY_BUDGET = float(os.getenv("LLM_RETRY_BUDGET", "0.2"))
+# Send a duplicate of a call still running past its stage's p95 (0 turns hedging off)
+LLM_HEDGE = os.getenv("LLM_HEDGE", "1") == "1"
+# Calls a stage needs before its p95 is trusted, and the shortest hedge delay
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.2"))
+LLM_HEDGE_WORKERS = int(os.getenv("LLM_HEDGE_WORKERS", "32"))
+# The breaker opens when this share of upstream calls in the window failed...
+BREAKER_ERROR_RATE = float(os.getenv("BREAKER_ERROR_RATE", "0.5"))
+BREAKER_WINDOW = float(os.getenv("BREAKER_WINDOW", "30"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "20"))
+# ...and lets a single probe call through after this many seconds
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "15"))
+
+# An attempt is not started with less time than this left before the deadline
+MIN_ATTEMPT_SECONDS = 0.5
+
+
+class CircuitOpen(Exception):
+    """The upstream is failing; the call was not made"""
+
+    def __init__(self):
+        super().__init__("circuit breaker is open")
+
+
+class Attempt:
+    """One request to one model: its response or error, and how long it took"""
+
+    def __init__(self, model: str, error: Optional[Exception] = None):
+        self.model = model
+        self.started_at = time.monotonic()
+        self.waited = 0.0
+        self.seconds = 0.0
+        self.response: Any = None
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+
+class CircuitBreaker:
+    """
+    Closed while the upstream is healthy. Opens when the error rate over the
+    last `window` seconds reaches `error_rate` (with at least `min_calls`
+    calls), failing calls fast; after `open_seconds` one probe is let
+    through, which closes it again on success or reopens it on failure. A
+    call let through that ends with neither (cancelled) reports abandon(),
+    so a cancelled probe frees the slot for the next one.
+    """
+
+    def __init__(self, error_rate: float = BREAKER_ERROR_RATE, window: float = BREAKER_WINDOW,
+                 min_calls: int = BREAKER_MIN_CALLS, open_seconds: float = BREAKER_OPEN_SECONDS):
+        self.error_rate = error_rate
+        self.window = window
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.state = "closed"
+        self._events: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.short_circuited = 0
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls are being failed fast right now (a due probe still counts as open)"""
+        return self.state != "closed"
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = "half_open"
+            if self.state == "closed" or (self.state == "half_open" and not self._probing):
+                if self.state == "half_open":
+                    self._probing = True
+                return True
+            self.short_circuited += 1
+            return False
+
+    def success(self) -> None:
+        with self._lock:
+            if self.state == "half_open":
+                self._close()
+                return
+            self._add(True)
+
+    def failure(self) -> None:
+        with self._lock:
+            if self.state == "half_open":
+                self._open()
+                return
+            self._add(False)
+            total = len(self._events)
+            if self.state == "closed" and total >= self.min_calls and self._failures / total >= self.error_rate:
+                self._open()
+
+    def abandon(self) -> None:
+        """A call allow() let through was cancelled before it had an outcome; the state stays as it is"""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = len(self._events)
+            return {
+                "state": self.state,
+                "window_calls": total,
+                "window_error_rate": round(self._failures / total, 3) if total else 0.0,
+                "opened": self.opened,
+                "short_circuited": self.short_circuited
+            }
+
+    def _add(self, ok: bool) -> None:
+        # Called with the lock held
+        now = time.monotonic()
+        self._events.append((now, ok))
+        if not ok:
+            self._failures += 1
+        while self._events and now - self._events[0][0] > self.window:
+            if not self._events.popleft()[1]:
+                self._failures -= 1
+
+    def _open(self) -> None:
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self._probing = False
+        self.opened += 1
+
+    def _close(self) -> None:
+        self.state = "closed"
+        self._probing = False
+        self._events.clear()
+        self._failures = 0
+
+
+class RetryBudget:
+    """Token bucket: each successful call earns `ratio` tokens, each retry or hedge spends one"""
+
+    def __init__(self, ratio: float = LLM_RETRY_BUDGET, reserve: float = 10):
+        self.ratio = ratio
+        self.reserve = reserve
+        self._tokens = reserve
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def deposit(self) -> None:
+        with self._lock:
+            self._tokens = min(self.reserve + 100 * self.ratio, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.denied += 1
+            return False
+
+
+class LatencyTracker:
+    """Recent successful call times per (stage, model), for the hedging threshold"""
+
+    def __init__(self, size: int = 200):
+        self.size = size
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage: str, model: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get((stage, model))
+            if samples is None:
+                samples = self._samples[(stage, model)] = deque(maxlen=self.size)
+            samples.append(seconds)
+
+    def p95(self, stage: str, model: str, min_samples: int) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples.get((stage, model), ()))
+        if len(samples) < min_samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+
+class Resilience:
+    """
+    Deadlines, jittered retries, hedging and a circuit breaker around LLM calls.
+
+    call() runs `run(model, timeout) -> Attempt` until one succeeds: first down
+    the stage's model chain, then `retries` more times with full-jitter backoff,
+    never past the stage's deadline and only while the retry budget allows.
+    A call still running past its stage's observed p95 gets one hedged
+    duplicate when there is spare capacity. Async calls race the two, the
+    first success winning and the other cancelled. A thread can't be
+    interrupted, so there the primary runs to the end on the caller's thread
+    and the hedge, sent from a small pool, answers in its place when the
+    primary fails. Both outcomes of a hedged pair reach the breaker. Every
+    attempt is passed to `settle(attempt, outcome)` exactly once, with
+    outcome "ok", "retried", "error", "hedge_lost" or "short_circuited"; an
+    async run() that gets cancelled accounts for itself instead.
+    """
+
+    def __init__(self, retries: int = LLM_RETRIES, hedge: bool = LLM_HEDGE,
+                 spare_capacity: Callable[[], bool] = lambda: True, breaker: Optional[CircuitBreaker] = None):
+        self.retries = retries
+        self.hedge = hedge
+        self.spare_capacity = spare_capacity
+        # Callers that reach the same upstream can share one breaker
+        self.breaker = breaker or CircuitBreaker()
+        self.budget = RetryBudget()
+        self.latency = LatencyTracker()
+        self._executor = ThreadPoolExecutor(max_workers=LLM_HEDGE_WORKERS, thread_name_prefix="llm-hedge")
+        self._lock = threading.Lock()
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def call(self, stage: str, models: List[str], deadline: float,
+             run: Callable[[str, float], Attempt], settle: Callable[[Attempt, str], None]) -> Attempt:
+        give_up_at = time.monotonic() + deadline
+        number = 0
+        while True:
+            model = models[number % len(models)]
+            if not self.breaker.allow():
+                attempt = Attempt(model, CircuitOpen())
+                settle(attempt, "short_circuited")
+                return attempt
+            attempt = self._hedged(stage, model, give_up_at, run, settle)
+            if self._settled(stage, attempt, settle):
+                return attempt
+            number += 1
+            delay = self.retry_delay(number, len(models), attempt.error, give_up_at)
+            if delay is None:
+                settle(attempt, "error")
+                return attempt
+            settle(attempt, "retried")
+            time.sleep(delay)
+
+    async def acall(self, stage: str, models: List[str], deadline: float,
+                    run: Callable[[str, float], Awaitable[Attempt]],
+                    settle: Callable[[Attempt, str], None]) -> Attempt:
+        """Async counterpart of call()"""
+        give_up_at = time.monotonic() + deadline
+        number = 0
+        while True:
+            model = models[number % len(models)]
+            if not self.breaker.allow():
+                attempt = Attempt(model, CircuitOpen())
+                settle(attempt, "short_circuited")
+                return attempt
+            attempt = await self._ahedged(stage, model, give_up_at, run, settle)
+            if self._settled(stage, attempt, settle):
+                return attempt
+            number += 1
+            delay = self.retry_delay(number, len(models), attempt.error, give_up_at)
+            if delay is None:
+                settle(attempt, "error")
+                return attempt
+            settle(attempt, "retried")
+            await asyncio.sleep(delay)
+
+    def retry_delay(self, number: int, chain_length: int, error: Exception, give_up_at: float) -> Optional[float]:
+        """
+        Seconds to wait before attempt `number` (0-based) after `error`, or None
+        to give up. Moving down the model chain is immediate; retries after
+        that back off with full jitter.
+        """
+        if not is_overloaded(error) or number >= chain_length + self.retries:
+            return None
+        delay = 0.0
+        if number >= chain_length:
+            delay = random.uniform(0, min(LLM_RETRY_CAP, LLM_RETRY_BASE * 2 ** (number - chain_length)))
+        if time.monotonic() + delay + MIN_ATTEMPT_SECONDS > give_up_at or not self.budget.withdraw():
+            return None
+        return delay
+
+    def observe(self, ok: bool, error: Optional[Exception] = None) -> None:
+        """
+        Feed one upstream outcome to the breaker and the retry budget; errors
+        that aren't the upstream's fault count as healthy for the breaker.
+        """
+        if ok:
+            self.budget.deposit()
+        if ok or not is_overloaded(error):
+            self.breaker.success()
+        else:
+            self.breaker.failure()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hedged, hedge_wins = self.hedged, self.hedge_wins
+        return {
+            "breaker": self.breaker.stats(),
+            "hedged": hedged,
+            "hedge_wins": hedge_wins,
+            "retry_budget_denied": self.budget.denied
+        }
+
+    def _settled(self, stage: str, attempt: Attempt, settle: Callable[[Attempt, str], None]) -> bool:
+        self.observe(attempt.ok, attempt.error)
+        if not attempt.ok:
+            return False
+        self.latency.observe(stage, attempt.model, attempt.seconds)
+        settle(attempt, "ok")
+        return True
+
+    def _hedge_delay(self, stage: str, model: str, give_up_at: float) -> Optional[float]:
+        if not self.hedge:
+            return None
+        p95 = self.latency.p95(stage, model, LLM_HEDGE_MIN_SAMPLES)
+        if p95 is None:
+            return None
+        delay = max(LLM_HEDGE_MIN_DELAY, p95)
+        return delay if time.monotonic() + delay + MIN_ATTEMPT_SECONDS < give_up_at else None
+
+    def _may_hedge(self) -> bool:
+        # Never hedge while the upstream is struggling or live calls are queueing
+        return not self.breaker.is_open and self.spare_capacity() and self.budget.withdraw()
+
+    def _hedged(self, stage: str, model: str, give_up_at: float,
+                run: Callable[[str, float], Attempt], settle: Callable[[Attempt, str], None]) -> Attempt:
+        delay = self._hedge_delay(stage, model, give_up_at)
+        if delay is None:
+            return run(model, give_up_at - time.monotonic())
+        # The primary runs on the caller's thread; only the hedge goes to the pool, queued by a
+        # timer at the p95 of the primary's own running time, so nothing waits behind other calls
+        context = copy_context()
+        state: Dict[str, Any] = {"primary_done": False, "hedge": None}
+
+        def send_hedge() -> Optional[Attempt]:
+            # Decided when a worker picks it up: the primary may have finished while it was queued
+            timeout = give_up_at - time.monotonic()
+            with self._lock:
+                if state["primary_done"] or timeout < MIN_ATTEMPT_SECONDS:
+                    return None
+            if not self._may_hedge():
+                return None
+            with self._lock:
+                self.hedged += 1
+            return run(model, timeout)
+
+        def launch() -> None:
+            with self._lock:
+                if not state["primary_done"]:
+                    state["hedge"] = self._executor.submit(context.run, send_hedge)
+
+        timer = threading.Timer(delay, launch)
+        timer.daemon = True
+        timer.start()
+        try:
+            attempt = run(model, give_up_at - time.monotonic())
+        finally:
+            timer.cancel()
+            with self._lock:
+                state["primary_done"] = True
+                hedge = state["hedge"]
+        if hedge is None or hedge.cancel():
+            return attempt
+        if attempt.ok:
+            # A thread can't be interrupted: the hedge is left to finish and then accounted for
+            hedge.add_done_callback(lambda future: self._lost(future.result(), settle))
+            return attempt
+        hedged = hedge.result()
+        if hedged is None:
+            return attempt
+        if hedged.ok:
+            with self._lock:
+                self.hedge_wins += 1
+            self._lost(attempt, settle)
+            return hedged
+        # Both failed: both errors reach the breaker, and the caller carries on with the primary's
+        self._lost(hedged, settle)
+        return attempt
+
+    def _lost(self, attempt: Optional[Attempt], settle: Callable[[Attempt, str], None]) -> None:
+        """Account for the attempt of a hedged pair that didn't win (None: the hedge was never sent)"""
+        if attempt is None:
+            return
+        self.observe(attempt.ok, attempt.error)
+        settle(attempt, "hedge_lost")
+
+    async def _ahedged(self, stage: str, model: str, give_up_at: float,
+                       run: Callable[[str, float], Awaitable[Attempt]],
+                       settle: Callable[[Attempt, str], None]) -> Attempt:
+        delay = self._hedge_delay(stage, model, give_up_at)
+        if delay is None:
+            return await run(model, give_up_at - time.monotonic())
+        primary = asyncio.ensure_future(run(model, give_up_at - time.monotonic()))
+        hedge = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._may_hedge():
+                return await primary
+            with self._lock:
+                self.hedged += 1
+            hedge = asyncio.ensure_future(run(model, give_up_at - time.monotonic()))
+            pending = {primary, hedge}
+            winner = None
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if winner is None and task.result().ok:
+                        winner = task
+        except asyncio.CancelledError:
+            # The caller gave up on this call: so do both requests
+            primary.cancel()
+            if hedge is not None:
+                hedge.cancel()
+            raise
+        if winner is None:
+            self._lost(hedge.result(), settle)
+            return primary.result()
+        if winner is hedge:
+            with self._lock:
+                self.hedge_wins += 1
+        loser = hedge if winner is primary else primary
+        if loser.done():
+            self._lost(loser.result(), settle)
+        else:
+            # run() accounts for its own cancellation
+            loser.cancel()
+        return winner.result()
@@ -0,0 +1,298 @@
+import atexit
+import contextlib
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: saves from several workers are not serialized
+    fcntl = None
+
+
+def path_key(path: List[str]) -> str:
+    """Content address of a normalized path of scene ids and choices"""
+    normalized = [" ".join(re.sub(r"[^\w\s]", "", step.lower()).split()) for step in path]
+    return hashlib.sha256("\x1f".join(normalized).encode("utf-8")).hexdigest()
+
+
+class SceneCache:
+    """
+    Generated turns shared between players, keyed on the path of choices
+    that led to them.
+
+    Each path keeps up to `variants` turns. Until a path has them all, get()
+    serves a cached turn with probability `reuse` and otherwise reports a
+    miss, so the caller generates a fresh one and put() adds it; after that
+    a random variant is always served. Popular branches stay varied and soon
+    stop costing LLM calls. At most `max_paths` paths are kept, least
+    recently used evicted first.
+
+    With a `directory`, each turn is written once to a file named by the hash
+    of its content and the path -> turns index is saved as index.json, so the
+    cache survives restarts. Entries with a different `fingerprint` (e.g.
+    after a prompt change) are ignored.
+
+    Several workers may share a directory. Each saves every `save_interval`
+    seconds and at exit, holding a lock on index.json.lock. A save merges the
+    index on disk with the worker's own, adopts the other workers' paths and
+    replaces index.json atomically. Turn files are only deleted once the
+    merged index no longer refers to them; a worker that still lists a
+    deleted turn treats it as a miss.
+    """
+
+    def __init__(self, directory: Optional[str], max_paths: int, reuse: float = 0.8,
+                 variants: int = 3, fingerprint: str = "", save_interval: float = 30):
+        self.directory = directory
+        self.max_paths = max_paths
+        self.reuse = reuse
+        self.variants = max(1, variants)
+        self.fingerprint = fingerprint
+        self.save_interval = save_interval
+        # path key -> content hashes of its turns, least recently used first
+        self._paths: "OrderedDict[str, List[str]]" = OrderedDict()
+        # content hash -> number of paths using it, so shared turns are only deleted once
+        self._refs: Dict[str, int] = {}
+        # Serialized turns when there is no directory to keep them in
+        self._blobs: Dict[str, str] = {}
+        # Since the last save: paths dropped here, and turns no path here refers to any more
+        self._removed: Set[str] = set()
+        self._released: Set[str] = set()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._saved_at = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.rerolls = 0
+        self.evicted = 0
+        self._load()
+        if self.directory:
+            atexit.register(self.save)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_paths > 0
+
+    def get(self, path: List[str]) -> Optional[Dict[str, Any]]:
+        """A cached turn for `path`, or None if the caller should generate one"""
+        if not self.enabled:
+            return None
+        key = path_key(path)
+        with self._lock:
+            digests = self._paths.get(key)
+            if not digests:
+                self.misses += 1
+                return None
+            if len(digests) < self.variants and random.random() >= self.reuse:
+                # Generate another variant instead of replaying this branch
+                self.rerolls += 1
+                return None
+            self._paths.move_to_end(key)
+            digest = random.choice(digests)
+        turn = self._read(digest)
+        with self._lock:
+            if turn is None:
+                self.misses += 1
+                self._drop(key, digest)
+            else:
+                self.hits += 1
+        return turn
+
+    def put(self, path: List[str], turn: Dict[str, Any]) -> None:
+        """Add a freshly generated turn for `path`, replacing its oldest variant if full"""
+        if not self.enabled:
+            return
+        key = path_key(path)
+        data = json.dumps(turn, sort_keys=True, separators=(",", ":"))
+        digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        self._write(digest, data)
+        with self._lock:
+            digests = self._paths.setdefault(key, [])
+            self._paths.move_to_end(key)
+            if digest not in digests:
+                digests.append(digest)
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+                if len(digests) > self.variants:
+                    self._drop(key, digests[0])
+            self._evict()
+            self._dirty = True
+            save = time.monotonic() - self._saved_at >= self.save_interval
+        if save:
+            self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "paths": len(self._paths),
+                "turns": len(self._refs),
+                "max_paths": self.max_paths,
+                "hits": self.hits,
+                "misses": self.misses,
+                "rerolls": self.rerolls,
+                "evicted": self.evicted
+            }
+
+    def save(self) -> None:
+        """Merge the index into index.json if it changed since the last save"""
+        with self._lock:
+            self._saved_at = time.monotonic()
+            if not self.directory or not self._dirty:
+                return
+            self._dirty = False
+            ours = [(key, list(digests)) for key, digests in self._paths.items()]
+            removed, self._removed = self._removed, set()
+            released, self._released = self._released, set()
+        index_path = os.path.join(self.directory, "index.json")
+        try:
+            with self._index_lock():
+                mine = {key for key, _ in ours}
+                theirs = [(key, digests) for key, digests in self._read_index()
+                          if key not in mine and key not in removed]
+                # Other workers' paths count as less recently used than ours
+                merged = theirs + ours
+                trimmed, merged = merged[:-self.max_paths], merged[-self.max_paths:]
+                data = {"fingerprint": self.fingerprint, "paths": merged}
+                # Write then rename so a crash never leaves a half-written index
+                tmp_path = f"{index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, index_path)
+                referenced = {digest for _, digests in merged for digest in digests}
+                with self._lock:
+                    self._adopt(theirs[len(trimmed):])
+                    unused = (released | {digest for _, digests in trimmed for digest in digests}) - referenced
+                    for digest in unused - set(self._refs):
+                        self._remove_blob(digest)
+        except OSError as e:
+            print(f"Error saving scene cache index {index_path}: {str(e)}")
+            with self._lock:
+                # Try again next time
+                self._dirty = True
+                self._removed |= removed
+                self._released |= released
+
+    @contextlib.contextmanager
+    def _index_lock(self) -> Iterator[None]:
+        """Serialize saves across the workers sharing the directory"""
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, "index.json.lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _adopt(self, paths: List[Tuple[str, List[str]]]) -> None:
+        # Called with the lock held; paths other workers saved go in as the least recently used
+        for key, digests in reversed(paths):
+            if key in self._paths or key in self._removed:
+                continue
+            self._paths[key] = list(digests)
+            self._paths.move_to_end(key, last=False)
+            for digest in digests:
+                self._refs[digest] = self._refs.get(digest, 0) + 1
+        if len(self._paths) > self.max_paths:
+            self._evict()
+            self._dirty = True
+
+    def _evict(self) -> None:
+        # Called with the lock held
+        while len(self._paths) > self.max_paths:
+            old_key, old_digests = self._paths.popitem(last=False)
+            if self.directory:
+                self._removed.add(old_key)
+            self.evicted += 1
+            for old in old_digests:
+                self._release(old)
+
+    def _drop(self, key: str, digest: str) -> None:
+        # Called with the lock held
+        digests = self._paths.get(key)
+        if digests and digest in digests:
+            digests.remove(digest)
+            self._release(digest)
+            if not digests:
+                del self._paths[key]
+                if self.directory:
+                    self._removed.add(key)
+            self._dirty = True
+
+    def _release(self, digest: str) -> None:
+        # Called with the lock held; a turn no path refers to any more is deleted, on disk at the next save
+        self._refs[digest] = self._refs.get(digest, 1) - 1
+        if self._refs[digest] > 0:
+            return
+        del self._refs[digest]
+        self._blobs.pop(digest, None)
+        if self.directory:
+            self._released.add(digest)
+
+    def _remove_blob(self, digest: str) -> None:
+        try:
+            os.remove(self._blob_path(digest))
+        except OSError:
+            pass
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], f"{digest}.json")
+
+    def _read(self, digest: str) -> Optional[Dict[str, Any]]:
+        if not self.directory:
+            # Parsed on every read so callers never share a turn's dicts
+            data = self._blobs.get(digest)
+            return json.loads(data) if data is not None else None
+        try:
+            with open(self._blob_path(digest), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable cached turn {digest}: {str(e)}")
+            return None
+
+    def _write(self, digest: str, data: str) -> None:
+        if not self.directory:
+            with self._lock:
+                self._blobs[digest] = data
+            return
+        blob_path = self._blob_path(digest)
+        if os.path.exists(blob_path):
+            # Same content, same name: nothing to write
+            return
+        tmp_path = f"{blob_path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data)
+            os.replace(tmp_path, blob_path)
+        except OSError as e:
+            print(f"Error saving cached turn {blob_path}: {str(e)}")
+
+    def _read_index(self) -> List[Tuple[str, List[str]]]:
+        """The paths in index.json, least recently used first; none if it is missing, unreadable or stale"""
+        index_path = os.path.join(self.directory, "index.json")
+        if not os.path.exists(index_path):
+            return []
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring unreadable scene cache index {index_path}: {str(e)}")
+            return []
+        if data.get("fingerprint") != self.fingerprint:
+            return []
+        return [(key, list(digests)) for key, digests in data.get("paths", [])]
+
+    def _load(self) -> None:
+        if not self.directory or self.max_paths <= 0:
+            return
+        for key, digests in self._read_index()[-self.max_paths:]:
+            self._paths[key] = digests
+            for digest in digests:
+                self._refs[digest] = self._refs.get(digest, 0) + 1
@@ -0,0 +1,276 @@
+import hashlib
+import json
+import mmap
+import os
+import shutil
+import struct
+import threading
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+
+from scene_cache import path_key
+
+# File layout, all integers little-endian:
+#   header   MAGIC, sha256 of the prompt fingerprint
+#   records  path key (sha256), payload length, payload crc32, payload (zlib JSON) -- appended one per turn
+#   table    path key, payload offset, payload length -- sorted by key, written by publish()
+#   trailer  TABLE_MAGIC, table offset, entry count
+# Writers only ever append records, in a side file that publish() copies
+# (records, then a fresh table and trailer) over the served one.
+MAGIC = b"SCNIDX01"
+TABLE_MAGIC = b"SCNTBL01"
+HEADER = struct.Struct("<8s32s")
+RECORD = struct.Struct("<32sII")
+ENTRY = struct.Struct("<32sQI")
+TRAILER = struct.Struct("<8sQQ")
+
+
+class SceneIndexError(Exception):
+    """Raised for an index file that is corrupt or was built for other prompts"""
+
+
+def _digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+def _key(path: List[str]) -> bytes:
+    return bytes.fromhex(path_key(path))
+
+
+def _encode(turn: Dict[str, Any]) -> bytes:
+    return zlib.compress(json.dumps(turn, sort_keys=True, separators=(",", ":")).encode("utf-8"), 9)
+
+
+def _read_trailer(data) -> Optional[Tuple[int, int]]:
+    """(table offset, entries) if the file ends with a valid table, else None"""
+    size = len(data)
+    if size < HEADER.size + TRAILER.size:
+        return None
+    magic, table_offset, count = TRAILER.unpack_from(data, size - TRAILER.size)
+    if magic != TABLE_MAGIC or table_offset + count * ENTRY.size + TRAILER.size != size:
+        return None
+    return table_offset, count
+
+
+def _scan_records(data, end: int) -> Tuple[Dict[bytes, Tuple[int, int]], int]:
+    """
+    Walk the records up to `end`: key -> (payload offset, length), later
+    records winning, and where the last intact record ends. A torn write at
+    the tail (an interrupted run) stops the scan there.
+    """
+    entries: Dict[bytes, Tuple[int, int]] = {}
+    offset = HEADER.size
+    while offset + RECORD.size <= end:
+        key, length, crc = RECORD.unpack_from(data, offset)
+        start = offset + RECORD.size
+        # Payloads are never empty, so a zero-filled tail is torn too
+        if not length or start + length > end or zlib.crc32(data[start:start + length]) != crc:
+            break
+        entries[key] = (start, length)
+        offset = start + length
+    return entries, offset
+
+
+class SceneIndex:
+    """
+    Read-only view of a pre-generated scene index, memory-mapped so every
+    worker process shares one copy through the page cache.
+
+    get() binary-searches the sorted key table in place and decompresses the
+    turn straight out of the mapping, so lookups allocate nothing but the
+    result. A missing file, or one built for other prompts (`fingerprint`),
+    serves nothing.
+    """
+
+    def __init__(self, path: str, fingerprint: str = ""):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._table_offset = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path and os.path.exists(path):
+            try:
+                self._open(fingerprint)
+            except (OSError, ValueError, SceneIndexError) as e:
+                print(f"Ignoring scene index {path}: {str(e)}")
+                self.close()
+
+    @property
+    def enabled(self) -> bool:
+        return self._view is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, path: List[str]) -> bool:
+        """Whether `path` is indexed; unlike get() it decodes nothing and counts no hit or miss"""
+        return self.enabled and self._find(_key(path)) is not None
+
+    def get(self, path: List[str]) -> Optional[Dict[str, Any]]:
+        """The pre-generated turn for `path`, or None past the frontier"""
+        if not self.enabled:
+            return None
+        found = self._find(_key(path))
+        with self._lock:
+            if found is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if found is None:
+            return None
+        offset, length = found
+        return json.loads(zlib.decompress(self._view[offset:offset + length]))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "path": self.path if self.enabled else None,
+                "turns": self._count,
+                "bytes": len(self._view) if self.enabled else 0,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def close(self) -> None:
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    def _open(self, fingerprint: str) -> None:
+        with open(self.path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER.size:
+                raise SceneIndexError("file is too short")
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        magic, digest = HEADER.unpack_from(self._view, 0)
+        if magic != MAGIC:
+            raise SceneIndexError("not a scene index")
+        if digest != _digest(fingerprint):
+            raise SceneIndexError("built for different prompts")
+        trailer = _read_trailer(self._view)
+        if trailer is None:
+            raise SceneIndexError("no lookup table; it was never published")
+        self._table_offset, self._count = trailer
+
+    def _find(self, key: bytes) -> Optional[Tuple[int, int]]:
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            position = self._table_offset + middle * ENTRY.size
+            probe = self._view[position:position + 32]
+            if probe == key:
+                _, offset, length = ENTRY.unpack_from(self._view, position)
+                return offset, length
+            if probe.tobytes() < key:
+                low = middle + 1
+            else:
+                high = middle
+        return None
+
+
+class SceneIndexWriter:
+    """
+    Builds the scene index at `path` by appending records to a side file,
+    `path` + ".building", that no server ever maps.
+
+    The side file outlives an interrupted run, and the next writer resumes it
+    (cutting off a torn record at its tail), so pre-generation picks up where
+    it stopped; without one, a published index is extended instead. publish()
+    atomically replaces `path` with everything written so far. Servers that
+    already mapped the old file keep reading it until they restart.
+    """
+
+    def __init__(self, path: str, fingerprint: str):
+        self.path = path
+        self.building_path = path + ".building"
+        self._lock = threading.Lock()
+        self._entries: Dict[bytes, Tuple[int, int]] = {}
+        if not os.path.exists(self.building_path) and os.path.exists(path):
+            shutil.copyfile(path, self.building_path)
+        exists = os.path.exists(self.building_path) and os.path.getsize(self.building_path) > 0
+        self._file = open(self.building_path, "r+b" if exists else "w+b")
+        if exists:
+            self._resume(fingerprint)
+        else:
+            self._file.write(HEADER.pack(MAGIC, _digest(fingerprint)))
+            self._file.flush()
+        # Where the records end and the next one goes
+        self._end = self._file.seek(0, os.SEEK_END)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def __contains__(self, path: List[str]) -> bool:
+        with self._lock:
+            return _key(path) in self._entries
+
+    def get(self, path: List[str]) -> Optional[Dict[str, Any]]:
+        """A turn already in the file, e.g. from an earlier run"""
+        with self._lock:
+            found = self._entries.get(_key(path))
+        if found is None:
+            return None
+        offset, length = found
+        return json.loads(zlib.decompress(os.pread(self._file.fileno(), length, offset)))
+
+    def add(self, path: List[str], turn: Dict[str, Any]) -> None:
+        """Append a turn; flushed at once so an interrupted run keeps it"""
+        key = _key(path)
+        payload = _encode(turn)
+        with self._lock:
+            self._file.seek(self._end)
+            self._file.write(RECORD.pack(key, len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._file.flush()
+            self._entries[key] = (self._end + RECORD.size, len(payload))
+            self._end += RECORD.size + len(payload)
+
+    def publish(self) -> int:
+        """Replace the served index with every turn written so far; returns its size in bytes"""
+        with self._lock:
+            self._file.seek(self._end)
+            for key in sorted(self._entries):
+                offset, length = self._entries[key]
+                self._file.write(ENTRY.pack(key, offset, length))
+            self._file.write(TRAILER.pack(TABLE_MAGIC, self._end, len(self._entries)))
+            self._file.flush()
+            size = self._file.tell()
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            try:
+                shutil.copyfile(self.building_path, temp_path)
+                with open(temp_path, "rb") as f:
+                    os.fsync(f.fileno())
+                os.replace(temp_path, self.path)
+            finally:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+                # Later records go where the table was
+                self._file.truncate(self._end)
+            return size
+
+    def close(self, finished: bool = False) -> None:
+        """Close the side file, deleting it once the run is `finished` and published"""
+        self._file.close()
+        if finished:
+            os.remove(self.building_path)
+
+    def _resume(self, fingerprint: str) -> None:
+        data = self._file.read()
+        if len(data) < HEADER.size:
+            raise SceneIndexError(f"{self.building_path} is too short to be a scene index")
+        magic, digest = HEADER.unpack_from(data, 0)
+        if magic != MAGIC:
+            raise SceneIndexError(f"{self.building_path} is not a scene index")
+        if digest != _digest(fingerprint):
+            raise SceneIndexError(f"{self.building_path} was built for different prompts; delete it to start over")
+        trailer = _read_trailer(data)
+        end = trailer[0] if trailer is not None else len(data)
+        self._entries, records_end = _scan_records(data, end)
+        self._file.truncate(records_end)
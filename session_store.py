@@ -0,0 +1,326 @@
+import abc
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Which backend make_session_store() builds: "memory" or "sqlite"
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "sessions.db")
+# Sessions untouched for this many seconds are evicted
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", str(6 * 3600)))
+# In-memory limits: session count and approximate bytes (each session's pickled size)
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "100000"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(512 * 1024 * 1024)))
+# How long a request waits for another request on the same session
+SESSION_LOCK_TIMEOUT = float(os.getenv("SESSION_LOCK_TIMEOUT", "30"))
+# A lock held longer than this is assumed to belong to a dead worker
+SESSION_LOCK_LEASE = float(os.getenv("SESSION_LOCK_LEASE", "300"))
+# How often a request waiting for another worker's lease tries again
+LEASE_POLL_SECONDS = 0.05
+
+
+class SessionBusy(Exception):
+    """Raised when a session stays locked by another request for too long"""
+
+
+def encode_state(data: Dict[str, Any]) -> bytes:
+    """Compact blob for a GameState.to_dict()"""
+    data = dict(data)
+    if "context_tiers" in data:
+        # story_context is rendered from the tiers, no need to store it twice
+        data.pop("story_context", None)
+    return zlib.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+
+
+def decode_state(blob: bytes) -> Dict[str, Any]:
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+class SessionStore(abc.ABC):
+    """
+    Where game sessions live between requests.
+
+    Routes use checkout(), which holds the session's lock for the whole turn
+    and writes the state back when the turn finishes, so two requests on the
+    same session can't interleave their updates.
+    """
+
+    # Whether get/put/delete/stats block on I/O, so async callers run them off the event loop
+    blocking_io = False
+
+    def __init__(self, state_factory: Callable[[], Any]):
+        self.state_factory = state_factory
+        # session_id -> [lock, holders + waiters]; dropped when nobody needs it
+        self._locks: Dict[str, list] = {}
+        self._locks_guard = threading.Lock()
+
+    @abc.abstractmethod
+    def get(self, session_id: str) -> Optional[Any]:
+        """The session's state, or None if it is unknown or expired"""
+
+    @abc.abstractmethod
+    def put(self, session_id: str, game_state: Any) -> None:
+        """Store the session's state, replacing any earlier one"""
+
+    @abc.abstractmethod
+    def delete(self, session_id: str) -> None:
+        """Forget the session"""
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        return {}
+
+    def try_lease(self, session_id: str) -> bool:
+        """
+        Take the session's lease across worker processes without waiting; a
+        store that lives in one process has nothing to lease. Callers hold
+        the process-local lock first.
+        """
+        return True
+
+    def release_lease(self, session_id: str) -> None:
+        pass
+
+    @contextmanager
+    def lock(self, session_id: str) -> Iterator[None]:
+        """Serialize requests on one session within this process"""
+        with self._locks_guard:
+            entry = self._locks.setdefault(session_id, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            if not entry[0].acquire(timeout=SESSION_LOCK_TIMEOUT):
+                raise SessionBusy(session_id)
+            try:
+                yield
+            finally:
+                entry[0].release()
+        finally:
+            with self._locks_guard:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._locks[session_id]
+
+    @contextmanager
+    def checkout(self, session_id: Optional[str]) -> Iterator[Optional[Any]]:
+        """
+        Lock a session and yield its state (None if unknown); saved back on
+        success, rolled back to where it started if the turn raises.
+        """
+        if not session_id:
+            yield None
+            return
+        with self.lock(session_id):
+            game_state = self.get(session_id)
+            if game_state is None:
+                yield None
+                return
+            savepoint = self.savepoint(game_state)
+            try:
+                yield game_state
+            except BaseException:
+                self.rollback(session_id, savepoint)
+                raise
+            self.put(session_id, game_state)
+
+    def savepoint(self, game_state: Any) -> Optional[bytes]:
+        """
+        What rollback() needs to undo a turn on `game_state`. None for stores
+        whose get() returns a fresh copy: a turn that isn't put never reaches them.
+        """
+        return None
+
+    def rollback(self, session_id: str, savepoint: Optional[bytes]) -> None:
+        if savepoint is not None:
+            self.put(session_id, self._new_state(pickle.loads(savepoint)))
+
+    def _new_state(self, data: Dict[str, Any]) -> Any:
+        game_state = self.state_factory()
+        game_state.from_dict(data)
+        return game_state
+
+
+class MemorySessionStore(SessionStore):
+    """Live GameState objects with LRU, idle-TTL and memory-cap eviction (single process)"""
+
+    def __init__(self, state_factory: Callable[[], Any], max_sessions: int = SESSION_MAX_COUNT,
+                 max_bytes: int = SESSION_MAX_BYTES, idle_ttl: float = SESSION_IDLE_TTL):
+        super().__init__(state_factory)
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        # session_id -> [game_state, last_access, approx_bytes], least recently used first
+        self._sessions: "OrderedDict[str, list]" = OrderedDict()
+        self._bytes = 0
+        self._evicted = 0
+        self._guard = threading.Lock()
+
+    def get(self, session_id: str) -> Optional[Any]:
+        with self._guard:
+            self._expire(time.monotonic())
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return None
+            entry[1] = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return entry[0]
+
+    def put(self, session_id: str, game_state: Any) -> None:
+        # The pickled size tracks what a live session holds and costs a tenth of
+        # encode_state(); it's a cap, not an exact count
+        size = len(pickle.dumps(game_state.to_dict(), pickle.HIGHEST_PROTOCOL))
+        with self._guard:
+            old = self._sessions.pop(session_id, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._sessions[session_id] = [game_state, time.monotonic(), size]
+            self._bytes += size
+            self._expire(time.monotonic())
+            while len(self._sessions) > 1 and (
+                len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes
+            ):
+                self._evict_oldest()
+
+    def delete(self, session_id: str) -> None:
+        with self._guard:
+            entry = self._sessions.pop(session_id, None)
+            if entry is not None:
+                self._bytes -= entry[2]
+
+    def savepoint(self, game_state: Any) -> Optional[bytes]:
+        # Routes change the live object in place, so keep how it was
+        return pickle.dumps(game_state.to_dict(), pickle.HIGHEST_PROTOCOL)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._guard:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "approx_bytes": self._bytes,
+                "evicted": self._evicted
+            }
+
+    def _expire(self, now: float) -> None:
+        while self._sessions:
+            entry = next(iter(self._sessions.values()))
+            if now - entry[1] <= self.idle_ttl:
+                break
+            self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        _, entry = self._sessions.popitem(last=False)
+        self._bytes -= entry[2]
+        self._evicted += 1
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Compressed GameState blobs in a SQLite database in WAL mode, so several
+    worker processes on one box can share sessions. Per-session locks are
+    leases in the database, which also lets a crashed worker's lock expire.
+    """
+
+    blocking_io = True
+
+    def __init__(self, state_factory: Callable[[], Any], path: str = SESSION_DB_PATH,
+                 idle_ttl: float = SESSION_IDLE_TTL):
+        super().__init__(state_factory)
+        self.path = path
+        self.idle_ttl = idle_ttl
+        self._local = threading.local()
+        self._owner = uuid.uuid4().hex
+        self._writes = 0
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, state BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_locks ("
+            "session_id TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections can't be shared between threads
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=SESSION_LOCK_TIMEOUT, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, session_id: str) -> Optional[Any]:
+        row = self._conn().execute(
+            "SELECT state, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None or time.time() - row[1] > self.idle_ttl:
+            return None
+        return self._new_state(decode_state(row[0]))
+
+    def put(self, session_id: str, game_state: Any) -> None:
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO sessions (session_id, state, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET state = excluded.state, updated_at = excluded.updated_at",
+            (session_id, encode_state(game_state.to_dict()), now)
+        )
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.idle_ttl,))
+            conn.execute("DELETE FROM session_locks WHERE expires_at < ?", (now,))
+
+    def delete(self, session_id: str) -> None:
+        self._conn().execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def stats(self) -> Dict[str, Any]:
+        count, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(state)), 0) FROM sessions"
+        ).fetchone()
+        return {"backend": "sqlite", "sessions": count, "stored_bytes": size}
+
+    def try_lease(self, session_id: str) -> bool:
+        now = time.time()
+        return bool(self._conn().execute(
+            "INSERT INTO session_locks (session_id, owner, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(session_id) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at "
+            "WHERE session_locks.expires_at < ?",
+            (session_id, self._owner, now + SESSION_LOCK_LEASE, now)
+        ).rowcount)
+
+    def release_lease(self, session_id: str) -> None:
+        self._conn().execute(
+            "DELETE FROM session_locks WHERE session_id = ? AND owner = ?", (session_id, self._owner)
+        )
+
+    @contextmanager
+    def lock(self, session_id: str) -> Iterator[None]:
+        """Serialize requests on one session across threads and worker processes"""
+        with super().lock(session_id):
+            deadline = time.monotonic() + SESSION_LOCK_TIMEOUT
+            while not self.try_lease(session_id):
+                if time.monotonic() > deadline:
+                    raise SessionBusy(session_id)
+                time.sleep(LEASE_POLL_SECONDS)
+            try:
+                yield
+            finally:
+                self.release_lease(session_id)
+
+
+def make_session_store(state_factory: Callable[[], Any]) -> SessionStore:
+    """Build the backend selected by SESSION_STORE"""
+    if SESSION_STORE == "sqlite":
+        return SQLiteSessionStore(state_factory)
+    return MemorySessionStore(state_factory)
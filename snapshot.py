@@ -0,0 +1,77 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import time
+import zlib
+from typing import Any, Dict, Tuple
+
+# Bump when the payload layout changes; older snapshots still load but are treated as stale
+SNAPSHOT_VERSION = 1
+# Key save codes are signed with; without one a random key is used, so save
+# codes stop verifying when the process restarts
+SNAPSHOT_SECRET = os.getenv("SNAPSHOT_SECRET", "")
+# Snapshots older than this many seconds resume with a freshly generated scene
+SNAPSHOT_MAX_AGE = float(os.getenv("SNAPSHOT_MAX_AGE", str(30 * 24 * 3600)))
+
+
+class SnapshotError(Exception):
+    """Raised for a save snapshot that is malformed or not signed with our key"""
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class Snapshots:
+    """
+    Signed, compressed save codes for a game state.
+
+    A snapshot is "v<version>.<payload>.<signature>": the payload is the
+    zlib-compressed JSON of the state and when it was saved, the signature an
+    HMAC-SHA256 over everything before it. load() only returns states this
+    server signed, and says whether they are fresh enough to resume as-is.
+    """
+
+    def __init__(self, secret: str = SNAPSHOT_SECRET, max_age: float = SNAPSHOT_MAX_AGE):
+        if not secret:
+            print("SNAPSHOT_SECRET is not set; save codes will not verify after a restart")
+        self._key = secret.encode("utf-8") if secret else os.urandom(32)
+        self.max_age = max_age
+
+    def dump(self, state: Dict[str, Any]) -> str:
+        payload = json.dumps({"saved_at": time.time(), "game_state": state}, separators=(",", ":"))
+        body = f"v{SNAPSHOT_VERSION}.{_b64encode(zlib.compress(payload.encode('utf-8'), 9))}"
+        return f"{body}.{_b64encode(self._sign(body))}"
+
+    def load(self, snapshot: str) -> Tuple[Dict[str, Any], bool]:
+        """The saved state and whether it is fresh, or SnapshotError"""
+        try:
+            version_text, payload, signature = snapshot.split(".")
+            version = int(version_text[1:]) if version_text.startswith("v") else 0
+        except (AttributeError, ValueError):
+            raise SnapshotError("malformed snapshot")
+        try:
+            valid = hmac.compare_digest(self._sign(f"{version_text}.{payload}"), _b64decode(signature))
+        except ValueError:
+            valid = False
+        if not valid:
+            raise SnapshotError("snapshot signature does not match")
+        if not 0 < version <= SNAPSHOT_VERSION:
+            raise SnapshotError(f"unsupported snapshot version {version}")
+        try:
+            data = json.loads(zlib.decompress(_b64decode(payload)).decode("utf-8"))
+            state = data["game_state"]
+            saved_at = float(data["saved_at"])
+        except (ValueError, KeyError, TypeError, zlib.error):
+            raise SnapshotError("unreadable snapshot payload")
+        fresh = version == SNAPSHOT_VERSION and time.time() - saved_at <= self.max_age
+        return state, fresh
+
+    def _sign(self, body: str) -> bytes:
+        return hmac.new(self._key, body.encode("ascii"), hashlib.sha256).digest()
@@ -0,0 +1,206 @@
+import asyncio
+import functools
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+def state_version(state: Dict[str, Any]) -> str:
+    """Fingerprint of a serialized game state, to tell whether a speculation still applies"""
+    return hashlib.sha1(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def option_key(option: Dict[str, Any]) -> Tuple[str, str]:
+    return option.get("text", ""), option.get("next_scene", "")
+
+
+class Branch:
+    """One speculatively generated follow-up turn"""
+
+    def __init__(self, option: Dict[str, Any]):
+        self.option = option
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        self.future: Optional[Future] = None
+
+
+class Speculator:
+    """
+    Generates the follow-up turns for a session's likely options while the
+    player is still reading, so make_choice can serve a hit instantly.
+
+    `run_branch(state, option)` plays one option from a serialized state and
+    returns (new_state, result, tokens_used). At most `max_inflight` branches
+    run at once across all sessions; branches over that budget are skipped,
+    and so are whole turns while `spare_capacity()` says live calls are
+    queueing, so speculation never competes with the turns it is for.
+    """
+
+    def __init__(self, run_branch: Callable[[Dict[str, Any], Dict[str, Any]], Any],
+                 branches: int, max_inflight: int, ttl: float = 600,
+                 spare_capacity: Callable[[], bool] = lambda: True):
+        self.run_branch = run_branch
+        self.branches = branches
+        self.max_inflight = max_inflight
+        self.ttl = ttl
+        self.spare_capacity = spare_capacity
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_inflight), thread_name_prefix="speculate")
+        # session_id -> (state version the branches start from, {option key: Branch})
+        self._sessions: Dict[str, Tuple[str, Dict[Tuple[str, str], Branch]]] = {}
+        self._lock = threading.Lock()
+        self._inflight = 0
+        self.counters = {
+            "speculated": 0,
+            "skipped_budget": 0,
+            "skipped_busy": 0,
+            "hits": 0,
+            "misses": 0,
+            "wasted_tokens": 0,
+            "used_tokens": 0,
+            "saved_seconds": 0.0
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.branches > 0 and self.max_inflight > 0
+
+    def speculate(self, session_id: str, state: Dict[str, Any], options: List[Dict[str, Any]]) -> None:
+        """Start generating the first few options' follow-ups from `state`"""
+        if not self.enabled:
+            return
+        self.discard(session_id)
+        if not self.spare_capacity():
+            with self._lock:
+                self.counters["skipped_busy"] += 1
+            return
+        candidates = [option for option in options if option.get("next_scene") not in ("custom_action", "start")]
+        branches = {}
+        with self._lock:
+            stale = self._expire()
+            for option in candidates[:self.branches]:
+                if self._inflight >= self.max_inflight:
+                    self.counters["skipped_budget"] += 1
+                    continue
+                self._inflight += 1
+                self.counters["speculated"] += 1
+                branches[option_key(option)] = Branch(option)
+        # Submitted outside the lock: a branch that is already done runs its callbacks right away
+        for branch in branches.values():
+            branch.future = self._submit(branch, state)
+        if branches:
+            with self._lock:
+                self._sessions[session_id] = (state_version(state), branches)
+        for branch in stale:
+            self._waste(branch)
+
+    def claim(self, session_id: str, state: Dict[str, Any], option: Dict[str, Any]) -> Optional[Future]:
+        """
+        Take the branch for the option the player just picked, cancelling its
+        siblings. The returned future resolves to (new_state, result); None
+        means there was nothing usable and the turn must be generated live.
+        """
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        if entry is None:
+            return None
+        version, branches = entry
+        branch = branches.pop(option_key(option), None) if version == state_version(state) else None
+        for sibling in branches.values():
+            self._waste(sibling)
+        if branch is None or branch.future is None or branch.future.cancelled():
+            with self._lock:
+                self.counters["misses"] += 1
+            if branch is not None:
+                self._waste(branch)
+            return None
+
+        # Whatever has already been generated is time the player doesn't wait
+        finished_at = branch.finished_at or time.monotonic()
+        with self._lock:
+            self.counters["hits"] += 1
+            self.counters["saved_seconds"] += finished_at - branch.started_at
+
+        claimed = Future()
+
+        def resolve(future: Future) -> None:
+            if future.cancelled():
+                claimed.set_exception(RuntimeError("speculative turn was cancelled"))
+                return
+            try:
+                new_state, result, tokens = future.result()
+            except Exception as e:
+                claimed.set_exception(e)
+                return
+            with self._lock:
+                self.counters["used_tokens"] += tokens
+            claimed.set_result((new_state, result))
+
+        branch.future.add_done_callback(resolve)
+        return claimed
+
+    def discard(self, session_id: str) -> None:
+        """Drop a session's outstanding branches (they were never claimed)"""
+        with self._lock:
+            entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            for branch in entry[1].values():
+                self._waste(branch)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self.counters)
+            stats["inflight"] = self._inflight
+            stats["sessions"] = len(self._sessions)
+        claimed = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / claimed if claimed else 0.0
+        return stats
+
+    def _submit(self, branch: Branch, state: Dict[str, Any]) -> Future:
+        future = self._executor.submit(self.run_branch, state, branch.option)
+        future.add_done_callback(functools.partial(self._finished, branch))
+        return future
+
+    def _finished(self, branch: Branch, future: Any) -> None:
+        # Done, failed or cancelled: the branch gives back its budget slot
+        branch.finished_at = time.monotonic()
+        with self._lock:
+            self._inflight -= 1
+
+    def _waste(self, branch: Branch) -> None:
+        future = branch.future
+        if future is None or future.cancel():
+            # Stopped before it spent anything more
+            return
+
+        def count(done: Any) -> None:
+            if not done.cancelled() and done.exception() is None:
+                with self._lock:
+                    self.counters["wasted_tokens"] += done.result()[2]
+
+        future.add_done_callback(count)
+
+    def _expire(self) -> List[Branch]:
+        # Called with the lock held: forget sessions whose player never came back
+        now = time.monotonic()
+        stale = [
+            session_id for session_id, (_, branches) in self._sessions.items()
+            if all(now - branch.started_at > self.ttl for branch in branches.values())
+        ]
+        return [branch for session_id in stale for branch in self._sessions.pop(session_id)[1].values()]
+
+
+class AsyncSpeculator(Speculator):
+    """
+    Same policy as Speculator for a single event loop: `run_branch` is a
+    coroutine function and each branch a task on the loop, so its calls take
+    the loop's admission slots like any live turn. Unlike a thread, a wasted
+    branch is cancelled mid-call, and the tokens it had spent are not counted.
+    """
+
+    def _submit(self, branch: Branch, state: Dict[str, Any]) -> "asyncio.Task":
+        task = asyncio.ensure_future(self.run_branch(state, branch.option))
+        task.add_done_callback(functools.partial(self._finished, branch))
+        return task
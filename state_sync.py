@@ -0,0 +1,46 @@
+import hashlib
+import json
+from typing import Any, Dict, Optional, Tuple
+
+
+def fingerprint(value: Any) -> str:
+    """Short stable hash of a JSON-serializable value"""
+    blob = json.dumps(value, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(blob, digest_size=8).hexdigest()
+
+
+def state_delta(synced: Optional[Dict[str, Any]], fields: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    What changed in `fields` since they had the fingerprints in `synced`, and
+    their fingerprints now. The delta is {"set": {field: value}, "append":
+    {field: items}}: a list that only grew is sent as its new items, so a
+    long history costs nothing per turn.
+    """
+    synced = synced or {}
+    delta: Dict[str, Any] = {"set": {}, "append": {}}
+    fingerprints: Dict[str, Any] = {}
+    for name, value in fields.items():
+        old = synced.get(name)
+        if isinstance(value, list):
+            # Lists also keep their length, to recognise an append
+            fingerprints[name] = [fingerprint(value), len(value)]
+            if old == fingerprints[name]:
+                continue
+            if isinstance(old, list) and old[1] < len(value) and fingerprint(value[:old[1]]) == old[0]:
+                delta["append"][name] = value[old[1]:]
+                continue
+        else:
+            fingerprints[name] = fingerprint(value)
+            if old == fingerprints[name]:
+                continue
+        delta["set"][name] = value
+    return delta, fingerprints
+
+
+def apply_delta(fields: Dict[str, Any], delta: Dict[str, Any]) -> Dict[str, Any]:
+    """The client side of state_delta(): `fields` brought up to date"""
+    updated = dict(fields)
+    updated.update(delta.get("set", {}))
+    for name, items in delta.get("append", {}).items():
+        updated[name] = list(updated.get(name, [])) + items
+    return updated
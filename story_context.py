@@ -0,0 +1,162 @@
+import os
+import re
+import warnings
+from typing import Any, Callable, Dict, List, Optional
+
+# Token budget for the compressed summary of older turns
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", "300"))
+# Token budget for the most recent turns, kept verbatim
+CONTEXT_RECENT_TOKENS = int(os.getenv("CONTEXT_RECENT_TOKENS", "400"))
+# Model whose tokenizer we measure with
+CONTEXT_TOKENIZER_MODEL = os.getenv("CONTEXT_TOKENIZER_MODEL", "gpt-4o")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """
+    Load the tiktoken encoding once; None if tiktoken or its data isn't
+    available, with a single warning, since the estimate can miss the real
+    count and let the context overrun its budget.
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.encoding_for_model(CONTEXT_TOKENIZER_MODEL)
+        except Exception as e:
+            warnings.warn(f"tiktoken unavailable, estimating token counts for the context budget: {str(e)}",
+                          RuntimeWarning, stacklevel=2)
+            _encoding = None
+    return _encoding
+
+
+def _approximate_tokens(text: str) -> List[str]:
+    # Close enough to BPE counts for English prose to enforce a budget
+    return re.findall(r"\w+|[^\w\s]", text)
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens the way the model will see them"""
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return len(_approximate_tokens(text))
+
+
+def keep_last_tokens(text: str, limit: int) -> str:
+    """Hard-trim text to its last `limit` tokens"""
+    if limit <= 0:
+        return ""
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text)
+        return text if len(tokens) <= limit else encoding.decode(tokens[-limit:]).lstrip()
+    words = text.split()
+    while words and len(_approximate_tokens(" ".join(words))) > limit:
+        words = words[max(1, len(words) // 10):]
+    return " ".join(words)
+
+
+class StoryContext:
+    """
+    Token-budgeted story context.
+
+    The opening premise is kept as-is, the latest turns are kept verbatim, and
+    older turns are folded into a compressed summary a few at a time, so the
+    rendered context stays within a fixed budget however long the session is.
+    """
+
+    # One per live session; the premise is the shared default string
+    __slots__ = ("premise", "summary", "recent", "summary_budget", "recent_budget", "_recent_tokens")
+
+    def __init__(self, premise: str, summary: str = "", recent: Optional[List[str]] = None,
+                 summary_budget: int = CONTEXT_SUMMARY_TOKENS, recent_budget: int = CONTEXT_RECENT_TOKENS):
+        self.premise = premise
+        self.summary = summary
+        self.recent = list(recent or [])
+        self.summary_budget = summary_budget
+        self.recent_budget = recent_budget
+        self._recent_tokens = [count_tokens(event) for event in self.recent]
+
+    def render(self) -> str:
+        return " ".join(part for part in [self.premise, self.summary] + self.recent if part)
+
+    def tokens(self) -> int:
+        return count_tokens(self.render())
+
+    def add(self, event: str) -> None:
+        """Record the summary of the latest turn"""
+        event = event.strip()
+        if event:
+            self.recent.append(event)
+            self._recent_tokens.append(count_tokens(event))
+
+    def needs_fold(self) -> bool:
+        return sum(self._recent_tokens) > self.recent_budget
+
+    def fold_prompt(self) -> Optional[str]:
+        """
+        Prompt that folds the oldest recent turns into the summary tier, or None
+        while the recent tier is within budget. Only the current summary and the
+        turns being evicted are sent, never the whole history.
+        """
+        if not self.needs_fold():
+            return None
+        folded = self._fold_events()
+        return f"""
+        Condense the story so far into a single summary of at most {self.summary_budget * 3 // 4} words.
+        Keep the names, allies, enemies, items, injuries and unresolved threats the story still needs; drop scenery and repetition.
+
+        Summary so far: {self.summary or "(none yet)"}
+        Events to fold in: {" ".join(folded)}
+
+        Respond with ONLY the new summary.
+        """
+
+    def apply_fold(self, new_summary: Optional[str]) -> None:
+        """
+        Evict the turns named by fold_prompt() into the summary tier. Without a
+        usable summary the evicted turns are appended and the tier hard-trimmed.
+        """
+        folded = self._fold_events()
+        del self.recent[:len(folded)]
+        del self._recent_tokens[:len(folded)]
+        if not new_summary:
+            new_summary = " ".join([self.summary] + folded).strip()
+        self.summary = keep_last_tokens(new_summary.strip(), self.summary_budget)
+
+    def _fold_events(self) -> List[str]:
+        # Evict down to half the budget so folding happens every few turns, not every turn
+        total = sum(self._recent_tokens)
+        count = 0
+        while count < len(self.recent) and total > self.recent_budget // 2:
+            total -= self._recent_tokens[count]
+            count += 1
+        return self.recent[:count]
+
+    def fold(self, summarize: Callable[[str], Optional[str]]) -> None:
+        """Fold with a synchronous summarizer if the recent tier is over budget"""
+        prompt = self.fold_prompt()
+        if prompt is not None:
+            self.apply_fold(summarize(prompt))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"summary": self.summary, "recent": list(self.recent)}
+
+    @classmethod
+    def from_dict(cls, premise: str, data: Dict[str, Any]) -> "StoryContext":
+        return cls(premise, data.get("summary", ""), data.get("recent", []))
+
+    @classmethod
+    def from_text(cls, premise: str, text: str) -> "StoryContext":
+        """Rebuild from a flat story_context string, e.g. an old save"""
+        text = text.strip()
+        if text.startswith(premise):
+            text = text[len(premise):].strip()
+        context = cls(premise)
+        if text:
+            context.add(text)
+        return context
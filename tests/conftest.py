@@ -0,0 +1,21 @@
+import os
+import sys
+
+# The app reads its settings at import: run it on the fake backend, fast, with nothing persisted
+os.environ.update({
+    "LLM_BACKEND": "fake",
+    "FAKE_LLM_TTFT_MS": "0",
+    "FAKE_LLM_TOKENS_PER_SEC": "1000000",
+    "FAKE_LLM_ERROR_RATE": "0",
+    "OPENAI_API_KEY": "test",
+    "SNAPSHOT_SECRET": "test",
+    "SESSION_STORE": "memory",
+    "OPENING_POOL_SIZE": "0",
+    "SCENE_CACHE_DIR": "",
+    "SCENE_INDEX_PATH": "",
+    "LLM_TRAFFIC_MODE": "",
+    "LLM_CACHE_ENTRIES": "0",
+    "SLOW_TURN_LOG": "",
+    "ENDING_SAMPLE_LOG": ""
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
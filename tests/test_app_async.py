@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+import app1
+import app_async
+
+
+def flask_stream(path, choice):
+    """Start a game on app1 and post `choice(started)` to one of its stream routes"""
+    client = app1.app.test_client()
+    started = client.post("/start_game", json={}).get_json()
+    response = client.post(path, json=choice(started))
+    return response.status_code, response.get_data(as_text=True)
+
+
+def quart_stream(path, choice):
+    """The same exchange with app_async"""
+    async def exchange():
+        async with app_async.app.test_app() as test_app:
+            client = test_app.test_client()
+            started = await (await client.post("/start_game", json={})).get_json()
+            response = await client.post(path, json=choice(started))
+            return response.status_code, await response.get_data(as_text=True)
+    return asyncio.run(exchange())
+
+
+def both(path, choice):
+    return flask_stream(path, choice), quart_stream(path, choice)
+
+
+def body(started, **fields):
+    return dict({"session_id": started["session_id"], "choice_index": 0, "turn": started["turn"]}, **fields)
+
+
+@pytest.mark.parametrize("path", ["/make_choice_stream", "/custom_action_stream"])
+def test_unknown_session_is_a_400_in_both_apps(path):
+    (flask_status, _), (quart_status, _) = both(path, lambda started: body(started, session_id="nope"))
+    assert flask_status == quart_status == 400
+
+
+def test_bad_choice_is_a_400_in_both_apps():
+    (flask_status, _), (quart_status, _) = both("/make_choice_stream", lambda started: body(started, choice_index=99))
+    assert flask_status == quart_status == 400
+
+
+def test_stale_turn_is_a_409_in_both_apps():
+    (flask_status, _), (quart_status, quart_body) = both(
+        "/make_choice_stream", lambda started: body(started, turn=started["turn"] - 5)
+    )
+    assert flask_status == quart_status == 409
+    assert '"turn"' in quart_body
+
+
+def test_valid_choice_streams_the_same_events_in_both_apps():
+    (flask_status, flask_body), (quart_status, quart_body) = both("/make_choice_stream", body)
+    assert flask_status == quart_status == 200
+    for events in (flask_body, quart_body):
+        assert events.startswith("event: token") and "event: done" in events
+
+
+def test_async_hedging_reads_the_async_admission():
+    assert app_async.resilience is not app1.resilience
+    assert app_async.resilience.spare_capacity()
+    app_async.admission.waiting += 1
+    try:
+        assert not app_async.resilience.spare_capacity()
+        # The thread admission is idle, but it is not what the async app hedges on
+        assert app1.admission.stats()["waiting"] == 0
+    finally:
+        app_async.admission.waiting -= 1
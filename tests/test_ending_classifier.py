@@ -0,0 +1,102 @@
+import json
+
+import pytest
+
+import app1
+from app1 import GameState
+from ending_classifier import EndingClassifier, classify_ending, ending_features, normalize_verdict
+from eval_ending import evaluate, load_samples
+
+VICTORY = "The rift seals and peace returns. You have saved the multiverse. The end."
+DEFEAT = "You take your last breath as the multiverse collapses. Mission failed."
+OPEN = "A portal opens ahead. Suddenly a drone approaches. What will you do?"
+
+
+@pytest.mark.parametrize("narrative, turn, stats, expected", [
+    (VICTORY, 15, {"health": 80}, "victory"),
+    (DEFEAT, 15, {"health": 5}, "defeat"),
+    (OPEN, 3, {"health": 100}, "continue"),
+])
+def test_clear_narratives_are_decided_confidently(narrative, turn, stats, expected):
+    verdict, confidence = classify_ending(narrative, turn, stats)
+    assert verdict == expected
+    assert confidence >= 0.95
+
+
+def test_early_turns_lean_towards_continuing():
+    assert classify_ending("You saved the world.", 1, {"health": 100})[0] == "continue"
+    assert classify_ending("You saved the world.", 18, {"health": 100})[0] == "victory"
+
+
+def test_health_pulls_towards_defeat_and_bad_stats_are_ignored():
+    assert classify_ending("The corridor is quiet.", 10, {"health": 0})[0] == "defeat"
+    assert ending_features("x", 0, {"health": "unknown"})["health"] == 100.0
+    assert classify_ending("The corridor is quiet.", 10, {"health": "unknown"})[0] == "continue"
+
+
+def test_cues_match_whole_words_only():
+    assert ending_features("The undefeated hero presses on.", 0, {})["defeat"] == 0
+    assert ending_features("You defeat the drone. Defeat!", 0, {})["defeat"] == 1.2
+    assert ending_features("Years later, they sing of you", 0, {})["closure"] == 1.5
+
+
+def test_normalize_verdict_reads_replies_like_the_game():
+    assert normalize_verdict(" Victory.") == "victory"
+    assert normalize_verdict("DEFEAT") == "defeat"
+    assert normalize_verdict("continue") == normalize_verdict("maybe?") == "continue"
+
+
+def test_classifier_escalates_below_the_threshold_and_counts_agreement(tmp_path):
+    log = tmp_path / "endings.jsonl"
+    classifier = EndingClassifier(0.9, sample_log=str(log))
+    assert classifier.decide("victory", 0.95) == "victory"
+    assert classifier.decide("continue", 0.6) is None
+    classifier.record(OPEN, 3, {"health": 100}, "continue", 0.6, "continue")
+    classifier.record(VICTORY, 3, {"health": 100}, "continue", 0.6, "victory")
+    stats = classifier.stats()
+    assert (stats["local"], stats["escalated"], stats["agreed"], stats["disagreed"]) == (1, 1, 1, 1)
+    assert stats["calls_avoided"] == 0.5 and stats["agreement"] == 0.5
+    samples = [json.loads(line) for line in log.read_text().splitlines()]
+    assert [(sample["local"], sample["llm"]) for sample in samples] == [("continue", "continue"),
+                                                                         ("continue", "victory")]
+
+
+def test_audits_escalate_confident_turns():
+    classifier = EndingClassifier(0.5, audit_rate=1.0)
+    assert classifier.decide("victory", 0.99) is None
+    assert classifier.stats()["audited"] == 1
+    # Above 1 nothing is confident enough, so every turn asks the LLM
+    assert EndingClassifier(1.1).decide("victory", 1.0) is None
+
+
+def test_check_ending_asks_the_llm_only_when_unsure(monkeypatch):
+    monkeypatch.setattr(app1, "ending_classifier", EndingClassifier(0.9))
+    game_state = GameState()
+    for number in range(10):
+        game_state.visit(f"scene_{number}")
+    assert app1.check_ending(game_state, OPEN)[2] == "continue"
+    verdict, confidence, decision = app1.check_ending(game_state, "The corridor is quiet.")
+    assert decision is None
+    # A failed LLM call falls back to the local verdict
+    assert app1.settle_ending(game_state, "The corridor is quiet.", verdict, confidence, None) == verdict
+    assert app1.settle_ending(game_state, "The corridor is quiet.", verdict, confidence, "Defeat") == "defeat"
+
+
+def test_evaluation_reports_calls_avoided_and_agreement(tmp_path):
+    path = tmp_path / "endings.jsonl"
+    lines = [
+        {"narrative": VICTORY, "turn": 15, "player_stats": {"health": 80}, "llm": "victory"},
+        {"narrative": DEFEAT, "turn": 15, "player_stats": {"health": 5}, "llm": "defeat"},
+        {"narrative": OPEN, "turn": 3, "player_stats": {}, "llm": "continue"},
+        # Locally this reads as an early-turn continue; the LLM called it over
+        {"narrative": "You saved the world.", "turn": 1, "player_stats": {}, "llm": "victory"},
+    ]
+    path.write_text("\n".join(json.dumps(line) for line in lines) + "\nnot json\n" + json.dumps({"llm": "x"}) + "\n")
+    samples = load_samples([str(path)])
+    assert len(samples) == 4
+    results = evaluate(samples, [0.5, 0.95])
+    loose, strict = results["thresholds"]
+    assert loose["calls_avoided"] == 1.0 and loose["missed_endings"] == 1
+    assert loose["overall_agreement"] == 0.75
+    assert strict["calls_avoided"] == 0.75 and strict["overall_agreement"] == 1.0
+    assert results["labels"] == {"continue": 1, "victory": 2, "defeat": 1}
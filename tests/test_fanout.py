@@ -0,0 +1,121 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import app1
+import app_async
+from app1 import GameState
+
+NARRATIVE = "The hero lands on the rooftop as the portal tears open."
+OPTIONS = "1. Jump into the portal\n2. Call for backup\n3. Shield the crowd\n4. Study the portal"
+REPLIES = {
+    "description": "Lightning over the skyline.",
+    "summary": "The hero reached the portal.",
+    "ending": "continue",
+    "options": OPTIONS,
+    "ending_narrative": "The city is saved.",
+}
+# Seconds each fanned-out call takes; in sequence they would take 0.6
+DELAY = 0.15
+
+
+class Calls:
+    """Stand-ins for generate_ai_content in either app, recording the stages called"""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.stages = []
+        self.lock = threading.Lock()
+
+    def thread(self, prompt, temperature=0.7, stage="other"):
+        with self.lock:
+            self.stages.append(stage)
+        time.sleep(self.delays.get(stage, DELAY))
+        return REPLIES[stage]
+
+    async def event_loop(self, prompt, temperature=0.7, stage="other"):
+        self.stages.append(stage)
+        await asyncio.sleep(self.delays.get(stage, DELAY))
+        return REPLIES[stage]
+
+
+def ending_check(decision):
+    """check_ending as if the local classifier decided `decision`, or escalated when it's None"""
+    return lambda game_state, narrative_text: ("continue", 0.5, decision)
+
+
+def complete_thread_turn(monkeypatch, calls, decision):
+    monkeypatch.setattr(app1, "generate_ai_content", calls.thread)
+    monkeypatch.setattr(app1, "check_ending", ending_check(decision))
+    game_state = GameState()
+    started_at = time.monotonic()
+    result = app1.complete_turn(game_state, "Open the portal", NARRATIVE)
+    return game_state, result, time.monotonic() - started_at
+
+
+def complete_async_turn(monkeypatch, calls, decision):
+    monkeypatch.setattr(app_async, "generate_ai_content", calls.event_loop)
+    monkeypatch.setattr(app_async, "check_ending", ending_check(decision))
+    game_state = GameState()
+
+    async def run():
+        started_at = time.monotonic()
+        result = await app_async.complete_turn(game_state, "Open the portal", NARRATIVE)
+        await asyncio.sleep(0)
+        # Nothing the turn started is left running
+        assert asyncio.all_tasks() == {asyncio.current_task()}
+        return result, time.monotonic() - started_at
+
+    result, seconds = asyncio.run(run())
+    return game_state, result, seconds
+
+
+both = pytest.mark.parametrize("complete", [complete_thread_turn, complete_async_turn], ids=["thread", "async"])
+
+
+@both
+def test_calls_run_concurrently(monkeypatch, complete):
+    calls = Calls()
+    game_state, result, seconds = complete(monkeypatch, calls, None)
+    assert sorted(calls.stages) == ["description", "ending", "options", "summary"]
+    # Roughly the slowest call, not the sum of them
+    assert seconds < 2.5 * DELAY
+    assert result["narrative"] == NARRATIVE
+    assert result["scene_description"] == REPLIES["description"]
+    assert [option["text"] for option in result["options"][:4]] == [
+        "Jump into the portal", "Call for backup", "Shield the crowd", "Study the portal"
+    ]
+    assert not result["is_ending"]
+    # The context is only updated once every call is done
+    assert game_state.context.recent[-1] == REPLIES["summary"]
+
+
+@both
+def test_a_local_decision_skips_the_ending_call(monkeypatch, complete):
+    calls = Calls()
+    complete(monkeypatch, calls, "continue")
+    assert "ending" not in calls.stages
+
+
+@both
+def test_an_ending_ignores_the_speculative_options(monkeypatch, complete):
+    calls = Calls(delays={"options": 1.0})
+    game_state, result, seconds = complete(monkeypatch, calls, "victory")
+    assert result["is_ending"]
+    assert result["narrative"] == NARRATIVE + "\n\n" + REPLIES["ending_narrative"]
+    assert [option["text"] for option in result["options"]] == ["Start a new adventure"]
+    # The turn doesn't wait for the options it won't show
+    assert seconds < 1.0
+
+
+@both
+def test_a_slow_call_falls_back_at_the_deadline(monkeypatch, complete):
+    monkeypatch.setattr(app1, "LLM_CALL_TIMEOUT", 0.3)
+    monkeypatch.setattr(app_async, "LLM_CALL_TIMEOUT", 0.3)
+    calls = Calls(delays={"description": 1.0})
+    game_state, result, seconds = complete(monkeypatch, calls, "continue")
+    assert seconds < 0.8
+    assert result["scene_description"].startswith("You're standing on the edge")
+    assert result["options"][0]["text"] == "Jump into the portal"
@@ -0,0 +1,112 @@
+import asyncio
+import json
+import time
+
+import openai
+import pytest
+
+import app1
+from app1 import TURN_SCHEMA, GameState, options_prompt, parse_options, repair_turn, turn_response_format
+from llm_backend import HISTORY_MARKER, FakeAsyncOpenAI, FakeLLM, FakeLLMError, FakeOpenAI
+
+NARRATIVE = "The hero lands on the rooftop as the portal tears open."
+
+
+def fake(**options):
+    """An instant fake backend unless timing is asked for"""
+    options = dict({"ttft_ms": 0, "tokens_per_sec": 0, "error_rate": 0, "ending_rate": 0}, **options)
+    return FakeOpenAI(FakeLLM(**options))
+
+
+def reply(client, prompt, model="gpt-4o", **request):
+    response = client.chat.completions.create(model=model, messages=[{"role": "user", "content": prompt}],
+                                              **request)
+    return response.choices[0].message.content
+
+
+def played_state():
+    game_state = GameState()
+    game_state.visit("scene_2")
+    return game_state
+
+
+def test_same_seed_and_prompt_give_the_same_reply():
+    prompt = app1.narrative_prompt(GameState(), "Open the portal", "Create an opening.")
+    assert reply(fake(), prompt) == reply(fake(), prompt)
+    assert reply(fake(), prompt) != reply(fake(seed="other"), prompt)
+    # Another model answers differently, so a fallback doesn't repeat a failure
+    assert reply(fake(), prompt) != reply(fake(), prompt, model="gpt-4o-mini")
+
+
+def test_replies_fit_the_prompt_they_answer():
+    client = fake()
+    options = parse_options(reply(client, options_prompt(GameState(), NARRATIVE)))
+    assert len(options) == 5 and options[0] not in app1.DEFAULT_OPTIONS
+    assert reply(client, app1.ending_prompt(NARRATIVE, "The story so far.")) == "continue"
+    assert "\n\n" in reply(client, app1.narrative_prompt(GameState(), "Open the portal", "Create an opening."))
+
+
+def test_structured_turns_fill_the_turn_schema():
+    prompt = app1.structured_turn_prompt(GameState(), "Open the portal", "Create an opening.")
+    content = reply(fake(), prompt, response_format=turn_response_format(TURN_SCHEMA, "story_turn"))
+    turn = repair_turn(json.loads(content))
+    assert turn is not None and turn["ending"] == "continue"
+
+
+def test_only_turns_after_the_opening_end_the_story():
+    client = fake(ending_rate=1.0)
+    opening = app1.structured_turn_prompt(GameState(), "Open the portal", "Create an opening.")
+    later = app1.structured_turn_prompt(played_state(), "Open the portal", "Continue the story.")
+    schema = turn_response_format(TURN_SCHEMA, "story_turn")
+    assert json.loads(reply(client, opening, response_format=schema))["ending"] == "continue"
+    assert json.loads(reply(client, later, response_format=schema))["ending"] in ("victory", "defeat")
+    # The ending check sees history through the summaries the fake wrote earlier
+    assert reply(client, app1.ending_prompt(NARRATIVE, "You wake up.")) == "continue"
+    assert reply(client, app1.ending_prompt(NARRATIVE, f"Shuri {HISTORY_MARKER} Loki.")) in ("victory", "defeat")
+
+
+def test_injected_failures_look_like_dropped_connections():
+    client = fake(error_rate=1.0)
+    with pytest.raises(openai.APIConnectionError):
+        reply(client, "Anything")
+    with pytest.raises(FakeLLMError):
+        list(client.chat.completions.create(model="gpt-4o", messages=[{"role": "user", "content": "x"}],
+                                            stream=True))
+    assert client.llm.stats() == {"calls": 2, "errors": 2, "tokens": 0}
+
+
+def test_streams_the_reply_in_pieces_with_usage_last():
+    client = fake()
+    messages = [{"role": "user", "content": "Tell me a story."}]
+    whole = client.chat.completions.create(model="gpt-4o", messages=messages)
+    chunks = list(client.chat.completions.create(model="gpt-4o", messages=messages, stream=True,
+                                                 stream_options={"include_usage": True}))
+    pieces = [chunk.choices[0].delta.content for chunk in chunks if chunk.choices]
+    assert len(pieces) > 1
+    assert "".join(pieces) == whole.choices[0].message.content
+    assert not chunks[-1].choices
+    assert chunks[-1].usage.completion_tokens == whole.usage.completion_tokens > 0
+
+
+def test_async_client_gives_the_same_replies():
+    messages = [{"role": "user", "content": "Tell me a story."}]
+    client = FakeAsyncOpenAI(FakeLLM(ttft_ms=0, tokens_per_sec=0, error_rate=0))
+
+    async def stream():
+        chunks = await client.chat.completions.create(model="gpt-4o", messages=messages, stream=True)
+        return "".join([chunk.choices[0].delta.content async for chunk in chunks])
+
+    assert asyncio.run(stream()) == reply(fake(), "Tell me a story.")
+
+
+def test_max_tokens_cuts_the_reply_short():
+    client = fake()
+    prompt = app1.narrative_prompt(GameState(), "Open the portal", "Create an opening.")
+    assert len(reply(client, prompt, max_tokens=10).split(" ")) < len(reply(client, prompt).split(" "))
+
+
+def test_latency_follows_the_configured_time_to_first_token():
+    client = fake(ttft_ms=100, ttft_sigma=0)
+    started_at = time.monotonic()
+    reply(client, "Anything")
+    assert 0.09 < time.monotonic() - started_at < 0.5
@@ -0,0 +1,59 @@
+import pytest
+
+from llm_traffic import LLMTraffic, ReplayMiss, request_key
+
+
+def chat(prompt, temperature=0.7):
+    return {"messages": [{"role": "user", "content": prompt}], "temperature": temperature}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "llm_traffic.jsonl")
+
+
+def record(path, calls, **settings):
+    recorder = LLMTraffic(mode="record", path=path, **settings)
+    for request, content in calls:
+        recorder.store("narrative", request, "test-model", content, None, 0.01)
+    return recorder
+
+
+def test_replay_serves_replies_in_recorded_order_then_cycles(path):
+    record(path, [(chat("open"), "first"), (chat("other"), "unrelated"), (chat("open"), "second")])
+    replay = LLMTraffic(mode="replay", path=path)
+    served = [replay.lookup("narrative", chat("open"))["content"] for _ in range(3)]
+    assert served == ["first", "second", "first"]
+    assert replay.lookup("narrative", chat("other"))["content"] == "unrelated"
+
+
+def test_replay_keeps_the_order_across_rotated_files(path):
+    # Every call rotates the file, so each reply lands in its own backup
+    record(path, [(chat("open"), f"reply {number}") for number in range(4)], max_bytes=1, backups=5)
+    replay = LLMTraffic(mode="replay", path=path, backups=5)
+    assert [replay.lookup("narrative", chat("open"))["content"] for _ in range(4)] == \
+        [f"reply {number}" for number in range(4)]
+
+
+def test_replay_matches_prompts_up_to_whitespace(path):
+    record(path, [(chat("Open   the\n        story"), "reply")])
+    replay = LLMTraffic(mode="replay", path=path)
+    assert replay.lookup("narrative", chat("Open the story"))["content"] == "reply"
+    assert request_key(chat("Open the story")) != request_key(chat("Open the story", temperature=0.2))
+
+
+def test_failed_calls_are_never_replayed(path):
+    recorder = LLMTraffic(mode="record", path=path)
+    recorder.store("narrative", chat("open"), "test-model", None, None, 0.01, RuntimeError("timeout"))
+    recorder.store("narrative", chat("open"), "test-model", "reply", None, 0.01)
+    replay = LLMTraffic(mode="replay", path=path)
+    assert [replay.lookup("narrative", chat("open"))["content"] for _ in range(2)] == ["reply", "reply"]
+
+
+def test_unrecorded_call_fails_or_goes_live(path):
+    record(path, [(chat("open"), "reply")])
+    with pytest.raises(ReplayMiss):
+        LLMTraffic(mode="replay", path=path).lookup("narrative", chat("never recorded"))
+    live = LLMTraffic(mode="replay", path=path, replay_misses="live")
+    assert live.lookup("narrative", chat("never recorded")) is None
+    assert live.stats()["replay_misses"] == 1
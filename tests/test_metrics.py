@@ -0,0 +1,115 @@
+import asyncio
+import json
+
+import app1
+import app_async
+from metrics import Registry, span, timeline
+
+
+def samples(text):
+    """Sample name with labels -> value, from Prometheus text format"""
+    parsed = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            parsed[name] = float(value)
+    return parsed
+
+
+def scrape():
+    response = app1.app.test_client().get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    return samples(response.get_data(as_text=True))
+
+
+def grew(before, after, name):
+    return after.get(name, 0) - before.get(name, 0)
+
+
+def test_registry_renders_prometheus_text():
+    registry = Registry()
+    calls = registry.counter("calls_total", "Calls", ("stage",))
+    latency = registry.histogram("latency_seconds", "Latency", ("stage",), buckets=(0.1, 1))
+    registry.gauge("depth", "Queue depth", lambda: 3)
+    registry.gauge("broken", "Fails to read", lambda: 1 / 0)
+    calls.inc(stage='say "hi"\n')
+    calls.inc(2, stage="ending")
+    latency.observe(0.05, stage="ending")
+    latency.observe(0.5, stage="ending")
+    latency.observe(5, stage="ending")
+    text = registry.render()
+    assert "# HELP calls_total Calls\n# TYPE calls_total counter\n" in text
+    assert "# TYPE latency_seconds histogram" in text
+    assert samples(text) == {
+        'calls_total{stage="ending"}': 2,
+        'calls_total{stage="say \\"hi\\"\\n"}': 1,
+        'latency_seconds_bucket{stage="ending",le="0.1"}': 1,
+        'latency_seconds_bucket{stage="ending",le="1"}': 2,
+        'latency_seconds_bucket{stage="ending",le="+Inf"}': 3,
+        'latency_seconds_sum{stage="ending"}': 5.55,
+        'latency_seconds_count{stage="ending"}': 3,
+        "depth": 3,
+    }
+
+
+def test_spans_collect_into_the_current_turn():
+    with timeline("make_choice") as turn:
+        with span("scene_cache", hit=False):
+            pass
+        turn.add("narrative", turn.started_at, 0.25, llm=True)
+        turn.add("narrative", turn.started_at + 0.25, 0.5, llm=True)
+    with span("outside"):
+        pass
+    assert set(turn.stage_totals()) == {"scene_cache", "narrative"}
+    assert turn.stage_totals()["narrative"] == 0.75
+    # Spans come out in the order they started
+    assert [span["start"] for span in turn.to_dict(1.0)["spans"]][-1] == 0.25
+
+
+def test_a_turn_shows_up_in_metrics():
+    before = scrape()
+    assert app1.app.test_client().post("/start_game", json={}).status_code == 200
+    after = scrape()
+    assert grew(before, after, 'turn_seconds_count{route="start_game"}') == 1
+    calls = [name for name in after if name.startswith('llm_calls_total{stage="turn"') and 'outcome="ok"' in name]
+    assert calls and sum(grew(before, after, name) for name in calls) >= 1
+    assert grew(before, after, 'llm_tokens_total{stage="turn",kind="prompt"}') > 0
+    assert grew(before, after, 'llm_call_seconds_count{stage="turn"}') >= 1
+    assert after["llm_breaker_open"] == 0
+    assert "llm_in_flight" in after and "turns_shed" in after
+
+
+def test_a_streamed_turn_is_timed_when_its_stream_ends():
+    before = scrape()
+    response = app1.app.test_client().post("/start_game_stream", json={})
+    response.get_data()
+    after = scrape()
+    assert grew(before, after, 'turn_seconds_count{route="start_game_stream"}') == 1
+    assert grew(before, after, 'llm_first_token_seconds_count{stage="narrative"}') == 1
+    stages = [name for name in after if name.startswith('turn_stage_seconds_count{route="start_game_stream"')]
+    assert any('stage="narrative"' in name for name in stages)
+
+
+def test_slow_turns_are_logged_with_their_timeline(monkeypatch, tmp_path):
+    log = tmp_path / "slow.jsonl"
+    monkeypatch.setattr(app1, "SLOW_TURN_SECONDS", 1e-9)
+    monkeypatch.setattr(app1, "SLOW_TURN_LOG", str(log))
+    app1.app.test_client().post("/start_game", json={})
+    entry = json.loads(log.read_text().splitlines()[-1])
+    assert entry["route"] == "start_game"
+    assert any(span["stage"] == "turn" and span["llm"] for span in entry["spans"])
+
+
+def test_the_async_app_serves_the_same_metrics():
+    async def scrape_async():
+        async with app_async.app.test_app() as test_app:
+            client = test_app.test_client()
+            await client.post("/start_game", json={})
+            response = await client.get("/metrics")
+            return response.status_code, samples(await response.get_data(as_text=True))
+
+    status, after = asyncio.run(scrape_async())
+    assert status == 200
+    assert after['turn_seconds_count{route="start_game"}'] >= 1
+    assert "llm_waiting" in after
@@ -0,0 +1,107 @@
+import json
+import time
+from types import SimpleNamespace
+
+import httpx
+import openai
+
+import app1
+from llm_backend import FakeLLM, FakeLLMError, FakeOpenAI
+from model_routing import DEFAULT_ROUTES, ModelRouter, is_overloaded, load_routing_config
+
+
+def status_error(status):
+    request = httpx.Request("POST", "http://api.invalid/v1/chat/completions")
+    return openai.APIStatusError("upstream", response=httpx.Response(status, request=request), body=None)
+
+
+def test_chain_moves_overloaded_models_last_until_they_cool_down():
+    router = ModelRouter({"routes": {"narrative": {"models": ["a", "b", "c"]}}}, cooldown=0.05)
+    assert router.chain("narrative") == ["a", "b", "c"]
+    router.overloaded("a")
+    assert router.chain("narrative") == ["b", "c", "a"]
+    router.overloaded("b")
+    assert router.chain("narrative") == ["c", "a", "b"]
+    time.sleep(0.06)
+    assert router.chain("narrative") == ["a", "b", "c"]
+
+
+def test_every_model_overloaded_keeps_the_configured_order():
+    router = ModelRouter({"routes": {"narrative": {"models": ["a", "b"]}}})
+    router.overloaded("b")
+    router.overloaded("a")
+    assert router.chain("narrative") == ["a", "b"]
+
+
+def test_overrides_merge_into_defaults_and_unknown_stages_use_the_catch_all():
+    router = ModelRouter({"routes": {"summary": {"max_tokens": 50}, "lore": {"models": ["x"]}}})
+    summary = router.route("summary")
+    assert summary.max_tokens == 50
+    assert summary.models == DEFAULT_ROUTES["summary"]["models"]
+    # A new stage starts from "*"
+    assert router.route("lore").models == ["x"]
+    assert router.route("lore").max_tokens == DEFAULT_ROUTES["*"]["max_tokens"]
+    assert router.route("never-configured").models == DEFAULT_ROUTES["*"]["models"]
+    assert router.route("ending").temperature_or(0.7) == 0.0
+    assert router.route("narrative").temperature_or(0.7) == 0.7
+
+
+def test_routing_config_is_inline_json_or_a_file(tmp_path):
+    config = {"routes": {"summary": {"models": ["m"]}}}
+    path = tmp_path / "routes.json"
+    path.write_text(json.dumps(config))
+    assert load_routing_config(json.dumps(config)) == config
+    assert load_routing_config(str(path)) == config
+    assert load_routing_config("") == {}
+    assert load_routing_config(str(tmp_path / "missing.json")) == {}
+
+
+def test_overload_errors_fall_through_and_bad_requests_do_not():
+    assert is_overloaded(openai.APITimeoutError(request=None))
+    assert is_overloaded(FakeLLMError("injected failure"))
+    assert is_overloaded(status_error(429))
+    assert is_overloaded(status_error(503))
+    assert not is_overloaded(status_error(400))
+    assert not is_overloaded(ValueError("bad reply"))
+
+
+def test_record_counts_cost_only_for_calls_that_reached_the_backend():
+    router = ModelRouter({"prices": {"m": [1.0, 2.0]}})
+    usage = SimpleNamespace(prompt_tokens=1000, completion_tokens=500)
+    assert router.record("turn", "m", 0.2, usage, "ok") == 0.002
+    router.record("turn", "m", 0.4, usage, "retried")
+    assert router.record("turn", "m", 0.0, usage, "cached") == 0.0
+    assert router.record("turn", "unpriced", 0.1, usage, "ok") == 0.0
+    stats = router.stats()["turn"]["m"]
+    assert stats["calls"] == 2 and stats["retries"] == 1 and stats["cached"] == 1
+    assert stats["prompt_tokens"] == 2000
+    assert stats["mean_ms"] == 300.0
+    assert stats["cost_usd"] == 0.004
+
+
+class FailingModel(FakeOpenAI):
+    """The fake backend, except that every call to `model` fails the way the fake injects failures"""
+
+    def __init__(self, model):
+        super().__init__(FakeLLM(ttft_ms=0, tokens_per_sec=1_000_000, error_rate=0))
+        create = self.chat.completions.create
+
+        def failing_create(**request):
+            if request["model"] == model:
+                raise FakeLLMError("injected failure")
+            return create(**request)
+
+        self.chat.completions.create = failing_create
+
+
+def test_a_failing_model_falls_back_to_the_next_and_cools_down(monkeypatch):
+    router = ModelRouter({"routes": {"summary": {"models": ["first", "second"]}}})
+    monkeypatch.setattr(app1, "model_router", router)
+    monkeypatch.setattr(app1, "client", FailingModel("first"))
+    attempt = app1.call_llm("summary", messages=[{"role": "user", "content": "Summarize."}],
+                            temperature=0.7, max_tokens=100)
+    assert attempt.ok and attempt.model == "second"
+    assert router.chain("summary") == ["second", "first"]
+    stats = router.stats()["summary"]
+    assert stats["first"]["calls"] == 1 and stats["first"]["errors"] + stats["first"]["retries"] == 1
+    assert stats["second"]["calls"] == 1 and stats["second"]["errors"] == 0
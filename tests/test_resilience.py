@@ -0,0 +1,185 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import openai
+import pytest
+
+import resilience
+from resilience import Attempt, CircuitBreaker, Resilience, RetryBudget
+
+
+def overloaded():
+    return openai.APITimeoutError(request=None)
+
+
+def probing(breaker):
+    """Trip `breaker` and wait until it lets a probe through"""
+    for _ in range(breaker.min_calls):
+        breaker.failure()
+    assert breaker.state == "open"
+    time.sleep(breaker.open_seconds)
+    return breaker
+
+
+def half_open_breaker():
+    return probing(CircuitBreaker(error_rate=0.5, window=30, min_calls=2, open_seconds=0.01))
+
+
+def test_breaker_opens_then_probes_then_closes():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    # One probe at a time
+    assert not breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+    assert breaker.stats()["opened"] == 1
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_cancelled_probe_lets_the_next_call_probe():
+    breaker = half_open_breaker()
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def test_cancelled_stream_gives_up_its_probe(monkeypatch):
+    import app1
+    breaker = half_open_breaker()
+    monkeypatch.setattr(app1.resilience, "breaker", breaker)
+    stream = app1.stream_ai_content("Tell me a story", stage="narrative")
+    assert next(stream)
+    # The client disconnects mid-stream
+    stream.close()
+    assert breaker.allow()
+
+
+def test_cancelled_async_probe_gives_up_its_probe(monkeypatch):
+    import app_async
+    breaker = half_open_breaker()
+    monkeypatch.setattr(app_async.resilience, "breaker", breaker)
+
+    async def hang(**request):
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(app_async, "async_client",
+                        SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=hang))))
+
+    async def cancel_probe():
+        assert breaker.allow()
+        task = asyncio.ensure_future(app_async.request_llm("narrative", "test-model", 10, messages=[]))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(cancel_probe())
+    assert breaker.allow()
+
+
+def test_retry_budget_runs_out_and_refills():
+    budget = RetryBudget(ratio=0.5, reserve=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    assert budget.denied == 1
+    budget.deposit()
+    budget.deposit()
+    assert budget.withdraw()
+
+
+def test_retries_stop_when_the_budget_is_spent(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_RETRY_BASE", 0.0)
+    guard = Resilience(retries=5, hedge=False)
+    guard.budget = RetryBudget(ratio=0, reserve=1)
+    calls, outcomes = [], []
+
+    def run(model, timeout):
+        calls.append(model)
+        return Attempt(model, overloaded())
+
+    attempt = guard.call("narrative", ["gpt-a", "gpt-b"], 10, run, lambda a, outcome: outcomes.append(outcome))
+    assert not attempt.ok
+    # The first model, then one fallback paid for by the budget's only token
+    assert calls == ["gpt-a", "gpt-b"]
+    assert outcomes == ["retried", "error"]
+    assert guard.stats()["retry_budget_denied"] == 1
+
+
+def test_request_errors_are_not_retried():
+    guard = Resilience(retries=5, hedge=False)
+    calls = []
+
+    def run(model, timeout):
+        calls.append(model)
+        return Attempt(model, ValueError("bad request"))
+
+    assert not guard.call("narrative", ["gpt-a", "gpt-b"], 10, run, lambda a, outcome: None).ok
+    assert calls == ["gpt-a"]
+
+
+def warmed(guard, stage, model):
+    """Give `stage` enough fast samples that a slow call gets hedged"""
+    for _ in range(resilience.LLM_HEDGE_MIN_SAMPLES):
+        guard.latency.observe(stage, model, 0.01)
+    return guard
+
+
+def test_async_hedge_winner_cancels_the_slow_primary(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_HEDGE_MIN_DELAY", 0.02)
+    guard = warmed(Resilience(hedge=True), "narrative", "gpt-a")
+    started, cancelled, outcomes = [], [], []
+
+    async def run(model, timeout):
+        number = len(started)
+        started.append(number)
+        attempt = Attempt(model)
+        try:
+            await asyncio.sleep(5 if number == 0 else 0)
+        except asyncio.CancelledError:
+            cancelled.append(number)
+            raise
+        attempt.response = f"reply {number}"
+        return attempt
+
+    async def hedged_call():
+        return await guard.acall("narrative", ["gpt-a"], 10, run, lambda a, outcome: outcomes.append(outcome))
+
+    began = time.monotonic()
+    attempt = asyncio.run(hedged_call())
+    assert time.monotonic() - began < 1
+    assert attempt.response == "reply 1"
+    assert cancelled == [0]
+    assert outcomes == ["ok"]
+    assert (guard.hedged, guard.hedge_wins) == (1, 1)
+
+
+def test_hedge_answers_for_a_failed_primary(monkeypatch):
+    monkeypatch.setattr(resilience, "LLM_HEDGE_MIN_DELAY", 0.02)
+    guard = warmed(Resilience(hedge=True), "narrative", "gpt-a")
+    outcomes = []
+
+    def run(model, timeout):
+        attempt = Attempt(model)
+        if threading.current_thread().name.startswith("llm-hedge"):
+            attempt.response = "hedge"
+        else:
+            time.sleep(0.2)
+            attempt.error = ValueError("primary failed")
+        return attempt
+
+    attempt = guard.call("narrative", ["gpt-a"], 10, run, lambda a, outcome: outcomes.append(outcome))
+    assert attempt.response == "hedge"
+    assert sorted(outcomes) == ["hedge_lost", "ok"]
+    assert guard.hedge_wins == 1
@@ -0,0 +1,147 @@
+import glob
+import json
+import os
+
+from scene_cache import SceneCache, path_key
+
+PATH = ["scene_1", "Open the door"]
+
+
+def cache(directory=None, max_paths=10, **options):
+    options = dict({"reuse": 1.0, "variants": 1, "save_interval": 3600}, **options)
+    return SceneCache(str(directory) if directory else None, max_paths=max_paths, **options)
+
+
+def turn(text):
+    return {"result": {"narrative": text}}
+
+
+def blobs(directory):
+    return glob.glob(os.path.join(str(directory), "*", "*.json"))
+
+
+def test_path_key_ignores_case_punctuation_and_spacing():
+    assert path_key(["scene_1", "Open the door!"]) == path_key(["scene_1", "  open  the DOOR"])
+    assert path_key(["scene_1", "Open the door"]) != path_key(["scene_1", "Open the window"])
+    assert path_key(["a", "b c"]) != path_key(["a b", "c"])
+
+
+def test_serves_a_copy_of_what_was_put():
+    scenes = cache()
+    assert scenes.get(PATH) is None
+    scenes.put(PATH, turn("A hall."))
+    served = scenes.get(["scene_1", "open the door."])
+    assert served == turn("A hall.")
+    served["result"]["narrative"] = "changed"
+    assert scenes.get(PATH) == turn("A hall.")
+    assert scenes.stats()["hits"] == 2 and scenes.stats()["misses"] == 1
+
+
+def test_rerolls_until_a_path_has_all_its_variants():
+    scenes = cache(reuse=0.0, variants=2)
+    scenes.put(PATH, turn("one"))
+    assert scenes.get(PATH) is None
+    assert scenes.stats()["rerolls"] == 1
+    scenes.put(PATH, turn("two"))
+    assert scenes.get(PATH) in (turn("one"), turn("two"))
+    # A third variant replaces the oldest
+    scenes.put(PATH, turn("three"))
+    served = {scenes.get(PATH)["result"]["narrative"] for _ in range(50)}
+    assert served == {"two", "three"}
+
+
+def test_evicts_the_least_recently_used_path():
+    scenes = cache(max_paths=2)
+    scenes.put(["a"], turn("a"))
+    scenes.put(["b"], turn("b"))
+    scenes.get(["a"])
+    scenes.put(["c"], turn("c"))
+    assert scenes.get(["b"]) is None
+    assert scenes.get(["a"]) == turn("a") and scenes.get(["c"]) == turn("c")
+    assert scenes.stats()["evicted"] == 1
+
+
+def test_survives_a_restart_unless_the_prompts_changed(tmp_path):
+    scenes = cache(tmp_path, fingerprint="v1")
+    scenes.put(PATH, turn("A hall."))
+    scenes.save()
+    assert cache(tmp_path, fingerprint="v1").get(PATH) == turn("A hall.")
+    assert cache(tmp_path, fingerprint="v2").get(PATH) is None
+
+
+def test_shared_turns_are_deleted_with_their_last_path(tmp_path):
+    scenes = cache(tmp_path, max_paths=2)
+    scenes.put(["a"], turn("same"))
+    scenes.put(["b"], turn("same"))
+    assert len(blobs(tmp_path)) == 1
+    scenes.put(["c"], turn("c"))
+    scenes.save()
+    assert len(blobs(tmp_path)) == 2
+    scenes.put(["d"], turn("d"))
+    scenes.save()
+    assert scenes.get(["b"]) is None
+    assert len(blobs(tmp_path)) == 2
+
+
+def test_workers_sharing_a_directory_merge_their_indexes(tmp_path):
+    first, second = cache(tmp_path), cache(tmp_path)
+    first.put(["a"], turn("a"))
+    second.put(["b"], turn("b"))
+    first.save()
+    second.save()
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        saved = {key for key, _ in json.load(f)["paths"]}
+    assert saved == {path_key(["a"]), path_key(["b"])}
+    # A save also picks up what the other workers saved
+    assert second.get(["a"]) == turn("a")
+    assert cache(tmp_path).get(["b"]) == turn("b")
+
+
+def test_the_merged_index_keeps_the_most_recent_paths(tmp_path):
+    first, second = cache(tmp_path, max_paths=1), cache(tmp_path, max_paths=1)
+    first.put(["a"], turn("a"))
+    first.save()
+    second.put(["b"], turn("b"))
+    second.save()
+    # "a" was older, so the merged index keeps "b" and the turn for "a" is gone
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        assert [key for key, _ in json.load(f)["paths"]] == [path_key(["b"])]
+    assert len(blobs(tmp_path)) == 1
+    first.put(["c"], turn("c"))
+    first.save()
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        assert [key for key, _ in json.load(f)["paths"]] == [path_key(["c"])]
+    assert len(blobs(tmp_path)) == 1
+    # The second worker still lists "b"; its deleted turn reads as a miss
+    assert second.get(["b"]) is None
+    assert second.stats()["paths"] == 0
+
+
+def test_a_dropped_path_is_not_merged_back_from_disk(tmp_path):
+    scenes = cache(tmp_path)
+    scenes.put(["a"], turn("a"))
+    scenes.put(["b"], turn("b"))
+    scenes.save()
+    for blob in blobs(tmp_path):
+        with open(blob, encoding="utf-8") as f:
+            if json.load(f) == turn("a"):
+                os.remove(blob)
+    assert scenes.get(["a"]) is None
+    scenes.save()
+    with open(tmp_path / "index.json", encoding="utf-8") as f:
+        assert [key for key, _ in json.load(f)["paths"]] == [path_key(["b"])]
+
+
+def test_a_failed_save_is_retried(tmp_path, monkeypatch):
+    scenes = cache(tmp_path)
+    scenes.put(PATH, turn("A hall."))
+
+    def unwritable(*args, **kwargs):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(os, "replace", unwritable)
+        scenes.save()
+    assert not os.path.exists(tmp_path / "index.json")
+    scenes.save()
+    assert cache(tmp_path).get(PATH) == turn("A hall.")
@@ -0,0 +1,108 @@
+import os
+
+import pytest
+
+from scene_index import HEADER, RECORD, SceneIndex, SceneIndexError, SceneIndexWriter
+
+FINGERPRINT = "prompts-v1"
+OPENING = ["start", "begin your hero's journey"]
+BRANCH = ["start", "scene_bunker_escape_route", "Follow the signal"]
+
+
+def turn(narrative):
+    return {"result": {"narrative": narrative, "options": []}, "context_tiers": {}}
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "scene_index.bin")
+
+
+def test_published_turns_are_served(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.add(BRANCH, turn("branch"))
+    writer.publish()
+    writer.close(finished=True)
+    assert not os.path.exists(path + ".building")
+
+    index = SceneIndex(path, FINGERPRINT)
+    assert len(index) == 2
+    assert index.get(OPENING) == turn("opening")
+    assert index.get(BRANCH) == turn("branch")
+    assert index.get(["start", "elsewhere"]) is None
+    assert OPENING in index and ["start", "elsewhere"] not in index
+    assert (index.stats()["hits"], index.stats()["misses"]) == (2, 1)
+
+
+def test_index_for_other_prompts_serves_nothing(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.publish()
+    writer.close(finished=True)
+    index = SceneIndex(path, "prompts-v2")
+    assert not index.enabled
+    assert index.get(OPENING) is None
+
+
+def test_unpublished_file_serves_nothing(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.close()
+    assert not SceneIndex(writer.building_path, FINGERPRINT).enabled
+
+
+def test_interrupted_run_resumes_without_the_torn_record(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.add(BRANCH, turn("branch"))
+    writer.close()
+    # The run died halfway through writing the second record
+    with open(path + ".building", "r+b") as f:
+        f.truncate(os.path.getsize(path + ".building") - 5)
+
+    resumed = SceneIndexWriter(path, FINGERPRINT)
+    assert len(resumed) == 1
+    assert resumed.get(OPENING) == turn("opening")
+    assert BRANCH not in resumed
+    resumed.add(BRANCH, turn("branch again"))
+    resumed.publish()
+    resumed.close(finished=True)
+    assert SceneIndex(path, FINGERPRINT).get(BRANCH) == turn("branch again")
+
+
+def test_corrupt_record_stops_the_resume_there(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.add(BRANCH, turn("branch"))
+    writer.close()
+    with open(path + ".building", "r+b") as f:
+        f.seek(HEADER.size + RECORD.size)
+        first = f.read(1)
+        f.seek(HEADER.size + RECORD.size)
+        f.write(bytes([first[0] ^ 0xFF]))
+
+    resumed = SceneIndexWriter(path, FINGERPRINT)
+    assert len(resumed) == 0
+    resumed.close()
+
+
+def test_published_index_is_extended_by_the_next_run(path):
+    writer = SceneIndexWriter(path, FINGERPRINT)
+    writer.add(OPENING, turn("opening"))
+    writer.publish()
+    writer.close(finished=True)
+
+    extended = SceneIndexWriter(path, FINGERPRINT)
+    assert extended.get(OPENING) == turn("opening")
+    extended.add(BRANCH, turn("branch"))
+    extended.publish()
+    extended.close(finished=True)
+    index = SceneIndex(path, FINGERPRINT)
+    assert len(index) == 2
+
+
+def test_resuming_a_side_file_for_other_prompts_fails(path):
+    SceneIndexWriter(path, FINGERPRINT).close()
+    with pytest.raises(SceneIndexError):
+        SceneIndexWriter(path, "prompts-v2")
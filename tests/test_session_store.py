@@ -0,0 +1,68 @@
+import pytest
+
+import session_store
+from app1 import GameState
+from session_store import MemorySessionStore, SessionBusy, SQLiteSessionStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    return str(tmp_path / "sessions.db")
+
+
+def test_lease_excludes_other_workers_until_released(db_path):
+    # Two stores on one database stand in for two worker processes
+    first, second = SQLiteSessionStore(GameState, db_path), SQLiteSessionStore(GameState, db_path)
+    assert first.try_lease("s1")
+    assert not second.try_lease("s1")
+    assert second.try_lease("s2")
+    first.release_lease("s1")
+    assert second.try_lease("s1")
+
+
+def test_release_only_drops_our_own_lease(db_path):
+    first, second = SQLiteSessionStore(GameState, db_path), SQLiteSessionStore(GameState, db_path)
+    assert first.try_lease("s1")
+    second.release_lease("s1")
+    assert not second.try_lease("s1")
+
+
+def test_expired_lease_is_taken_over(db_path, monkeypatch):
+    first, second = SQLiteSessionStore(GameState, db_path), SQLiteSessionStore(GameState, db_path)
+    monkeypatch.setattr(session_store, "SESSION_LOCK_LEASE", -1.0)
+    assert first.try_lease("s1")
+    assert second.try_lease("s1")
+
+
+def test_lock_times_out_while_another_worker_holds_the_lease(db_path, monkeypatch):
+    monkeypatch.setattr(session_store, "SESSION_LOCK_TIMEOUT", 0.1)
+    first, second = SQLiteSessionStore(GameState, db_path), SQLiteSessionStore(GameState, db_path)
+    with first.lock("s1"):
+        with pytest.raises(SessionBusy):
+            with second.lock("s1"):
+                pass
+    with second.lock("s1"):
+        assert not first.try_lease("s1")
+
+
+def test_checkout_writes_back_the_finished_turn(db_path):
+    store = SQLiteSessionStore(GameState, db_path)
+    store.put("s1", GameState())
+    with store.checkout("s1") as game_state:
+        game_state.turn = 3
+    assert store.get("s1").turn == 3
+    with store.checkout("missing") as game_state:
+        assert game_state is None
+
+
+def test_checkout_rolls_back_a_failed_turn():
+    store = MemorySessionStore(GameState)
+    store.put("s1", GameState())
+    with pytest.raises(RuntimeError):
+        with store.checkout("s1") as game_state:
+            game_state.turn = 3
+            game_state.visit("scene_half_played")
+            raise RuntimeError("turn failed")
+    restored = store.get("s1")
+    assert restored.turn == 0
+    assert restored.visited_locations == []
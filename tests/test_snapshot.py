@@ -0,0 +1,40 @@
+import pytest
+
+from snapshot import Snapshots, SnapshotError
+
+STATE = {"current_scene": "scene_stark_tower_rooftop", "inventory": ["shield"], "turn": 4}
+
+
+def test_signed_snapshot_round_trips():
+    snapshots = Snapshots("secret")
+    state, fresh = snapshots.load(snapshots.dump(STATE))
+    assert state == STATE
+    assert fresh
+
+
+def test_snapshot_from_another_key_is_rejected():
+    with pytest.raises(SnapshotError):
+        Snapshots("other").load(Snapshots("secret").dump(STATE))
+
+
+def test_tampered_payload_is_rejected():
+    snapshots = Snapshots("secret")
+    version, payload, signature = snapshots.dump(STATE).split(".")
+    forged = Snapshots("other").dump(dict(STATE, inventory=["infinity gauntlet"])).split(".")[1]
+    with pytest.raises(SnapshotError):
+        snapshots.load(f"{version}.{forged}.{signature}")
+    with pytest.raises(SnapshotError):
+        snapshots.load(f"{version}.{payload}.{signature[:-2]}")
+
+
+@pytest.mark.parametrize("snapshot", ["", "not a snapshot", "v1.abc", None, "v1.!!.!!"])
+def test_malformed_snapshot_is_rejected(snapshot):
+    with pytest.raises(SnapshotError):
+        Snapshots("secret").load(snapshot)
+
+
+def test_old_snapshot_loads_but_is_stale():
+    snapshots = Snapshots("secret", max_age=-1)
+    state, fresh = snapshots.load(snapshots.dump(STATE))
+    assert state == STATE
+    assert not fresh
@@ -0,0 +1,147 @@
+import asyncio
+import threading
+import time
+
+from speculation import AsyncSpeculator, Speculator, state_version
+
+STATE = {"current_scene": "start", "turn": 1}
+OPTIONS = [
+    {"text": "Follow the signal", "next_scene": "scene_signal"},
+    {"text": "Hold your ground", "next_scene": "scene_ground"},
+    {"text": "Other (write your own action)", "next_scene": "custom_action"}
+]
+TOKENS = {"scene_signal": 10, "scene_ground": 7}
+
+
+def play(state, option):
+    return dict(state, current_scene=option["next_scene"]), {"narrative": option["text"]}, TOKENS[option["next_scene"]]
+
+
+class Running:
+    """A run_branch whose branches are known to have started before the test goes on"""
+
+    def __init__(self):
+        self.started = []
+
+    def __call__(self, state, option):
+        self.started.append(option["next_scene"])
+        return play(state, option)
+
+    def wait(self, count):
+        eventually(lambda: len(self.started) >= count)
+
+
+def eventually(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition never held"
+        time.sleep(0.005)
+
+
+def test_only_shared_options_are_speculated():
+    speculator = Speculator(play, branches=3, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    assert speculator.stats()["speculated"] == 2
+
+
+def test_claim_hits_once_and_only_once():
+    speculator = Speculator(play, branches=2, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    claimed = speculator.claim("s1", STATE, OPTIONS[0])
+    new_state, result = claimed.result(timeout=2)
+    assert new_state["current_scene"] == "scene_signal"
+    assert result == {"narrative": "Follow the signal"}
+    assert speculator.claim("s1", STATE, OPTIONS[0]) is None
+    stats = speculator.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 0)
+
+
+def test_siblings_of_a_claimed_branch_are_wasted():
+    running = Running()
+    speculator = Speculator(running, branches=2, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    running.wait(2)
+    speculator.claim("s1", STATE, OPTIONS[0]).result(timeout=2)
+    eventually(lambda: speculator.stats()["wasted_tokens"] == TOKENS["scene_ground"])
+    stats = speculator.stats()
+    assert stats["used_tokens"] == TOKENS["scene_signal"]
+    eventually(lambda: speculator.stats()["inflight"] == 0)
+
+
+def test_branches_from_an_older_state_are_discarded():
+    running = Running()
+    speculator = Speculator(running, branches=2, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    running.wait(2)
+    moved_on = dict(STATE, turn=2)
+    assert state_version(moved_on) != state_version(STATE)
+    assert speculator.claim("s1", moved_on, OPTIONS[0]) is None
+    assert speculator.stats()["misses"] == 1
+    eventually(lambda: speculator.stats()["wasted_tokens"] == sum(TOKENS.values()))
+    # Nothing is left to claim, even for the state it was started from
+    assert speculator.claim("s1", STATE, OPTIONS[0]) is None
+
+
+def test_new_turn_replaces_the_sessions_branches():
+    running = Running()
+    speculator = Speculator(running, branches=1, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    running.wait(1)
+    speculator.speculate("s1", dict(STATE, turn=2), OPTIONS)
+    eventually(lambda: speculator.stats()["wasted_tokens"] == TOKENS["scene_signal"])
+    assert speculator.stats()["sessions"] == 1
+
+
+def test_budget_and_busy_servers_skip_speculation():
+    release = threading.Event()
+
+    def slow(state, option):
+        release.wait(2)
+        return play(state, option)
+
+    speculator = Speculator(slow, branches=2, max_inflight=1)
+    speculator.speculate("s1", STATE, OPTIONS)
+    assert speculator.stats()["skipped_budget"] == 1
+    release.set()
+    eventually(lambda: speculator.stats()["inflight"] == 0)
+
+    busy = Speculator(play, branches=2, max_inflight=8, spare_capacity=lambda: False)
+    busy.speculate("s1", STATE, OPTIONS)
+    stats = busy.stats()
+    assert (stats["speculated"], stats["skipped_busy"], stats["sessions"]) == (0, 1, 0)
+
+
+def test_failed_branch_is_a_claimed_error():
+    def failing(state, option):
+        raise RuntimeError("speculative turn failed")
+
+    speculator = Speculator(failing, branches=1, max_inflight=8)
+    speculator.speculate("s1", STATE, OPTIONS)
+    claimed = speculator.claim("s1", STATE, OPTIONS[0])
+    assert isinstance(claimed.exception(timeout=2), RuntimeError)
+
+
+def test_async_branches_are_tasks_and_wasted_ones_are_cancelled():
+    cancelled = []
+
+    async def play_async(state, option):
+        try:
+            await asyncio.sleep(0 if option["next_scene"] == "scene_signal" else 10)
+        except asyncio.CancelledError:
+            cancelled.append(option["next_scene"])
+            raise
+        return play(state, option)
+
+    async def scenario():
+        speculator = AsyncSpeculator(play_async, branches=2, max_inflight=8)
+        speculator.speculate("s1", STATE, OPTIONS)
+        await asyncio.sleep(0.01)
+        claimed = speculator.claim("s1", STATE, OPTIONS[0])
+        new_state, _ = await asyncio.wrap_future(claimed)
+        await asyncio.sleep(0.01)
+        return speculator.stats(), new_state
+
+    stats, new_state = asyncio.run(scenario())
+    assert new_state["current_scene"] == "scene_signal"
+    assert cancelled == ["scene_ground"]
+    assert (stats["hits"], stats["inflight"], stats["used_tokens"], stats["wasted_tokens"]) == (1, 0, 10, 0)
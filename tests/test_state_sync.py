@@ -0,0 +1,46 @@
+from state_sync import apply_delta, state_delta
+
+FIELDS = {
+    "current_scene": "start",
+    "inventory": [],
+    "player_stats": {"health": 100, "courage": 50, "wisdom": 50},
+    "visited_locations": ["start"]
+}
+
+
+def test_first_delta_sets_every_field():
+    delta, _ = state_delta(None, FIELDS)
+    assert delta == {"set": FIELDS, "append": {}}
+
+
+def test_unchanged_fields_send_nothing():
+    _, synced = state_delta(None, FIELDS)
+    delta, again = state_delta(synced, FIELDS)
+    assert delta == {"set": {}, "append": {}}
+    assert again == synced
+
+
+def test_grown_list_sends_only_the_new_items():
+    _, synced = state_delta(None, FIELDS)
+    fields = dict(FIELDS, visited_locations=["start", "scene_bunker_escape_route"], current_scene="scene_x")
+    delta, _ = state_delta(synced, fields)
+    assert delta == {"set": {"current_scene": "scene_x"}, "append": {"visited_locations": ["scene_bunker_escape_route"]}}
+    assert apply_delta(FIELDS, delta) == fields
+
+
+def test_rewritten_list_is_sent_whole():
+    _, synced = state_delta(None, dict(FIELDS, inventory=["shield", "comm"]))
+    fields = dict(FIELDS, inventory=["comm", "shield", "tesseract"])
+    delta, _ = state_delta(synced, fields)
+    assert delta["set"] == {"inventory": fields["inventory"]}
+    assert delta["append"] == {}
+
+
+def test_client_follows_a_run_of_deltas():
+    client, synced, fields = {}, None, dict(FIELDS)
+    for turn in range(5):
+        fields = dict(fields, visited_locations=fields["visited_locations"] + [f"scene_{turn}"],
+                      player_stats=dict(fields["player_stats"], courage=50 + turn))
+        delta, synced = state_delta(synced, fields)
+        client = apply_delta(client, delta)
+        assert client == fields
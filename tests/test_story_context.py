@@ -0,0 +1,110 @@
+import sys
+import warnings
+
+import pytest
+
+import story_context
+from story_context import StoryContext, count_tokens, keep_last_tokens
+
+PREMISE = "You wake on the shore of a drowned kingdom."
+
+
+def turn(number):
+    return f"Turn {number}: the hero crossed the bridge, fought the troll and found a silver key."
+
+
+def played(turns, **budgets):
+    context = StoryContext(PREMISE, **budgets)
+    for number in range(turns):
+        context.add(turn(number))
+    return context
+
+
+def test_recent_turns_stay_verbatim_until_over_budget():
+    context = played(2, recent_budget=400)
+    assert not context.needs_fold()
+    assert context.fold_prompt() is None
+    assert context.render() == " ".join([PREMISE, turn(0), turn(1)])
+
+
+def test_fold_prompt_sends_only_the_summary_and_the_evicted_turns():
+    context = played(12, summary_budget=100, recent_budget=120)
+    context.summary = "The hero set out."
+    assert context.needs_fold()
+    prompt = context.fold_prompt()
+    assert "The hero set out." in prompt
+    assert turn(0) in prompt
+    # The newest turns stay in the recent tier and out of the prompt
+    assert turn(11) not in prompt
+    assert PREMISE not in prompt
+
+
+def test_fold_evicts_down_to_half_the_recent_budget():
+    context = played(12, summary_budget=100, recent_budget=120)
+    prompts = []
+
+    def summarize(prompt):
+        prompts.append(prompt)
+        return "A short summary."
+
+    context.fold(summarize)
+    assert len(prompts) == 1
+    assert context.summary == "A short summary."
+    assert sum(count_tokens(event) for event in context.recent) <= 60
+    assert context.recent[-1] == turn(11)
+    # Within budget again, so another fold is a no-op
+    context.fold(summarize)
+    assert len(prompts) == 1
+
+
+def test_failed_fold_keeps_the_evicted_turns_trimmed_to_the_summary_budget():
+    context = played(12, summary_budget=30, recent_budget=120)
+    context.fold(lambda prompt: None)
+    assert context.summary
+    assert count_tokens(context.summary) <= 30
+    assert turn(0) not in context.render()
+
+
+def test_context_stays_within_budget_however_long_the_session():
+    context = StoryContext(PREMISE, summary_budget=50, recent_budget=100)
+    for number in range(200):
+        context.add(turn(number))
+        context.fold(lambda prompt: None)
+    # A few tokens of slack for the spaces render() joins the tiers with
+    assert context.tokens() <= count_tokens(PREMISE) + 50 + 100 + 5
+    assert context.recent[-1] == turn(199)
+
+
+def test_keep_last_tokens_keeps_the_end():
+    text = " ".join(f"word{number}" for number in range(100))
+    trimmed = keep_last_tokens(text, 10)
+    assert count_tokens(trimmed) <= 10
+    assert trimmed.endswith("word99")
+    assert keep_last_tokens(text, 0) == ""
+    assert keep_last_tokens("short", 10) == "short"
+
+
+def test_round_trips_and_rebuilds_old_saves():
+    context = played(3)
+    context.summary = "Earlier."
+    restored = StoryContext.from_dict(PREMISE, context.to_dict())
+    assert restored.render() == context.render()
+    old = StoryContext.from_text(PREMISE, f"{PREMISE} The hero found a key.")
+    assert old.recent == ["The hero found a key."]
+    assert old.premise == PREMISE
+
+
+@pytest.fixture
+def no_tiktoken(monkeypatch):
+    monkeypatch.setattr(story_context, "_encoding", None)
+    monkeypatch.setattr(story_context, "_encoding_loaded", False)
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+
+
+def test_missing_tiktoken_warns_once_and_estimates(no_tiktoken):
+    with warnings.catch_warnings(record=True) as caught:
+        warnings.simplefilter("always")
+        assert count_tokens("The hero crossed the bridge.") == 6
+        assert count_tokens("Again.") == 2
+    assert [str(w.message).startswith("tiktoken unavailable") for w in caught] == [True]
+    assert caught[0].category is RuntimeWarning
@@ -0,0 +1,98 @@
+import asyncio
+import json
+import threading
+
+import app1
+import app_async
+from app1 import AI_ERROR_TEXT, sse_event
+from bench_load import parse_sse
+
+RESULT_EVENTS = ["scene_description", "options", "game_state", "done"]
+
+
+def frames(text):
+    """(event, data) for each SSE frame in a response body"""
+    parsed = []
+    for frame in text.split("\n\n"):
+        if not frame:
+            continue
+        event, data = frame.split("\n")
+        assert event.startswith("event: ") and data.startswith("data: ")
+        parsed.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return parsed
+
+
+def event_names(parsed):
+    """The events in order, with a run of tokens as one"""
+    names = []
+    for event, _ in parsed:
+        if not (event == "token" and names and names[-1] == "token"):
+            names.append(event)
+    return names
+
+
+def test_sse_event_is_one_frame_whatever_the_text():
+    frame = sse_event("token", {"text": "Line one\n\nLine two"})
+    assert frame == 'event: token\ndata: {"text": "Line one\\n\\nLine two"}\n\n'
+    assert frames(frame) == [("token", {"text": "Line one\n\nLine two"})]
+
+
+def test_flask_stream_sends_tokens_then_the_rest_of_the_turn():
+    response = app1.app.test_client().post("/start_game_stream", json={})
+    assert response.status_code == 200
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["X-Accel-Buffering"] == "no"
+    parsed = frames(response.get_data(as_text=True))
+    assert event_names(parsed) == ["session", "token"] + RESULT_EVENTS
+    # The narrative arrives in pieces, not as one event at the end
+    assert sum(event == "token" for event, _ in parsed) > 1
+    turn = parse_sse(response.get_data(as_text=True).split("\n"))
+    assert turn["narrative"] == "".join(data["text"] for event, data in parsed if event == "token")
+    assert len(turn["options"]) >= 2 and "session_id" in turn and "turn" in turn
+
+
+def test_async_stream_sends_the_same_events():
+    async def stream():
+        async with app_async.app.test_app() as test_app:
+            response = await test_app.test_client().post("/start_game_stream", json={})
+            return response.status_code, await response.get_data(as_text=True)
+
+    status, text = asyncio.run(stream())
+    assert status == 200
+    parsed = frames(text)
+    assert event_names(parsed) == ["session", "token"] + RESULT_EVENTS
+    assert sum(event == "token" for event, _ in parsed) > 1
+
+
+def test_first_token_is_sent_before_the_turn_is_complete(monkeypatch):
+    released = threading.Event()
+    complete_turn = app1.complete_turn
+
+    def held(*args, **kwargs):
+        assert released.wait(5)
+        return complete_turn(*args, **kwargs)
+
+    monkeypatch.setattr(app1, "complete_turn", held)
+    response = app1.app.test_client().post("/start_game_stream", json={}, buffered=False)
+    chunks = iter(response.response)
+    seen = ""
+    while "event: token" not in seen:
+        seen += next(chunks).decode("utf-8")
+    # The narrative is streaming while the rest of the turn is still being generated
+    assert "event: options" not in seen
+    released.set()
+    rest = b"".join(chunks).decode("utf-8")
+    response.close()
+    assert event_names(frames(seen + rest))[-len(RESULT_EVENTS):] == RESULT_EVENTS
+
+
+def test_failed_narrative_stream_ends_with_an_error_event(monkeypatch):
+    def failing(prompt, temperature=0.7, stage="other"):
+        yield "The hero "
+        yield AI_ERROR_TEXT
+
+    monkeypatch.setattr(app1, "stream_ai_content", failing)
+    response = app1.app.test_client().post("/start_game_stream", json={})
+    parsed = frames(response.get_data(as_text=True))
+    assert event_names(parsed) == ["session", "token", "error"]
+    assert "error" in parse_sse(response.get_data(as_text=True).split("\n"))
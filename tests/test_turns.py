@@ -0,0 +1,47 @@
+import app1
+from app1 import MULTI_CALL_ROUND_TRIPS, OPENING_CHOICE, GameState, turn_stats
+from resilience import Attempt
+
+AI_PROMPT = "Create an action-packed opening for a Marvel superhero origin."
+
+
+def test_structured_turn_is_one_round_trip():
+    before = dict(turn_stats)
+    result = app1.generate_narrative(GameState(), OPENING_CHOICE, AI_PROMPT)
+    assert not app1.turn_failed(result)
+    assert len(result["options"]) >= 2
+    assert turn_stats["structured_turns"] == before["structured_turns"] + 1
+    assert turn_stats["fallback_turns"] == before["fallback_turns"]
+
+
+def test_unparseable_structured_reply_falls_back_to_multi_call(monkeypatch):
+    structured = app1.generate_structured_content
+
+    def garbled(prompt, schema, name, temperature=0.7, stage="structured"):
+        if stage == "turn":
+            return None
+        return structured(prompt, schema, name, temperature, stage)
+
+    monkeypatch.setattr(app1, "generate_structured_content", garbled)
+    before = dict(turn_stats)
+    result = app1.generate_narrative(GameState(), OPENING_CHOICE, AI_PROMPT)
+    assert not app1.turn_failed(result)
+    # The failed structured attempt counts against the fallback
+    assert result["round_trips_saved"] == MULTI_CALL_ROUND_TRIPS - (MULTI_CALL_ROUND_TRIPS + 1)
+    assert turn_stats["fallback_turns"] == before["fallback_turns"] + 1
+    assert turn_stats["round_trips_saved"] == before["round_trips_saved"] - 1
+
+
+def test_failed_call_serves_the_error_turn_without_the_chain(monkeypatch):
+    calls = []
+
+    def failing(stage, **request):
+        calls.append(stage)
+        return Attempt("test-model", error=RuntimeError("upstream down"))
+
+    monkeypatch.setattr(app1, "call_llm", failing)
+    before = dict(turn_stats)
+    result = app1.generate_narrative(GameState(), OPENING_CHOICE, AI_PROMPT)
+    assert result == app1.error_turn()
+    assert calls == ["turn"]
+    assert turn_stats["fallback_turns"] == before["fallback_turns"]
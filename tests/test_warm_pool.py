@@ -0,0 +1,131 @@
+import asyncio
+import itertools
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+import app1
+from warm_pool import AsyncWarmPool, WarmPool
+
+
+def counter():
+    numbers = itertools.count(1)
+    return lambda: {"number": next(numbers)}
+
+
+def eventually(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition never held"
+        time.sleep(0.005)
+
+
+def save(path, items, fingerprint="f", created_at=None):
+    created_at = time.time() if created_at is None else created_at
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"fingerprint": fingerprint, "items": [{"created_at": created_at, "item": item} for item in items]}, f)
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def base(tmp_path):
+    return str(tmp_path / "pool.json")
+
+
+def test_pool_fills_to_target_and_refills_after_pops(base):
+    pool = WarmPool(counter(), base, target=3, low_water=1, fingerprint="f")
+    assert not pool.started and pool.pop() is None
+    pool.start()
+    eventually(lambda: pool.stats()["size"] == 3)
+    assert [pool.pop(), pool.pop()] == [{"number": 1}, {"number": 2}]
+    eventually(lambda: pool.stats()["size"] == 3)
+    stats = pool.stats()
+    assert (stats["hits"], stats["misses"], stats["generated"]) == (2, 1, 5)
+
+
+def test_each_worker_saves_to_its_own_file(base):
+    pool = WarmPool(counter(), base, target=2, low_water=0, fingerprint="f")
+    pool.start()
+    own = f"{base}.{os.getpid()}"
+    eventually(lambda: os.path.exists(own) and len(json.load(open(own))["items"]) == 2)
+    assert not os.path.exists(base)
+
+
+def test_start_adopts_files_no_live_worker_owns(base):
+    save(base, [{"from": "shared file"}])
+    save(f"{base}.{dead_pid()}", [{"from": "dead worker"}])
+    save(f"{base}.{os.getpid()}", [{"from": "this pid, last run"}])
+    live = f"{base}.{os.getppid()}"
+    save(live, [{"from": "live worker"}])
+
+    pool = WarmPool(lambda: {"from": "generated"}, base, target=3, low_water=0, fingerprint="f")
+    pool.start()
+    adopted = [pool.pop() for _ in range(3)]
+    assert sorted(item["from"] for item in adopted) == ["dead worker", "shared file", "this pid, last run"]
+    # The live worker's entries are never handed out twice
+    assert os.path.exists(live)
+    assert not os.path.exists(base)
+
+
+def test_entries_for_other_prompts_or_too_old_are_dropped(base):
+    save(f"{base}.{dead_pid()}", [{"from": "old prompts"}], fingerprint="other")
+    save(base, [{"from": "stale"}], created_at=time.time() - 7200)
+    pool = WarmPool(lambda: {"from": "generated"}, base, target=1, low_water=0, fingerprint="f", max_age=3600)
+    pool.start()
+    eventually(lambda: pool.stats()["generated"] == 1)
+    assert pool.pop() == {"from": "generated"}
+
+
+def test_failed_generation_banks_nothing(base, monkeypatch):
+    monkeypatch.setattr("warm_pool.time.sleep", lambda seconds: None)
+
+    def failing():
+        raise RuntimeError("opening generation failed")
+
+    pool = WarmPool(failing, base, target=2, low_water=0)
+    pool.start()
+    time.sleep(0.05)
+    assert pool.stats()["size"] == 0 and pool.pop() is None
+
+
+def test_async_pool_refills_on_the_event_loop(base):
+    numbers = itertools.count(1)
+
+    async def generate():
+        await asyncio.sleep(0)
+        return {"number": next(numbers)}
+
+    async def scenario():
+        pool = AsyncWarmPool(generate, base, target=2, low_water=1, fingerprint="f")
+        pool.start()
+        for _ in range(100):
+            if pool.stats()["size"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        first = pool.pop()
+        for _ in range(100):
+            if pool.stats()["size"] == 2:
+                break
+            await asyncio.sleep(0.01)
+        return first, pool.stats()
+
+    first, stats = asyncio.run(scenario())
+    assert first == {"number": 1}
+    assert (stats["size"], stats["generated"]) == (2, 3)
+
+
+def test_openings_that_end_the_story_are_not_banked(monkeypatch):
+    monkeypatch.setattr(app1, "generate_opening", lambda game_state: {"narrative": "The end.", "is_ending": True})
+    with pytest.raises(RuntimeError):
+        app1.pregenerate_opening()
+    monkeypatch.setattr(app1, "generate_opening", lambda game_state: {"narrative": "Go.", "is_ending": False})
+    assert app1.pregenerate_opening()["result"]["narrative"] == "Go."
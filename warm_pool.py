@@ -0,0 +1,215 @@
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class WarmPool:
+    """
+    A pool of pre-generated items kept topped up by a background thread.
+
+    pop() is O(1) and never waits on generation. Whenever the pool drops to
+    `low_water` the refiller wakes up and generates until it holds `target`
+    items again. The pool is written to `path` so it survives restarts;
+    entries made with a different `fingerprint` (e.g. after a prompt change)
+    or older than `max_age` seconds are thrown away.
+
+    Every worker process keeps its own file, `path` + "." + its pid, so no
+    two workers ever hand out the same entry. start() adopts the files of
+    processes that are gone, claiming each by renaming it, so a restart
+    serves what the old workers left and only one worker gets each file.
+    """
+
+    def __init__(self, generate: Callable[[], Dict[str, Any]], path: Optional[str],
+                 target: int, low_water: int, fingerprint: str = "", max_age: float = 86400):
+        self.generate = generate
+        self.path = path
+        self.target = target
+        self.low_water = min(low_water, target)
+        self.fingerprint = fingerprint
+        self.max_age = max_age
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._dirty = False
+        # The refiller: a thread here, a task on the event loop for AsyncWarmPool
+        self._refiller: Any = None
+        # Set by start(), in the worker that serves the pool rather than a parent that forks it
+        self._own_path: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+
+    @property
+    def started(self) -> bool:
+        return self._refiller is not None
+
+    def start(self) -> None:
+        """Load the saved pool and start the refiller (idempotent)"""
+        if self.target <= 0:
+            return
+        with self._lock:
+            if self._refiller is not None:
+                return
+            if self.path:
+                self._own_path = f"{self.path}.{os.getpid()}"
+                self._load()
+            self._refiller = self._start_refiller()
+        self._wake.set()
+
+    def pop(self) -> Optional[Dict[str, Any]]:
+        """Take a ready item, or None if the pool is empty"""
+        now = time.time()
+        with self._lock:
+            item = None
+            while self._items:
+                entry = self._items.popleft()
+                self._dirty = True
+                if now - entry["created_at"] <= self.max_age:
+                    item = entry["item"]
+                    break
+            if item is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            low = len(self._items) <= self.low_water
+        if low or self._dirty:
+            self._wake.set()
+        return item
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._items),
+                "target": self.target,
+                "low_water": self.low_water,
+                "hits": self.hits,
+                "misses": self.misses,
+                "generated": self.generated
+            }
+
+    def _start_refiller(self) -> Any:
+        thread = threading.Thread(target=self._refill_forever, name="warm-pool", daemon=True)
+        thread.start()
+        return thread
+
+    def _refill_forever(self) -> None:
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            self._save_if_dirty()
+            refill = self._low()
+            while refill:
+                try:
+                    item = self.generate()
+                except Exception as e:
+                    print(f"Error pre-generating pool item: {str(e)}")
+                    time.sleep(5)
+                    break
+                refill = self._add(item)
+                self._save_if_dirty()
+
+    def _low(self) -> bool:
+        with self._lock:
+            return len(self._items) <= self.low_water
+
+    def _add(self, item: Dict[str, Any]) -> bool:
+        """Bank a generated item; returns whether the pool still wants more"""
+        with self._lock:
+            self._items.append({"created_at": time.time(), "item": item})
+            self.generated += 1
+            self._dirty = True
+            return len(self._items) < self.target
+
+    def _orphaned_files(self) -> List[str]:
+        """Pool files no live worker owns: the shared file older versions wrote, dead workers' files, ours"""
+        found = [self.path] if os.path.exists(self.path) else []
+        for candidate in glob.glob(glob.escape(self.path) + ".*"):
+            suffix = candidate[len(self.path) + 1:]
+            # A restarted container often reuses the pid; that file is ours from last time
+            if suffix.isdigit() and (int(suffix) == os.getpid() or not _alive(int(suffix))):
+                found.append(candidate)
+        return found
+
+    def _load(self) -> None:
+        now = time.time()
+        for path in self._orphaned_files():
+            claimed = f"{self._own_path}.claim"
+            try:
+                # Whoever renames the file first owns its entries
+                os.replace(path, claimed)
+            except OSError:
+                continue
+            try:
+                with open(claimed, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Ignoring unreadable pool file {path}: {str(e)}")
+                data = {}
+            finally:
+                os.remove(claimed)
+            if data.get("fingerprint") != self.fingerprint:
+                continue
+            self._items.extend(
+                entry for entry in data.get("items", []) if now - entry.get("created_at", 0) <= self.max_age
+            )
+            self._dirty = True
+
+    def _save_if_dirty(self) -> None:
+        if not self._own_path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            data = {"fingerprint": self.fingerprint, "items": list(self._items)}
+        # Write then rename so a crash never leaves a half-written pool
+        tmp_path = f"{self._own_path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self._own_path)
+        except OSError as e:
+            print(f"Error saving pool file {self._own_path}: {str(e)}")
+
+
+class AsyncWarmPool(WarmPool):
+    """
+    Same pool for a single event loop: `generate` is a coroutine function and
+    the refiller a task on the loop, so its calls take the loop's admission
+    slots like any live turn. start() must be called on that loop.
+    """
+
+    def _start_refiller(self) -> Any:
+        self._wake = asyncio.Event()
+        return asyncio.ensure_future(self._arefill_forever())
+
+    async def _arefill_forever(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            await asyncio.to_thread(self._save_if_dirty)
+            refill = self._low()
+            while refill:
+                try:
+                    item = await self.generate()
+                except Exception as e:
+                    print(f"Error pre-generating pool item: {str(e)}")
+                    await asyncio.sleep(5)
+                    break
+                refill = self._add(item)
+                await asyncio.to_thread(self._save_if_dirty)